@@ -222,10 +222,10 @@ CREATE INDEX IF NOT EXISTS idx_tasks_user_cycle_status ON tasks(user_id, cycle_i
 
 
 def upgrade() -> None:
-    # Execute DDL statement-by-statement (works across drivers).
-    stmts = [s.strip() for s in DDL.split(";") if s.strip()]
-    for s in stmts:
-        op.execute(s + ";")
+    # Send the whole script as one simple-query batch: PostgreSQL accepts
+    # multi-statement text without bound params, and a naive split(";") would
+    # break any statement that carries a literal semicolon.
+    op.execute(DDL)
 
 
 def downgrade() -> None:
@@ -364,6 +364,7 @@ def _categorize_captcha_error(err_msg: str) -> Dict[str, str]:
 
 
 def _runtime_sync_event_detail(scope: str, user_id: int = 0) -> Dict[str, Any]:
+    db.flush_write_behind()
     conn = db._conn()
     try:
         params: List[Any] = [f"RUNTIME_SYNC_{str(scope or '').strip().upper()}_%"]
@@ -2248,6 +2249,22 @@ def admin_rebuild_review_state(req: Request, authorization: Optional[str] = Head
     return {"ok": True, **summary}
 
 
+@app.post("/admin/maintenance/reindex")
+def admin_reindex(req: Request, authorization: Optional[str] = Header(None)):
+    ctx = _auth_ctx(req, authorization)
+    if str(ctx["user"].get("role")) != "admin":
+        raise HTTPException(status_code=403, detail="forbidden: admin only")
+
+    summary = db.ensure_deferred_task_indexes()
+    db.log_sys_event(
+        "DB_REINDEX",
+        ctx["user"].get("id"),
+        "Admin triggered deferred index build",
+        summary,
+    )
+    return {"ok": not summary.get("errors"), **summary}
+
+
 @app.get("/admin/pools")
 def legacy_get_admin_pools(req: Request, authorization: Optional[str] = Header(None)):
     ctx = _auth_ctx(req, authorization)
@@ -3016,7 +3033,7 @@ def issue_token(req: Request, body: TokenRequest):
             env_user = os.environ.get("SHEEP_COMPUTE_USER", "").strip()
             env_pass = os.environ.get("SHEEP_COMPUTE_PASS", "").strip()
             if env_user and env_pass and body.username == env_user and body.password == env_pass:
-                u = db.get_user_by_username(env_user)
+                u = db.get_user_by_username(env_user, use_cache=False)
                 if not u:
                     from sheep_platform_security import hash_password
                     pw_str = hash_password(env_pass)
@@ -3024,12 +3041,7 @@ def issue_token(req: Request, body: TokenRequest):
                     db.create_user(env_user, pw_str, role="admin")
                     u = db.get_user_by_username(env_user)
                 else:
-                    _conn = db._conn()
-                    try:
-                        _conn.execute("UPDATE users SET role = 'admin', run_enabled = 1, disabled = 0 WHERE id = ?", (u["id"],))
-                        _conn.commit()
-                    finally:
-                        _conn.close()
+                    db.set_user_admin(int(u["id"]), run_enabled=True)
                     u = db.get_user_by_username(env_user)
                 
                 token = db.create_api_token(int(u["id"]), ttl_seconds=int(body.ttl_seconds), name="compute")
@@ -4124,23 +4124,15 @@ def _init_once() -> None:
 
     try:
         uname_norm = normalize_username(admin_username)
-        row = db.get_user_by_username(uname_norm)
+        row = db.get_user_by_username(uname_norm, use_cache=False)
     except Exception:   
         row = None
 
     try:
         if row:
-            conn = db._conn()
-            try:
-                # Keep the bootstrap admin account enabled, but do not rotate passwords implicitly.
-                conn.execute(
-                    "UPDATE users SET role = 'admin', disabled = 0 WHERE id = ?",
-                    (int(row["id"]),),
-                )
-                conn.commit()
-                db.log_sys_event("BOOTSTRAP", None, "已確認管理員帳號存在並啟用", {"username": admin_username})
-            finally:
-                conn.close()
+            # Keep the bootstrap admin account enabled, but do not rotate passwords implicitly.
+            db.set_user_admin(int(row["id"]))
+            db.log_sys_event("BOOTSTRAP", None, "已確認管理員帳號存在並啟用", {"username": admin_username})
         else:
             pw_hash = hash_password(admin_password)
             pw_hash_str = pw_hash.decode('utf-8') if isinstance(pw_hash, bytes) else str(pw_hash)
@@ -8406,27 +8398,28 @@ def _import_weekly_report_csv(uploaded_file) -> Dict[str, Any]:
                 week_end_ts = week_start_ts
 
         eligible = return_pct > 0.0
-        db.create_weekly_check(
+        st_row = None
+        amount = 0.0
+        if eligible and capital_usdt > 0.0 and payout_rate > 0.0:
+            st_row = db.get_strategy_with_params(strategy_id)
+            if st_row:
+                alloc = float(st_row.get("allocation_pct") or 0.0) / 100.0
+                amount = capital_usdt * (return_pct / 100.0) * alloc * payout_rate
+
+        # 檢查紀錄、停權與發放合併成單一交易
+        db.record_weekly_settlement(
             strategy_id=strategy_id,
+            user_id=int((st_row or {}).get("user_id") or 0),
             week_start_ts=week_start_ts,
             week_end_ts=week_end_ts,
             return_pct=return_pct,
             max_drawdown_pct=max_dd,
             trades=trades,
             eligible=eligible,
+            payout_amount_usdt=float(amount),
         )
-
-        if not eligible:
-            db.set_strategy_status(strategy_id, "disqualified")
-
-        if eligible and capital_usdt > 0.0 and payout_rate > 0.0:
-            st_row = db.get_strategy_with_params(strategy_id)
-            if not st_row:
-                continue
-            alloc = float(st_row.get("allocation_pct") or 0.0) / 100.0
-            amount = capital_usdt * (return_pct / 100.0) * alloc * payout_rate
-            if amount > 0.0 and not db.payout_exists(strategy_id, week_start_ts):
-                db.create_payout(strategy_id=strategy_id, user_id=int(st_row["user_id"]), week_start_ts=week_start_ts, amount_usdt=float(amount))
+        if eligible and capital_usdt > 0.0 and payout_rate > 0.0 and not st_row:
+            continue
 
         applied += 1
 
@@ -8486,25 +8479,23 @@ def _run_weekly_check(week_start_ts: str, week_end_ts: str) -> None:
         trades = int(res.get("trades") or 0)
 
         eligible = ret > 0.0
-        db.create_weekly_check(
+        amount = 0.0
+        if eligible and capital_usdt > 0.0 and payout_rate > 0.0:
+            alloc = float(s.get("allocation_pct") or 0.0) / 100.0
+            amount = capital_usdt * (ret / 100.0) * alloc * payout_rate
+
+        # 檢查紀錄、停權與發放合併成單一交易（一次 fsync）
+        db.record_weekly_settlement(
             strategy_id=int(s["id"]),
+            user_id=int(s["user_id"]),
             week_start_ts=week_start_ts,
             week_end_ts=week_end_ts,
             return_pct=ret,
             max_drawdown_pct=dd,
             trades=trades,
             eligible=eligible,
+            payout_amount_usdt=float(amount),
         )
-
-        if not eligible:
-            db.set_strategy_status(int(s["id"]), "disqualified")
-
-        amount = 0.0
-        if eligible and capital_usdt > 0.0 and payout_rate > 0.0:
-            alloc = float(s.get("allocation_pct") or 0.0) / 100.0
-            amount = capital_usdt * (ret / 100.0) * alloc * payout_rate
-            if amount > 0.0 and not db.payout_exists(int(s["id"]), week_start_ts):
-                db.create_payout(strategy_id=int(s["id"]), user_id=int(s["user_id"]), week_start_ts=week_start_ts, amount_usdt=float(amount))
         time.sleep(0.005) # 釋放 GIL，防止管理員背景結算癱瘓主執行緒
 
 
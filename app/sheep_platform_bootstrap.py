@@ -14,24 +14,15 @@ def _provision_compute_admin() -> None:
     password = str(os.environ.get("SHEEP_COMPUTE_PASS", "") or "").strip()
     if not user or not password:
         return
-    from sheep_platform_security import hash_password, normalize_username
+    from sheep_platform_security import hash_password
 
-    user_norm = normalize_username(user)
-    existing = db.get_user_by_username(user)
+    existing = db.get_user_by_username(user, use_cache=False)
     pw_hashed = hash_password(password)
     pw_text = pw_hashed.decode("utf-8") if isinstance(pw_hashed, bytes) else str(pw_hashed)
     if not existing:
         db.create_user(user, pw_text, role="admin")
         return
-    conn = db._conn()
-    try:
-        conn.execute(
-            "UPDATE users SET role = 'admin', run_enabled = 1, disabled = 0 WHERE username_norm = ?",
-            (user_norm,),
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    db.set_user_admin(int(existing.get("id") or 0), run_enabled=True)
 
 
 def _rebuild_review_state() -> None:
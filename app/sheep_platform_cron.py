@@ -88,25 +88,23 @@ def run_weekly_check(week_start_ts: str, week_end_ts: str) -> None:
         trades = int(res.get("trades") or 0)
 
         eligible = ret > 0.0
-        db.create_weekly_check(
+        amount = 0.0
+        if eligible and capital_usdt > 0.0 and payout_rate > 0.0:
+            alloc = float(s.get("allocation_pct") or 0.0) / 100.0
+            amount = capital_usdt * (ret / 100.0) * alloc * payout_rate
+
+        db.record_weekly_settlement(
             strategy_id=int(s["id"]),
+            user_id=int(s["user_id"]),
             week_start_ts=week_start_ts,
             week_end_ts=week_end_ts,
             return_pct=ret,
             max_drawdown_pct=dd,
             trades=trades,
             eligible=eligible,
+            payout_amount_usdt=float(amount),
         )
 
-        if not eligible:
-            db.set_strategy_status(int(s["id"]), "disqualified")
-
-        if eligible and capital_usdt > 0.0 and payout_rate > 0.0:
-            alloc = float(s.get("allocation_pct") or 0.0) / 100.0
-            amount = capital_usdt * (ret / 100.0) * alloc * payout_rate
-            if amount > 0.0:
-                db.create_payout(strategy_id=int(s["id"]), user_id=int(s["user_id"]), week_start_ts=week_start_ts, amount_usdt=float(amount))
-
 
 def main() -> None:
     parser = argparse.ArgumentParser()
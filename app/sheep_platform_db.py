@@ -7,11 +7,13 @@ import math
 import html
 import base64
 import atexit
+import queue
 import socket
 import hashlib
+from functools import lru_cache
 from urllib.parse import urlparse, urlunparse
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import sys as _sys
 db = _sys.modules[__name__]
@@ -46,6 +48,86 @@ try:
 except Exception:
     psycopg2 = None
 
+# --- 熱路徑 JSON 編解碼（有 orjson 就用，沒有退回標準庫） ---
+def _has_non_finite(obj: Any) -> bool:
+    """是否含 NaN/Infinity：orjson 會把它們寫成 null，json.dumps 則寫成 NaN/Infinity"""
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(_has_non_finite(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(_has_non_finite(v) for v in obj)
+    return False
+
+
+try:
+    import orjson as _orjson
+
+    def _fast_json_loads(text: Any) -> Any:
+        try:
+            return _orjson.loads(text)
+        except Exception:
+            # orjson 不接受 NaN/Infinity，但 json.dumps 預設會寫出來；遇到就退回標準庫解析
+            return json.loads(text)
+
+    def _fast_json_line(obj: Any) -> bytes:
+        """序列化成單行 JSON（含結尾換行），給 JSONL 追加寫入用"""
+        try:
+            out = _orjson.dumps(obj, option=_orjson.OPT_SERIALIZE_NUMPY | _orjson.OPT_APPEND_NEWLINE, default=str)
+        except Exception:
+            return (json.dumps(obj, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        # 輸出有 null 才需要確認是不是 NaN/Infinity 被改寫成 null，一般情況不多走一趟
+        if b"null" in out and _has_non_finite(obj):
+            return (json.dumps(obj, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        return out
+
+    def _fast_json_dumps(obj: Any) -> str:
+        """序列化成緊湊 JSON 字串，給 progress_json 這類高頻欄位寫入用"""
+        try:
+            out = _orjson.dumps(obj, option=_orjson.OPT_SERIALIZE_NUMPY)
+        except Exception:
+            # 非字串 key 等 orjson 不收的型別，退回標準庫維持原本的行為
+            return json.dumps(obj, ensure_ascii=False)
+        # NaN/Infinity 交給標準庫，維持 json.dumps 原本寫出 NaN/Infinity 的格式
+        if b"null" in out and _has_non_finite(obj):
+            try:
+                return json.dumps(obj, ensure_ascii=False)
+            except Exception:
+                pass
+        return out.decode("utf-8")
+except Exception:
+
+    def _fast_json_loads(text: Any) -> Any:
+        return json.loads(text)
+
+    def _fast_json_line(obj: Any) -> bytes:
+        """序列化成單行 JSON（含結尾換行），給 JSONL 追加寫入用"""
+        return (json.dumps(obj, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+    def _fast_json_dumps(obj: Any) -> str:
+        """序列化成緊湊 JSON 字串，給 progress_json 這類高頻欄位寫入用"""
+        return json.dumps(obj, ensure_ascii=False)
+
+try:
+    import fcntl as _fcntl
+except Exception:
+    _fcntl = None
+
+
+def _fast_json_object(value: Any) -> Dict[str, Any]:
+    """與 parse_json_object 相同語意（非 dict 一律回 {}），但字串改走 _fast_json_loads"""
+    if isinstance(value, dict):
+        return dict(value)
+    if isinstance(value, (str, bytes)):
+        if not value.strip():
+            return {}
+        try:
+            parsed = _fast_json_loads(value)
+        except Exception:
+            return {}
+        return dict(parsed) if isinstance(parsed, dict) else {}
+    return {}
+
 
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
@@ -58,6 +140,12 @@ _ACTIVE_POOL_CACHE: Dict[str, Any] = {
     "ttl": 30.0,
     "lock": threading.Lock(),
 }
+# get_global_progress_snapshot 用的 Pool 清單快取（cycle_id -> (expires_at, 資料庫 scope, rows)）；Pool 異動時隨 active pool 快取一起失效
+_SNAPSHOT_POOL_CACHE: Dict[str, Any] = {
+    "values": {},
+    "ttl": 5.0,
+    "lock": threading.Lock(),
+}
 _GLOBAL_COUNTERS_CACHE: Dict[str, Any] = {
     "value": None,
     "expires_at": 0.0,
@@ -66,12 +154,53 @@ _GLOBAL_COUNTERS_CACHE: Dict[str, Any] = {
     "invalidate_throttle": 15.0,
     "lock": threading.Lock(),
 }
+# get_worker_stats_snapshot 快取（(db, window_seconds) -> (expires_at, stats)）；管理頁與 /compute/stats 多人輪詢時共用同一份
+_WORKER_STATS_CACHE: Dict[str, Any] = {
+    "values": {},
+    "ttl": 5.0,
+    "lock": threading.Lock(),
+}
 _LEADERBOARD_PG_AGG_BACKOFF: Dict[str, Any] = {
     "until": 0.0,
     "reason": "",
     "lock": threading.Lock(),
     "query_lock": threading.Lock(),
 }
+# scope 記錄快取內容來自哪個 DB（DSN 或 SQLite 路徑）；切換 DB 後舊列一律作廢，避免跨庫讀到別人的 user
+_USER_CACHE: Dict[str, Any] = {
+    "values": {},
+    "by_norm": {},
+    "scope": "",
+    "ttl": 5.0,
+    "lock": threading.Lock(),
+}
+_ACTIVE_CYCLE_CACHE: Dict[str, Any] = {
+    "value": None,
+    "expires_at": 0.0,
+    "scope": "",
+    "ttl": 10.0,
+    "rollover_checked_at": 0.0,
+    "rollover_interval": 60.0,
+    "lock": threading.Lock(),
+}
+# get_setting 短 TTL 快取，鍵為 (資料庫 scope, key)；存原始文字、set_setting 寫入中的 key 不回填
+_SETTINGS_CACHE: Dict[str, Any] = {
+    "values": {},
+    "hold": {},
+    "ttl": 5.0,
+    "lock": threading.Lock(),
+}
+# 預設頭像只在管理員改設定時變動，卻在每次裝飾 user 列時都要讀一次（值可達數百 KB），短 TTL 快取即可
+_DEFAULT_AVATAR_CACHE: Dict[str, Any] = {
+    "value": None,
+    "expires_at": 0.0,
+    "scope": "",
+    "ttl": 30.0,
+    "lock": threading.Lock(),
+}
+
+# init_db 跑完 mining_tasks lease_* 欄位的 ALTER 後才會設為 True
+_LEASE_COLS_READY = False
 
 _GLOBAL_COUNTER_TOTAL_POOL_COMBOS = "dashboard_total_strategy_pool_combo_count"
 _GLOBAL_COUNTER_GLOBAL_MINED_COMBOS = "dashboard_global_mined_combo_count"
@@ -106,6 +235,75 @@ def _invalidate_active_pool_cache(cycle_id: Optional[int] = None) -> None:
                 expires.pop(key, None)
         _ACTIVE_POOL_CACHE["values"] = values
         _ACTIVE_POOL_CACHE["expires"] = expires
+    with _SNAPSHOT_POOL_CACHE["lock"]:
+        if cycle_id is None:
+            _SNAPSHOT_POOL_CACHE["values"].clear()
+        else:
+            _SNAPSHOT_POOL_CACHE["values"].pop(int(cycle_id), None)
+
+
+def _db_cache_scope() -> str:
+    u = _db_url()
+    if u:
+        return u
+    return "sqlite:" + _db_path()
+
+
+def _user_cache_sync_scope_locked() -> None:
+    scope = _db_cache_scope()
+    if _USER_CACHE["scope"] != scope:
+        _USER_CACHE["values"].clear()
+        _USER_CACHE["by_norm"].clear()
+        _USER_CACHE["scope"] = scope
+
+
+def _user_cache_get(user_id: int) -> Optional[Dict[str, Any]]:
+    with _USER_CACHE["lock"]:
+        _user_cache_sync_scope_locked()
+        hit = _USER_CACHE["values"].get(int(user_id))
+        if not hit:
+            return None
+        expires_at, row = hit
+        if time.time() >= float(expires_at):
+            _USER_CACHE["values"].pop(int(user_id), None)
+            return None
+        return dict(row)
+
+
+def _user_cache_uid_for_norm(username_norm: str) -> int:
+    with _USER_CACHE["lock"]:
+        _user_cache_sync_scope_locked()
+        return int(_USER_CACHE["by_norm"].get(str(username_norm or "")) or 0)
+
+
+def _user_cache_put(row: Optional[Dict[str, Any]]) -> None:
+    if not row:
+        return
+    try:
+        uid = int(row.get("id") or 0)
+    except Exception:
+        return
+    if uid <= 0:
+        return
+    expires_at = time.time() + float(_USER_CACHE.get("ttl") or 5.0)
+    with _USER_CACHE["lock"]:
+        _user_cache_sync_scope_locked()
+        _USER_CACHE["values"][uid] = (expires_at, dict(row))
+        norm = str(row.get("username_norm") or "").strip()
+        if norm:
+            _USER_CACHE["by_norm"][norm] = uid
+
+
+def _invalidate_user_cache(user_id: Optional[int] = None) -> None:
+    with _USER_CACHE["lock"]:
+        if user_id is None:
+            _USER_CACHE["values"].clear()
+            _USER_CACHE["by_norm"].clear()
+            return
+        uid = int(user_id or 0)
+        _USER_CACHE["values"].pop(uid, None)
+        for norm in [k for k, v in _USER_CACHE["by_norm"].items() if int(v or 0) == uid]:
+            _USER_CACHE["by_norm"].pop(norm, None)
 
 
 def _pool_rows_to_cacheable(rows: Any) -> List[Dict[str, int]]:
@@ -317,6 +515,14 @@ _DEFAULT_THRESHOLD_SETTINGS: Dict[str, Any] = {
     "worker_download_url": DEFAULT_WORKER_DOWNLOAD_URL,
 }
 
+_DEFAULT_SETTINGS_KEYS = tuple(str(k) for k in _DEFAULT_THRESHOLD_SETTINGS)
+_SQL_DEFAULT_SETTINGS_EXISTING = (
+    "SELECT key FROM settings WHERE key IN (" + ",".join("?" for _ in _DEFAULT_SETTINGS_KEYS) + ")"
+)
+_SQL_DEFAULT_SETTINGS_INSERT = (
+    "INSERT INTO settings (key, value, updated_at) VALUES (?, ?, ?) ON CONFLICT(key) DO NOTHING"
+)
+
 _PROFILE_NICKNAME_MAX_LEN = 16
 _AVATAR_DATA_URL_MAX_LEN = 350000
 
@@ -366,20 +572,43 @@ def _sanitize_avatar_url(value: Any) -> str:
     return ""
 
 
+def _invalidate_default_avatar_cache() -> None:
+    with _DEFAULT_AVATAR_CACHE["lock"]:
+        _DEFAULT_AVATAR_CACHE["value"] = None
+        _DEFAULT_AVATAR_CACHE["expires_at"] = 0.0
+
+
 def _default_avatar_url_from_conn(conn: Any = None) -> str:
+    now_mono = time.monotonic()
+    scope = _db_cache_scope()
+    with _DEFAULT_AVATAR_CACHE["lock"]:
+        cached = _DEFAULT_AVATAR_CACHE.get("value")
+        # scope 不同代表是切換前另一個資料庫的設定，視為未命中
+        if (
+            cached is not None
+            and _DEFAULT_AVATAR_CACHE.get("scope") == scope
+            and float(_DEFAULT_AVATAR_CACHE.get("expires_at") or 0.0) > now_mono
+        ):
+            return str(cached)
+
     owns_conn = not bool(getattr(conn, "_is_db_conn", False))
     if owns_conn:
         conn = _conn()
+    out = ""
     try:
-        custom = _sanitize_avatar_url(get_setting(conn, "default_avatar_data_url", ""))
-        if custom:
-            return custom
+        out = _sanitize_avatar_url(get_setting(conn, "default_avatar_data_url", ""))
     except Exception:
-        pass
+        out = ""
     finally:
         if owns_conn:
             conn.close()
-    return _build_default_avatar_data_url("SHEEP")
+    if not out:
+        out = _build_default_avatar_data_url("SHEEP")
+    with _DEFAULT_AVATAR_CACHE["lock"]:
+        _DEFAULT_AVATAR_CACHE["value"] = out
+        _DEFAULT_AVATAR_CACHE["scope"] = scope
+        _DEFAULT_AVATAR_CACHE["expires_at"] = now_mono + float(_DEFAULT_AVATAR_CACHE.get("ttl") or 0.0)
+    return out
 
 
 def _clamp_nonnegative_int(value: Any) -> int:
@@ -421,7 +650,7 @@ def _get_setting_int_from_conn(conn: Any, key: str, default: Optional[int] = 0)
         return default
     raw_value = dict(row or {}).get("value")
     try:
-        raw_value = json.loads(raw_value)
+        raw_value = _fast_json_loads(raw_value)
     except Exception:
         pass
     try:
@@ -438,6 +667,7 @@ def _bump_setting_int(conn: Any, key: str, delta: Any) -> None:
     delta_int = int(float(delta or 0))
     if delta_int == 0:
         return
+    _invalidate_settings_cache(str(key or ""))
     initial_value = str(max(0, delta_int))
     now = _now_iso()
     kind = str(getattr(conn, "kind", "sqlite") or "sqlite")
@@ -524,40 +754,6 @@ def invalidate_global_dashboard_counters(*, force: bool = False) -> None:
         _GLOBAL_COUNTERS_CACHE["last_invalidated_at"] = now_ts
 
 
-def _get_progress_summary_columns(conn: Any) -> Tuple[str, str, str]:
-    kind = str(getattr(conn, "kind", "sqlite") or "sqlite")
-    if kind == "postgres":
-        combos_done_expr = """
-            COALESCE(
-                progress_combos_done,
-                NULLIF(progress_json::jsonb->>'combos_done', '')::bigint,
-                NULLIF(progress_json::jsonb->>'done', '')::bigint,
-                0
-            )
-        """
-        combos_total_expr = """
-            COALESCE(
-                progress_combos_total,
-                NULLIF(progress_json::jsonb->>'combos_total', '')::bigint,
-                NULLIF(progress_json::jsonb->>'total', '')::bigint,
-                0
-            )
-        """
-        elapsed_expr = """
-            COALESCE(
-                progress_elapsed_s,
-                NULLIF(progress_json::jsonb->>'elapsed_s', '')::double precision,
-                NULLIF(progress_json::jsonb->>'elapsed', '')::double precision,
-                0.0
-            )
-        """
-        return combos_done_expr, combos_total_expr, elapsed_expr
-    combos_done_expr = "COALESCE(progress_combos_done, CAST(COALESCE(json_extract(progress_json, '$.combos_done'), json_extract(progress_json, '$.done'), 0) AS INTEGER), 0)"
-    combos_total_expr = "COALESCE(progress_combos_total, CAST(COALESCE(json_extract(progress_json, '$.combos_total'), json_extract(progress_json, '$.total'), 0) AS INTEGER), 0)"
-    elapsed_expr = "COALESCE(progress_elapsed_s, CAST(COALESCE(json_extract(progress_json, '$.elapsed_s'), json_extract(progress_json, '$.elapsed'), 0.0) AS REAL), 0.0)"
-    return combos_done_expr, combos_total_expr, elapsed_expr
-
-
 def get_global_dashboard_counters() -> Dict[str, int]:
     lock = _GLOBAL_COUNTERS_CACHE.get("lock")
     now_ts = time.time()
@@ -569,6 +765,12 @@ def get_global_dashboard_counters() -> Dict[str, int]:
                 if cached:
                     return cached
 
+    # 快取失效要重算時，先把合併中的進度落地，計數才會包含最新進度
+    try:
+        flush_task_progress()
+    except Exception:
+        pass
+
     conn = _conn()
     try:
         total_pool_combos = _get_global_dashboard_counter(conn, _GLOBAL_COUNTER_TOTAL_POOL_COMBOS, None)
@@ -747,13 +949,14 @@ def _normalize_strategy_row(row: Any) -> Dict[str, Any]:
 
 def _normalize_candidate_row(row: Any) -> Dict[str, Any]:
     data = dict(row or {})
-    direction = _infer_direction(direction=data.get("direction"), params_json=data.get("params_json"))
+    # params_json 只解碼一次，再把 dict 交給 _infer_direction，避免同一欄位被 json 解析兩次
+    params = _fast_json_object(data.get("params_json"))
+    direction = _infer_direction(direction=data.get("direction"), params_json=params)
     data["direction"] = direction
-    params = parse_json_object(data.get("params_json"))
     if params:
         params["direction"] = direction
     data["params_json"] = params
-    data["metrics"] = parse_json_object(data.get("metrics_json"))
+    data["metrics"] = _fast_json_object(data.get("metrics_json"))
     return data
 
 
@@ -876,12 +1079,19 @@ def ensure_default_settings(conn: Any = None) -> Dict[str, Any]:
 
     inserted: List[str] = []
     try:
+        # 一次查出已存在的 key、缺的以 executemany + ON CONFLICT DO NOTHING 補上，不覆蓋管理員剛寫入的值
+        rows = conn.execute(_SQL_DEFAULT_SETTINGS_EXISTING, _DEFAULT_SETTINGS_KEYS).fetchall()
+        existing = {str(r[0]) for r in (rows or [])}
+        now = _now_iso()
+        params = []
         for key, value in _DEFAULT_THRESHOLD_SETTINGS.items():
-            row = conn.execute("SELECT 1 FROM settings WHERE key = ? LIMIT 1", (str(key),)).fetchone()
-            if row:
+            if str(key) in existing:
                 continue
-            set_setting(conn, str(key), value)
+            params.append((str(key), json.dumps(value, ensure_ascii=False), now))
             inserted.append(str(key))
+        if params:
+            conn.executemany(_SQL_DEFAULT_SETTINGS_INSERT, params)
+            _invalidate_settings_cache(*inserted)
 
         if owns_conn:
             conn.commit()
@@ -1005,6 +1215,31 @@ def _backfill_factor_pool_combo_counts(conn: Any) -> int:
     return int(total_combo_count)
 
 
+def _backfill_payout_cycle_ids(conn: Any) -> int:
+    # payouts.cycle_id 為反正規化欄位（payouts -> strategies -> factor_pools），舊資料一次補齊；已補過的列不再碰
+    try:
+        cur = conn.execute(
+            """
+            UPDATE payouts
+            SET cycle_id = (
+                SELECT fp.cycle_id
+                FROM strategies s
+                JOIN factor_pools fp ON fp.id = s.pool_id
+                WHERE s.id = payouts.strategy_id
+            )
+            WHERE cycle_id IS NULL
+            """
+        )
+        conn.commit()
+        return int(cur.rowcount or 0)
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        return 0
+
+
 def _backfill_task_progress_summaries(conn: Any) -> int:
     last_id = 0
     batch_size = 1000
@@ -1088,20 +1323,36 @@ class _DBResult:
             self._cur = None
 
 
+@lru_cache(maxsize=1024)
+def _qmark_to_pyformat(sql: str) -> str:
+    """? → %s（psycopg2 的參數格式）。SQL 幾乎都是模組常數，快取後每條語句只轉換一次"""
+    return sql.replace("?", "%s")
+
+
+# psycopg2 的 executemany 是逐列往返；execute_batch 每頁的列數
+_PG_EXECUTE_BATCH_PAGE = 100
+
+
 class _DBConn:
+    # 每條查詢都會建立此物件，用 __slots__ 省掉 per-instance __dict__
+    __slots__ = ("_c", "_p", "_closed", "_is_db_conn", "kind", "_pool_path", "_ro_path")
+
     def __init__(self, conn, pool):
         self._c = conn
         self._p = pool
         self._closed = False
         self._is_db_conn = True  # 修復 get_setting 誤判導致的連線無限增生
+        self.kind = ""
+        self._pool_path = ""
+        self._ro_path = ""
 
     def execute(self, sql: str, params: Any = None):
-        is_pg = (getattr(self, "kind", "") == "postgres")
+        is_pg = (self.kind == "postgres")
         if is_pg and psycopg2 is not None:
             # [極致修復] 移除會導致 UnboundLocalError 的區域 import，直接使用檔案頂部已匯入的全域模組
             cur = self._c.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
             # 僅在 Postgres 模式下替換佔位符，保護 SQLite 原生語法
-            sql_fixed = sql.replace("?", "%s")
+            sql_fixed = _qmark_to_pyformat(sql)
         else:
             cur = self._c.cursor()
             sql_fixed = sql
@@ -1120,9 +1371,59 @@ class _DBConn:
                 pass
             raise e
 
+    def execute_tuples(self, sql: str, params: Any = None):
+        """回傳 tuple 列的 execute：Postgres 用預設游標、SQLite 關掉 sqlite3.Row，
+        給只取一兩個欄位的熱路徑（RETURNING id 等）省掉每列建 dict / Row 的成本。"""
+        is_pg = (self.kind == "postgres")
+        if is_pg and psycopg2 is not None:
+            cur = self._c.cursor()
+            sql_fixed = _qmark_to_pyformat(sql)
+        else:
+            cur = self._c.cursor()
+            cur.row_factory = None
+            sql_fixed = sql
+
+        try:
+            if params is not None:
+                cur.execute(sql_fixed, params)
+            else:
+                cur.execute(sql_fixed)
+            return cur
+        except Exception as e:
+            try:
+                self._c.rollback()
+            except Exception:
+                pass
+            raise e
+
+    def executemany(self, sql: str, seq_of_params: Any, batch: bool = False):
+        """batch=True 時 Postgres 改走 psycopg2 execute_batch：每 100 列併成一次往返送出，
+        但 rowcount 只剩最後一頁的數字，所以只給不看 rowcount 的批次寫入（心跳、進度、事件）使用。"""
+        is_pg = (self.kind == "postgres")
+        if is_pg and psycopg2 is not None:
+            cur = self._c.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            sql_fixed = _qmark_to_pyformat(sql)
+        else:
+            cur = self._c.cursor()
+            sql_fixed = sql
+
+        try:
+            rows = list(seq_of_params or [])
+            if is_pg and psycopg2 is not None and batch:
+                psycopg2.extras.execute_batch(cur, sql_fixed, rows, page_size=_PG_EXECUTE_BATCH_PAGE)
+            else:
+                cur.executemany(sql_fixed, rows)
+            return cur
+        except Exception as e:
+            try:
+                self._c.rollback()
+            except Exception:
+                pass
+            raise e
+
     def executescript(self, sql: str):
         """兼容 SQLite 的 executescript 方法，供 init_db 執行 DDL 使用"""
-        is_pg = (getattr(self, "kind", "") == "postgres")
+        is_pg = (self.kind == "postgres")
         if is_pg and psycopg2 is not None:
             cur = self._c.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         else:
@@ -1150,7 +1451,7 @@ class _DBConn:
     def close(self):
         if not self._closed:
             try:
-                is_pg = (getattr(self, "kind", "") == "postgres")
+                is_pg = (self.kind == "postgres")
                 if is_pg and self._p:
                     # [專家級防護] 歸還連線前強制 rollback，徹底清除 IDLE IN TRANSACTION 與懸空鎖！
                     # 這是解決 PostgreSQL 中 SELECT 讀寫鎖阻塞 ALTER TABLE (導致全站轉圈圈且無日誌) 的終極解法
@@ -1159,12 +1460,13 @@ class _DBConn:
                     except Exception:
                         pass
                     self._p.putconn(self._c)
+                elif not is_pg and self._ro_path:
+                    if not _sqlite_ro_checkin(self._c, self._ro_path):
+                        _sqlite_close_raw(self._c)
                 elif not is_pg:
-                    # [專家級修復] SQLite 必須真實關閉連線，防止伺服器 File Descriptor 記憶體洩漏
-                    try:
-                        self._c.close()
-                    except Exception:
-                        pass
+                    # 先歸還給本執行緒的閒置槽重複使用；槽已被佔用才真的關閉
+                    if not _sqlite_checkin(self._c, self._pool_path):
+                        _sqlite_close_raw(self._c)
             except Exception as e:
                 import traceback
                 import sys
@@ -1172,6 +1474,19 @@ class _DBConn:
             finally:
                 self._closed = True
 
+    # with _conn() as conn: 區塊結束即歸還連線（SQLite 回到執行緒閒置槽 / 唯讀池，Postgres 回連線池）；例外時先 rollback
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            try:
+                self.rollback()
+            except Exception:
+                pass
+        self.close()
+        return False
+
     # [專家級補強] 確保物件被垃圾回收時，連線一定會還給連線池，防止 Pool Exhausted
     def __del__(self):
         try:
@@ -1181,6 +1496,15 @@ class _DBConn:
             pass
 
 
+def _fetchall_dicts(cur: Any) -> List[Dict[str, Any]]:
+    """把查詢結果一次轉成 list[dict]；SQLite 游標改回傳原生 tuple，欄名只取一次再 zip。"""
+    if isinstance(cur, sqlite3.Cursor):
+        cur.row_factory = None
+        cols = [d[0] for d in (cur.description or ())]
+        return [dict(zip(cols, r)) for r in cur.fetchall()]
+    return [dict(r) for r in cur.fetchall()]
+
+
 _PG_POOL = None
 _PG_POOL_LOCK = threading.Lock()
 
@@ -1304,6 +1628,177 @@ def _pg_pool():
         ) from last_err
 
 
+# SQLite 每條執行緒保留一條閒置連線重複使用（保住 page cache 與 statement cache）；巢狀取用時另開新連線
+_SQLITE_THREAD_SLOT = threading.local()
+_SQLITE_WAL_APPLIED: set = set()
+# thread ident -> (path, raw)：只登記「正閒置在該執行緒 slot 內」的連線，借出時即移除，避免同一連線被重複派發
+_SQLITE_IDLE_CONNS: Dict[int, Any] = {}
+_SQLITE_IDLE_CONNS_LOCK = threading.Lock()
+_SQLITE_SEEN_THREADS: set = set()
+# 第二層：跨執行緒共用的閒置連線（LIFO，最近歸還的最先被拿走，page cache 最熱）。
+# Streamlit 每次 rerun、背景任務都會換新執行緒，單靠 thread-local 幾乎重用不到
+_SQLITE_SHARED_IDLE: Dict[str, Any] = {
+    "values": [],
+    "max": max(2, 2 * int(os.cpu_count() or 1)),
+    "lock": threading.Lock(),
+}
+# 儀表板唯讀連線（mode=ro + query_only）另外一池，不與可寫連線混用
+_SQLITE_RO_IDLE: Dict[str, Any] = {
+    "values": [],
+    "max": max(2, int(os.cpu_count() or 1)),
+    "lock": threading.Lock(),
+}
+
+
+# PRAGMA optimize：連線真正關閉時跑一次（SQLite 官方建議），長駐在池內的連線則依間隔在歸還時補跑，
+# 讓 query planner 的統計資訊跟得上 mining_tasks / candidates 的成長
+_SQLITE_OPTIMIZE_STATE: Dict[str, Any] = {
+    "last": {},
+    "lock": threading.Lock(),
+}
+
+
+def _sqlite_optimize_interval_s() -> float:
+    try:
+        return max(0.0, float(os.environ.get("SHEEP_SQLITE_OPTIMIZE_INTERVAL_S", "3600") or "3600"))
+    except Exception:
+        return 3600.0
+
+
+def _sqlite_optimize(raw: sqlite3.Connection) -> None:
+    try:
+        if raw.in_transaction:
+            return
+        # analysis_limit 限制 ANALYZE 每個索引掃描的列數，避免大表在關閉連線時卡住
+        raw.execute("PRAGMA analysis_limit = 400;")
+        raw.execute("PRAGMA optimize;")
+    except Exception:
+        pass
+
+
+def _sqlite_maybe_optimize(raw: sqlite3.Connection, path: str) -> None:
+    interval = _sqlite_optimize_interval_s()
+    if interval <= 0:
+        return
+    now = time.time()
+    with _SQLITE_OPTIMIZE_STATE["lock"]:
+        last = float(_SQLITE_OPTIMIZE_STATE["last"].get(path, 0.0) or 0.0)
+        if last <= 0.0:
+            # 行程剛起來的第一條連線不跑，從這裡開始計時
+            _SQLITE_OPTIMIZE_STATE["last"][path] = now
+            return
+        if (now - last) < interval:
+            return
+        _SQLITE_OPTIMIZE_STATE["last"][path] = now
+    _sqlite_optimize(raw)
+
+
+def _sqlite_close_raw(raw: sqlite3.Connection) -> None:
+    _sqlite_optimize(raw)
+    try:
+        raw.close()
+    except Exception:
+        pass
+
+
+def _sqlite_reuse_enabled() -> bool:
+    return str(os.environ.get("SHEEP_SQLITE_CONN_REUSE", "1") or "1").strip().lower() not in {"0", "false", "no", "off"}
+
+
+def _sqlite_shared_put(path: str, raw: sqlite3.Connection) -> bool:
+    with _SQLITE_SHARED_IDLE["lock"]:
+        if len(_SQLITE_SHARED_IDLE["values"]) >= int(_SQLITE_SHARED_IDLE["max"]):
+            return False
+        _SQLITE_SHARED_IDLE["values"].append((path, raw))
+        return True
+
+
+def _sqlite_shared_take(path: str) -> Optional[sqlite3.Connection]:
+    stale: List[sqlite3.Connection] = []
+    found: Optional[sqlite3.Connection] = None
+    with _SQLITE_SHARED_IDLE["lock"]:
+        values = _SQLITE_SHARED_IDLE["values"]
+        while values:
+            idle_path, raw = values.pop()
+            if idle_path == path:
+                found = raw
+                break
+            stale.append(raw)
+    for c in stale:
+        _sqlite_close_raw(c)
+    return found
+
+
+def _sqlite_checkout(path: str) -> Optional[sqlite3.Connection]:
+    idle = getattr(_SQLITE_THREAD_SLOT, "idle", None)
+    if idle is None:
+        return _sqlite_shared_take(path)
+    _SQLITE_THREAD_SLOT.idle = None
+    with _SQLITE_IDLE_CONNS_LOCK:
+        _SQLITE_IDLE_CONNS.pop(threading.get_ident(), None)
+    idle_path, raw = idle
+    if idle_path == path:
+        return raw
+    # DB 路徑換了（例如測試切換暫存目錄），舊連線直接關掉
+    _sqlite_close_raw(raw)
+    return None
+
+
+def _sqlite_checkin(raw: sqlite3.Connection, path: str) -> bool:
+    if not path or not _sqlite_reuse_enabled():
+        return False
+    try:
+        # 沒 commit 的交易比照關閉連線的語意直接丟棄，下一位使用者拿到的一定是乾淨連線
+        if raw.in_transaction:
+            raw.rollback()
+    except Exception:
+        return False
+    _sqlite_maybe_optimize(raw, path)
+    if getattr(_SQLITE_THREAD_SLOT, "idle", None) is not None:
+        # 本執行緒已有閒置連線（巢狀 _conn() 的情況），多出來的放進共用池
+        return _sqlite_shared_put(path, raw)
+    _SQLITE_THREAD_SLOT.idle = (path, raw)
+    ident = threading.get_ident()
+    with _SQLITE_IDLE_CONNS_LOCK:
+        is_new_thread = ident not in _SQLITE_SEEN_THREADS
+        _SQLITE_IDLE_CONNS[ident] = (path, raw)
+        if is_new_thread:
+            # 新執行緒登記時順手回收已結束執行緒留下的連線
+            alive = {t.ident for t in threading.enumerate()}
+            _SQLITE_SEEN_THREADS.intersection_update(alive)
+            _SQLITE_SEEN_THREADS.add(ident)
+            dead = [k for k in _SQLITE_IDLE_CONNS if k not in alive]
+            stale = [_SQLITE_IDLE_CONNS.pop(k) for k in dead]
+        else:
+            stale = []
+    for stale_path, c in stale:
+        # 已結束執行緒的連線仍然可用，優先轉進共用池給下一個新執行緒
+        if _sqlite_shared_put(stale_path, c):
+            continue
+        _sqlite_close_raw(c)
+    return True
+
+
+def _close_sqlite_idle_conns() -> None:
+    with _SQLITE_IDLE_CONNS_LOCK:
+        conns = [raw for _, raw in _SQLITE_IDLE_CONNS.values()]
+        _SQLITE_IDLE_CONNS.clear()
+    with _SQLITE_SHARED_IDLE["lock"]:
+        conns.extend(raw for _, raw in _SQLITE_SHARED_IDLE["values"])
+        _SQLITE_SHARED_IDLE["values"].clear()
+    with _SQLITE_RO_IDLE["lock"]:
+        conns.extend(raw for _, raw in _SQLITE_RO_IDLE["values"])
+        _SQLITE_RO_IDLE["values"].clear()
+    for c in conns:
+        _sqlite_close_raw(c)
+
+
+try:
+    atexit.register(_close_sqlite_idle_conns)
+except Exception:
+    pass
+
+
 def _release_conn(kind: str, raw) -> None:
     if kind == "postgres":
         # [專家級修復] 歸還連線前強制 rollback，清除殘留的錯誤交易狀態與死鎖，防止連線池被毒化
@@ -1356,63 +1851,389 @@ def _conn() -> _DBConn:
         return conn_obj
 
     # sqlite
-    # sqlite
-    path = _db_path()
+    return _sqlite_conn(_db_path())
+
+
+def _sqlite_conn(path: str) -> _DBConn:
     try:
         os.makedirs(os.path.dirname(path), exist_ok=True)
     except Exception as e:
         import traceback
         print(f"[DB ERROR] 無法建立資料庫目錄 {path}, 錯誤詳情: {e}\n{traceback.format_exc()}")
 
+    reused = _sqlite_checkout(path)
+    if reused is not None:
+        conn_obj = _DBConn(reused, None)
+        conn_obj.kind = "sqlite"
+        conn_obj._pool_path = path
+        return conn_obj
+
     # [專家級修復] 使用 IMMEDIATE 隔離級別，根除 SQLite 讀寫鎖升級導致的 deadlock 與瞬間 database is locked 錯誤
-    raw = sqlite3.connect(path, timeout=30.0, check_same_thread=False, isolation_level="IMMEDIATE")
+    raw = sqlite3.connect(path, timeout=30.0, check_same_thread=False, isolation_level="IMMEDIATE", cached_statements=256)
     raw.row_factory = sqlite3.Row
 
-    try:
-        raw.execute("PRAGMA foreign_keys = ON;")
-    except Exception:
-        pass
-    try:
-        raw.execute("PRAGMA journal_mode = WAL;")
-    except Exception:
-        pass
-    try:
-        raw.execute("PRAGMA synchronous = NORMAL;")
-    except Exception:
-        pass
+    # journal_mode=WAL 會寫進資料庫檔案本身，同一個檔案每個行程只需切換一次；其餘 PRAGMA 屬連線層級，開連線時各設一次
+    if path not in _SQLITE_WAL_APPLIED:
+        try:
+            mode_row = raw.execute("PRAGMA journal_mode = WAL;").fetchone()
+            if mode_row and str(mode_row[0] or "").lower() == "wal":
+                _SQLITE_WAL_APPLIED.add(path)
+        except Exception:
+            pass
+    _sqlite_apply_pragmas(
+        raw,
+        [
+            "PRAGMA foreign_keys = ON;",
+            "PRAGMA synchronous = NORMAL;",
+            # 約 4MB WAL 就 checkpoint 一次，避免 lease/heartbeat 高頻寫入讓 -wal 檔無限長大拖慢讀取
+            "PRAGMA wal_autocheckpoint = 1000;",
+            f"PRAGMA busy_timeout = {_sqlite_busy_timeout_ms()};",
+        ]
+        + _SQLITE_MEMORY_PRAGMAS,
+    )
+
+    # 修復：正確的參數順序為 _DBConn(conn, pool)，SQLite 無 pool 故傳 None
+    conn_obj = _DBConn(raw, None)
+    conn_obj.kind = "sqlite"
+    conn_obj._pool_path = path
+    return conn_obj
+
+
+_SQLITE_MEMORY_PRAGMAS = [
+    "PRAGMA mmap_size = 268435456;",
+    "PRAGMA cache_size = -64000;",
+    "PRAGMA temp_store = MEMORY;",
+]
+
+
+def _sqlite_busy_timeout_ms() -> int:
     try:
         busy_ms = int(float(os.environ.get("SHEEP_SQLITE_BUSY_TIMEOUT_MS", "15000") or "15000"))
     except Exception:
         busy_ms = 15000
-    busy_ms = max(0, min(60000, int(busy_ms)))
+    return max(0, min(60000, int(busy_ms)))
+
+
+def _sqlite_apply_pragmas(raw: sqlite3.Connection, pragmas: List[str]) -> None:
+    """連線層級 PRAGMA 併成一次 executescript 送出；任何一條失敗才退回逐條設定、逐條容錯"""
     try:
-        raw.execute(f"PRAGMA busy_timeout = {busy_ms};")
+        raw.executescript("\n".join(pragmas))
+        return
     except Exception:
         pass
-    try:
-        raw.execute("PRAGMA mmap_size = 268435456;")
+    for pragma in pragmas:
+        try:
+            raw.execute(pragma)
+        except Exception:
+            pass
+
+
+def _readonly_conn_enabled() -> bool:
+    return str(os.environ.get("SHEEP_DB_READONLY_CONN", "1") or "1").strip().lower() not in {"0", "false", "no", "off"}
+
+
+def _sqlite_ro_checkin(raw: sqlite3.Connection, path: str) -> bool:
+    if not _sqlite_reuse_enabled():
+        return False
+    try:
+        if raw.in_transaction:
+            raw.rollback()
     except Exception:
-        pass
+        return False
+    with _SQLITE_RO_IDLE["lock"]:
+        if len(_SQLITE_RO_IDLE["values"]) >= int(_SQLITE_RO_IDLE["max"]):
+            return False
+        _SQLITE_RO_IDLE["values"].append((path, raw))
+        return True
+
+
+def _sqlite_ro_open(path: str) -> Optional[sqlite3.Connection]:
+    stale: List[sqlite3.Connection] = []
+    found: Optional[sqlite3.Connection] = None
+    with _SQLITE_RO_IDLE["lock"]:
+        values = _SQLITE_RO_IDLE["values"]
+        while values:
+            idle_path, raw = values.pop()
+            if idle_path == path:
+                found = raw
+                break
+            stale.append(raw)
+    for c in stale:
+        _sqlite_close_raw(c)
+    if found is not None:
+        return found
+    if not os.path.exists(path):
+        return None
     try:
-        raw.execute("PRAGMA cache_size = -20000;")
+        from urllib.parse import quote as _url_quote
+
+        # autocommit（isolation_level=None）：唯讀查詢不會開隱含交易，每條 SELECT 各自拿 WAL 快照
+        raw = sqlite3.connect(
+            f"file:{_url_quote(os.path.abspath(path))}?mode=ro",
+            uri=True,
+            timeout=30.0,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=256,
+        )
     except Exception:
-        pass
+        return None
     try:
-        raw.execute("PRAGMA temp_store = MEMORY;")
+        raw.row_factory = sqlite3.Row
+        raw.execute("PRAGMA query_only = 1;")
+        _sqlite_apply_pragmas(raw, [f"PRAGMA busy_timeout = {_sqlite_busy_timeout_ms()};"] + _SQLITE_MEMORY_PRAGMAS)
+        # mode=ro 在 -shm 不可用等情況下要到第一次讀取才會失敗，先探一次，失敗就退回一般連線
+        raw.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        return raw
     except Exception:
-        pass
+        try:
+            raw.close()
+        except Exception:
+            pass
+        return None
 
-    # 修復：正確的參數順序為 _DBConn(conn, pool)，SQLite 無 pool 故傳 None
+
+def _conn_ro() -> _DBConn:
+    """儀表板 / 排行榜等純讀取路徑專用連線。
+
+    SQLite 以 mode=ro URI + PRAGMA query_only 開啟並放在獨立的閒置池，靠 WAL 與寫入端並行、不碰寫鎖；
+    Postgres 沿用連線池，交易開頭 SET TRANSACTION READ ONLY。開不起來時一律退回 _conn()。
+    """
+    if _db_kind() == "postgres" or not _readonly_conn_enabled():
+        conn = _conn()
+        if getattr(conn, "kind", "") == "postgres" and _readonly_conn_enabled():
+            try:
+                conn.execute("SET TRANSACTION READ ONLY")
+            except Exception:
+                pass
+        return conn
+    path = _db_path()
+    raw = _sqlite_ro_open(path)
+    if raw is None:
+        return _conn()
     conn_obj = _DBConn(raw, None)
     conn_obj.kind = "sqlite"
+    conn_obj._ro_path = path
     return conn_obj
 
 
+_ADD_COLUMN_RE = re.compile(
+    r"\s*ALTER\s+TABLE\s+(\w+)\s+ADD\s+COLUMN\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)",
+    re.IGNORECASE,
+)
+
+
+def _table_columns(conn: Any, table: str) -> Optional[frozenset]:
+    """一次取回資料表的欄位名稱集合；探測失敗回傳 None，呼叫端照舊直接送 ALTER。"""
+    try:
+        if getattr(conn, "kind", "sqlite") == "postgres":
+            rows = conn.execute(
+                "SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = ?",
+                (str(table),),
+            ).fetchall()
+            return frozenset(str(r["column_name"]).lower() for r in (rows or []))
+        rows = conn.execute(f"PRAGMA table_info({table})").fetchall()
+        return frozenset(str(r["name"]).lower() for r in (rows or []))
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        return None
+
+
+def _schema_failure(failures: List[Tuple[str, str]], stmt: str, err: Exception) -> None:
+    msg = str(err)
+    low = msg.lower()
+    if "already exists" in low or "duplicate column" in low:
+        return
+    failures.append((" ".join(str(stmt).split())[:200], msg))
+
+
+def _apply_schema_statements(conn: Any, statements: List[str]) -> List[Tuple[str, str]]:
+    """套用 init_db 的增量 schema 語句。
+
+    CREATE ... IF NOT EXISTS 屬於冪等 DDL，併成單一交易一次送出（只需一次 fsync）；
+    ALTER / UPDATE 在 SQLite 下常因欄位已存在而失敗，維持逐條套用、逐條容錯。
+    批次失敗時退回原本的逐條迴圈，確保單一壞語句不會拖垮其餘 DDL。
+    回傳真正失敗的 (語句, 錯誤)；「已存在」類錯誤代表 schema 已到位，不算失敗。
+    呼叫端只在回傳空清單時才記錄 schema 指紋，失敗的語句下次開機會再試。
+    """
+    is_pg = (getattr(conn, "kind", "sqlite") == "postgres")
+    batch: List[str] = []
+    singles: List[str] = []
+    for stmt in statements:
+        head = " ".join(str(stmt).split()).upper()
+        if head.startswith("CREATE ") and "IF NOT EXISTS" in head:
+            batch.append(str(stmt).strip().rstrip(";"))
+        else:
+            singles.append(stmt)
+
+    # 已存在的欄位直接跳過，不再每次啟動都送出必敗的 ALTER + rollback
+    table_cols: Dict[str, Optional[frozenset]] = {}
+    failures: List[Tuple[str, str]] = []
+    for stmt in singles:
+        m = _ADD_COLUMN_RE.match(str(stmt))
+        if m:
+            table, col = m.group(1).lower(), m.group(2).lower()
+            if table not in table_cols:
+                table_cols[table] = _table_columns(conn, table)
+            cols = table_cols[table]
+            if cols is not None and col in cols:
+                continue
+        try:
+            conn.execute(stmt)
+            conn.commit()
+            if m and table_cols.get(table) is not None:
+                table_cols[table] = table_cols[table] | {col}
+        except Exception as e:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            _schema_failure(failures, stmt, e)
+
+    if not batch:
+        return failures
+    try:
+        if is_pg:
+            conn.execute(";\n".join(batch))
+            conn.commit()
+        else:
+            conn.executescript("BEGIN IMMEDIATE;\n" + ";\n".join(batch) + ";\nCOMMIT;")
+        return failures
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+
+    for stmt in batch:
+        try:
+            conn.execute(stmt)
+            conn.commit()
+        except Exception as e:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            _schema_failure(failures, stmt, e)
+    return failures
+
+
+# 這兩個含 updated_at 的索引拖慢最熱的 mining_tasks 寫入，改由 ensure_deferred_task_indexes() 於離峰建立
+_DEFERRED_TASK_INDEXES: List[Tuple[str, str]] = [
+    ("idx_mining_tasks_updated_status", "CREATE INDEX IF NOT EXISTS idx_mining_tasks_updated_status ON mining_tasks(updated_at, status)"),
+    ("idx_mining_tasks_user_cycle_status_upd", "CREATE INDEX IF NOT EXISTS idx_mining_tasks_user_cycle_status_upd ON mining_tasks(user_id, cycle_id, status, updated_at)"),
+    # get_global_progress_snapshot 排名子查詢所需欄位全在索引內 -> index-only scan，依 (pool_id, partition_idx) 順序走訪
+    ("idx_mining_tasks_snapshot_cover", "CREATE INDEX IF NOT EXISTS idx_mining_tasks_snapshot_cover ON mining_tasks(cycle_id, pool_id, partition_idx, status, updated_at DESC, created_at, id DESC)"),
+]
+
+
+def ensure_deferred_task_indexes() -> Dict[str, Any]:
+    created: List[str] = []
+    errors: List[str] = []
+    conn = _conn()
+    try:
+        for idx_name, idx_sql in _DEFERRED_TASK_INDEXES:
+            try:
+                conn.execute(idx_sql)
+                conn.commit()
+                created.append(idx_name)
+            except Exception as e:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                errors.append(f"{idx_name}: {e}")
+    finally:
+        conn.close()
+    return {"indexes": created, "errors": errors}
+
+
+# 同一行程內多個執行緒（API worker、背景 job）同時 init_db 時排隊執行，
+# 避免兩條連線同時跑 CREATE TABLE / ALTER 互相撞鎖或重複搬資料
+_INIT_DB_LOCK = threading.RLock()
+_SQLITE_INIT_BUSY_TIMEOUT_MS = 30000
+
+
+_SCHEMA_VERSION_KEY = "schema_version"
+
+
+def _schema_gate_enabled() -> bool:
+    return str(os.environ.get("SHEEP_INIT_DB_SCHEMA_GATE", "1")).strip().lower() not in {"0", "false", "no", "off"}
+
+
+@lru_cache(maxsize=1)
+def _schema_version() -> str:
+    """以 _init_db_locked 內所有 DDL 字串常數算出指紋；改動任何建表/索引/ALTER 語句都會自動換版本。
+
+    ALTER/INDEX 清單這類多元素的 list 字面值會被編譯成 tuple 常數，所以 tuple/frozenset 也要展開。
+    """
+    parts: List[str] = []
+    stack: List[Any] = [_init_db_locked.__code__]
+    while stack:
+        const = stack.pop()
+        if isinstance(const, str):
+            parts.append(const)
+        elif hasattr(const, "co_consts"):
+            stack.extend(reversed(const.co_consts))
+        elif isinstance(const, tuple):
+            stack.extend(reversed(const))
+        elif isinstance(const, frozenset):
+            # frozenset 迭代順序不固定，排序後指紋才穩定
+            stack.extend(sorted(const, key=repr))
+    return hashlib.sha1("\x00".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def _schema_is_current(conn: Any) -> bool:
+    try:
+        row = conn.execute("SELECT value FROM settings WHERE key = ? LIMIT 1", (_SCHEMA_VERSION_KEY,)).fetchone()
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        return False
+    if not row:
+        return False
+    try:
+        return _fast_json_loads(row[0] if not isinstance(row, dict) else row.get("value")) == _schema_version()
+    except Exception:
+        return False
+
+
+def _record_schema_version(conn: Any, failures: List[Tuple[str, str]]) -> None:
+    # 有 DDL 沒套上（鎖等待逾時、statement_timeout 等）就不寫指紋，下次開機整套 DDL 會再跑一次
+    if failures:
+        for stmt, err in failures:
+            print(f"[DB ERROR] init_db schema 語句失敗，下次啟動重試: {stmt} | {err}", file=_sys.stderr, flush=True)
+        return
+    set_setting(conn, _SCHEMA_VERSION_KEY, _schema_version())
+
+
 def init_db() -> None:
+    with _INIT_DB_LOCK:
+        _invalidate_user_cache()
+        _init_db_locked()
+
+
+def _init_db_locked() -> None:
+    global _LEASE_COLS_READY
     conn = _conn()
     is_pg = (getattr(conn, "kind", "sqlite") == "postgres")
     
     try:
+        # schema 指紋沒變就跳過 DDL 與全表 backfill；payouts.cycle_id 舊版寫入端不會填，每次開機仍補 NULL 列
+        if _schema_gate_enabled() and _schema_is_current(conn):
+            _LEASE_COLS_READY = True
+            _backfill_payout_cycle_ids(conn)
+            ensure_default_settings(conn)
+            _activate_catalog_template_strategies(conn)
+            conn.commit()
+            invalidate_global_dashboard_counters(force=True)
+            return
+
         if is_pg:
             # ---------------------------------------------------------
             # PostgreSQL 專用 DDL
@@ -1505,7 +2326,6 @@ def init_db() -> None:
 
                 CREATE INDEX IF NOT EXISTS idx_mining_tasks_pool_cycle_part ON mining_tasks (pool_id, cycle_id, partition_idx);
                 CREATE INDEX IF NOT EXISTS idx_mining_tasks_cycle_status ON mining_tasks (cycle_id, status);
-                CREATE INDEX IF NOT EXISTS idx_mining_tasks_updated_status ON mining_tasks (updated_at, status);
                 CREATE INDEX IF NOT EXISTS idx_mining_tasks_user_cycle_pool_part ON mining_tasks (user_id, cycle_id, pool_id, partition_idx);
                 CREATE INDEX IF NOT EXISTS idx_mining_tasks_user_cycle_id_desc ON mining_tasks (user_id, cycle_id, id DESC);
                 CREATE INDEX IF NOT EXISTS idx_mining_tasks_activity_at ON mining_tasks (COALESCE(last_heartbeat, updated_at, created_at), user_id);
@@ -1588,6 +2408,7 @@ def init_db() -> None:
 
                 CREATE INDEX IF NOT EXISTS idx_payouts_created_at ON payouts(created_at);
                 CREATE INDEX IF NOT EXISTS idx_payouts_created_user ON payouts(created_at, user_id);
+                CREATE INDEX IF NOT EXISTS idx_payouts_created_user_amount ON payouts(created_at, user_id, amount_usdt);
 
                 CREATE TABLE IF NOT EXISTS runtime_portfolio_snapshots (
                     id BIGSERIAL PRIMARY KEY,
@@ -1681,6 +2502,7 @@ def init_db() -> None:
                 "ALTER TABLE mining_tasks ADD COLUMN IF NOT EXISTS progress_combos_done BIGINT NOT NULL DEFAULT 0",
                 "ALTER TABLE mining_tasks ADD COLUMN IF NOT EXISTS progress_combos_total BIGINT NOT NULL DEFAULT 0",
                 "ALTER TABLE mining_tasks ADD COLUMN IF NOT EXISTS progress_elapsed_s DOUBLE PRECISION NOT NULL DEFAULT 0.0",
+                "ALTER TABLE payouts ADD COLUMN IF NOT EXISTS cycle_id BIGINT",
                 """
                 CREATE TABLE IF NOT EXISTS workers (
                     worker_id TEXT PRIMARY KEY,
@@ -1710,8 +2532,15 @@ def init_db() -> None:
                 """,
                 "CREATE INDEX IF NOT EXISTS idx_workers_last_seen ON workers(last_seen_at)",
                 "CREATE INDEX IF NOT EXISTS idx_worker_events_ts ON worker_events(ts)",
+                "CREATE INDEX IF NOT EXISTS idx_worker_events_event_ts ON worker_events(event, ts)",
                 "CREATE INDEX IF NOT EXISTS idx_mining_tasks_user_cycle_pool_part ON mining_tasks(user_id, cycle_id, pool_id, partition_idx)",
                 "CREATE INDEX IF NOT EXISTS idx_mining_tasks_user_cycle_id_desc ON mining_tasks(user_id, cycle_id, id DESC)",
+                "CREATE INDEX IF NOT EXISTS idx_mining_tasks_status_lease ON mining_tasks(status, lease_expires_at)",
+                # 僵屍任務回收 (status IN running/syncing AND last_heartbeat < ?)：partial index 只收執行中的列，體積小、範圍掃描直接命中
+                "CREATE INDEX IF NOT EXISTS idx_mining_tasks_stale_hb ON mining_tasks(last_heartbeat) WHERE status IN ('running', 'syncing')",
+                # 派工挑選：只收 assigned/queued 的部分索引，依 id 順序走訪、找到第一筆可派的即停，不必排序整批待派任務
+                "CREATE INDEX IF NOT EXISTS idx_mining_tasks_claimable_id ON mining_tasks(id) WHERE status IN ('assigned', 'queued')",
+                "CREATE INDEX IF NOT EXISTS idx_mining_tasks_user_claimable ON mining_tasks(user_id, cycle_id, id) WHERE status IN ('assigned', 'queued')",
                 "CREATE INDEX IF NOT EXISTS idx_mining_tasks_activity_at ON mining_tasks((COALESCE(last_heartbeat, updated_at, created_at)), user_id)",
                 "CREATE INDEX IF NOT EXISTS idx_mining_tasks_status_user ON mining_tasks(status, user_id)",
                 "CREATE INDEX IF NOT EXISTS idx_mining_tasks_status_id ON mining_tasks(status, id)",
@@ -1720,12 +2549,22 @@ def init_db() -> None:
                 "CREATE INDEX IF NOT EXISTS idx_mining_tasks_user_completed_review_status ON mining_tasks(user_id, (COALESCE(progress_json::jsonb->>'review_status', progress_json::jsonb->>'oos_status', ''))) WHERE status = 'completed'",
                 "CREATE INDEX IF NOT EXISTS idx_mining_tasks_activity_status_user ON mining_tasks((COALESCE(last_heartbeat, updated_at, created_at)), status, user_id)",
                 "CREATE INDEX IF NOT EXISTS idx_users_runnable ON users(disabled, run_enabled, id)",
+                "CREATE INDEX IF NOT EXISTS idx_users_lower_username ON users((lower(username)))",
                 "CREATE INDEX IF NOT EXISTS idx_submissions_status_user ON submissions(status, user_id)",
                 "CREATE INDEX IF NOT EXISTS idx_candidates_created_user_score ON candidates(created_at, user_id, score)",
                 "CREATE INDEX IF NOT EXISTS idx_strategies_status_user ON strategies(status, user_id)",
                 "CREATE INDEX IF NOT EXISTS idx_strategies_user_status_created ON strategies(user_id, status, created_at)",
                 "CREATE INDEX IF NOT EXISTS idx_weekly_checks_checked_strategy ON weekly_checks(checked_at, strategy_id)",
                 "CREATE INDEX IF NOT EXISTS idx_payouts_created_user ON payouts(created_at, user_id)",
+                # 排行榜 points 區段 (created_at 範圍 + SUM(amount_usdt) GROUP BY user_id) 走 covering index，不回表
+                "CREATE INDEX IF NOT EXISTS idx_payouts_created_user_amount ON payouts(created_at, user_id, amount_usdt)",
+                "CREATE INDEX IF NOT EXISTS idx_api_tokens_expires_at ON api_tokens(expires_at)",
+                "CREATE INDEX IF NOT EXISTS idx_factor_pools_cycle_active ON factor_pools(cycle_id, active)",
+                "CREATE INDEX IF NOT EXISTS idx_mining_tasks_cycle_pool_part ON mining_tasks(cycle_id, pool_id, partition_idx)",
+                "CREATE INDEX IF NOT EXISTS idx_candidates_task_score ON candidates(task_id, score DESC)",
+                "CREATE INDEX IF NOT EXISTS idx_payouts_strategy_week ON payouts(strategy_id, week_start_ts)",
+                "CREATE INDEX IF NOT EXISTS idx_submissions_user_status_id ON submissions(user_id, status, id DESC)",
+                "CREATE INDEX IF NOT EXISTS idx_payouts_cycle_status_amount ON payouts(cycle_id, status, amount_usdt)",
                 """
                 CREATE TABLE IF NOT EXISTS announcements (
                     id BIGSERIAL PRIMARY KEY,
@@ -1742,23 +2581,23 @@ def init_db() -> None:
                 )
                 """,
                 "CREATE INDEX IF NOT EXISTS idx_announcements_status_published ON announcements(status, published_at DESC, id DESC)",
+                # active 週期查詢 (status = 'active' ORDER BY id DESC LIMIT 1) 直接從索引尾端取一筆，不掃 mining_cycles
+                "CREATE INDEX IF NOT EXISTS idx_mining_cycles_status_id ON mining_cycles(status, id)",
                 "ALTER TABLE runtime_portfolio_items ADD COLUMN IF NOT EXISTS strategy_id BIGINT",
                 "ALTER TABLE runtime_portfolio_items ADD COLUMN IF NOT EXISTS total_return_pct DOUBLE PRECISION NOT NULL DEFAULT 0.0",
                 "ALTER TABLE runtime_portfolio_items ADD COLUMN IF NOT EXISTS max_drawdown_pct DOUBLE PRECISION NOT NULL DEFAULT 0.0",
             ]
             
-            for stmt in statements:
-                try:
-                    conn.execute(stmt)
-                    conn.commit()
-                except Exception:
-                    conn.rollback()
+            schema_failures = _apply_schema_statements(conn, statements)
+            _LEASE_COLS_READY = True
 
             ensure_default_settings(conn)
             _backfill_direction_columns(conn)
             _backfill_factor_pool_combo_counts(conn)
             _backfill_task_progress_summaries(conn)
+            _backfill_payout_cycle_ids(conn)
             _activate_catalog_template_strategies(conn)
+            _record_schema_version(conn, schema_failures)
             conn.commit()
             invalidate_global_dashboard_counters(force=True)
             # 執行完 Postgres 的 DDL 後，直接結束函數，絕對不往下跑 SQLite 的邏圈
@@ -1768,6 +2607,12 @@ def init_db() -> None:
             # ---------------------------------------------------------
             # SQLite 專用 DDL
             # ---------------------------------------------------------
+            # 跨行程不另外加檔案鎖：DDL 全是 IF NOT EXISTS 冪等語句，同時開機的行程交給 SQLite 自己的
+            # busy handler 排隊；初始化期間把等待上限拉到 30 秒，結束後還原成一般連線的設定
+            try:
+                conn.execute(f"PRAGMA busy_timeout = {_SQLITE_INIT_BUSY_TIMEOUT_MS};")
+            except Exception:
+                pass
             conn.executescript(
                 """
                 CREATE TABLE IF NOT EXISTS users (
@@ -1935,6 +2780,7 @@ def init_db() -> None:
                 );
                 CREATE INDEX IF NOT EXISTS idx_payouts_created_at ON payouts(created_at);
                 CREATE INDEX IF NOT EXISTS idx_payouts_created_user ON payouts(created_at, user_id);
+                CREATE INDEX IF NOT EXISTS idx_payouts_created_user_amount ON payouts(created_at, user_id, amount_usdt);
 
                 CREATE TABLE IF NOT EXISTS runtime_portfolio_snapshots (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -2016,6 +2862,7 @@ def init_db() -> None:
                 "ALTER TABLE mining_tasks ADD COLUMN progress_combos_done INTEGER NOT NULL DEFAULT 0",
                 "ALTER TABLE mining_tasks ADD COLUMN progress_combos_total INTEGER NOT NULL DEFAULT 0",
                 "ALTER TABLE mining_tasks ADD COLUMN progress_elapsed_s REAL NOT NULL DEFAULT 0.0",
+                "ALTER TABLE payouts ADD COLUMN cycle_id INTEGER",
                 """
                 CREATE TABLE IF NOT EXISTS workers (
                     worker_id TEXT PRIMARY KEY,
@@ -2046,15 +2893,19 @@ def init_db() -> None:
                 "CREATE INDEX IF NOT EXISTS idx_workers_last_seen ON workers(last_seen_at)",
                 "CREATE INDEX IF NOT EXISTS idx_worker_events_ts ON worker_events(ts)",
                 "CREATE INDEX IF NOT EXISTS idx_worker_events_event_ts ON worker_events(event, ts)",
-                "CREATE INDEX IF NOT EXISTS idx_mining_tasks_user_cycle_status_upd ON mining_tasks(user_id, cycle_id, status, updated_at)",
                 "CREATE INDEX IF NOT EXISTS idx_mining_tasks_user_cycle_pool_part ON mining_tasks(user_id, cycle_id, pool_id, partition_idx)",
                 "CREATE INDEX IF NOT EXISTS idx_mining_tasks_user_cycle_id_desc ON mining_tasks(user_id, cycle_id, id DESC)",
                 "CREATE INDEX IF NOT EXISTS idx_mining_tasks_activity_at ON mining_tasks(COALESCE(last_heartbeat, updated_at, created_at), user_id)",
                 "CREATE INDEX IF NOT EXISTS idx_mining_tasks_status_lease ON mining_tasks(status, lease_expires_at)",
+                # 僵屍任務回收：SQLite 的 MULTI-INDEX OR 不會挑 partial index，改用 (status, last_heartbeat) 讓兩個 OR 分支都走 covering index
+                "CREATE INDEX IF NOT EXISTS idx_mining_tasks_status_heartbeat ON mining_tasks(status, last_heartbeat)",
                 "CREATE INDEX IF NOT EXISTS idx_mining_tasks_status_fast ON mining_tasks(status)",
+                # 派工挑選：只收 assigned/queued 的部分索引，依 id 順序走訪、找到第一筆可派的即停，不必排序整批待派任務
+                "CREATE INDEX IF NOT EXISTS idx_mining_tasks_claimable_id ON mining_tasks(id) WHERE status IN ('assigned', 'queued')",
+                "CREATE INDEX IF NOT EXISTS idx_mining_tasks_user_claimable ON mining_tasks(user_id, cycle_id, id) WHERE status IN ('assigned', 'queued')",
                 "CREATE INDEX IF NOT EXISTS idx_users_runnable ON users(disabled, run_enabled, id)",
                 "CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at)",
-                "CREATE INDEX IF NOT EXISTS idx_mining_tasks_updated_status ON mining_tasks(updated_at, status)",
+                "CREATE INDEX IF NOT EXISTS idx_users_lower_username ON users(lower(username))",
                 "CREATE INDEX IF NOT EXISTS idx_candidates_created_at ON candidates(created_at)",
                 "CREATE INDEX IF NOT EXISTS idx_candidates_created_user_score ON candidates(created_at, user_id, score)",
                 "CREATE INDEX IF NOT EXISTS idx_strategies_status_user ON strategies(status, user_id)",
@@ -2062,6 +2913,15 @@ def init_db() -> None:
                 "CREATE INDEX IF NOT EXISTS idx_weekly_checks_checked_strategy ON weekly_checks(checked_at, strategy_id)",
                 "CREATE INDEX IF NOT EXISTS idx_payouts_created_at ON payouts(created_at)",
                 "CREATE INDEX IF NOT EXISTS idx_payouts_created_user ON payouts(created_at, user_id)",
+                # 排行榜 points 區段 (created_at 範圍 + SUM(amount_usdt) GROUP BY user_id) 走 covering index，不回表
+                "CREATE INDEX IF NOT EXISTS idx_payouts_created_user_amount ON payouts(created_at, user_id, amount_usdt)",
+                "CREATE INDEX IF NOT EXISTS idx_api_tokens_expires_at ON api_tokens(expires_at)",
+                "CREATE INDEX IF NOT EXISTS idx_factor_pools_cycle_active ON factor_pools(cycle_id, active)",
+                "CREATE INDEX IF NOT EXISTS idx_mining_tasks_cycle_pool_part ON mining_tasks(cycle_id, pool_id, partition_idx)",
+                "CREATE INDEX IF NOT EXISTS idx_candidates_task_score ON candidates(task_id, score DESC)",
+                "CREATE INDEX IF NOT EXISTS idx_payouts_strategy_week ON payouts(strategy_id, week_start_ts)",
+                "CREATE INDEX IF NOT EXISTS idx_submissions_user_status_id ON submissions(user_id, status, id DESC)",
+                "CREATE INDEX IF NOT EXISTS idx_payouts_cycle_status_amount ON payouts(cycle_id, status, amount_usdt)",
                 "CREATE INDEX IF NOT EXISTS idx_mining_tasks_status_user ON mining_tasks(status, user_id)",
                 "CREATE INDEX IF NOT EXISTS idx_mining_tasks_status_id ON mining_tasks(status, id)",
                 """
@@ -2080,6 +2940,8 @@ def init_db() -> None:
                 )
                 """,
                 "CREATE INDEX IF NOT EXISTS idx_announcements_status_published ON announcements(status, published_at DESC, id DESC)",
+                # active 週期查詢 (status = 'active' ORDER BY id DESC LIMIT 1) 直接從索引尾端取一筆，不掃 mining_cycles
+                "CREATE INDEX IF NOT EXISTS idx_mining_cycles_status_id ON mining_cycles(status, id)",
                 "CREATE INDEX IF NOT EXISTS idx_mining_tasks_user_cycle_status_id ON mining_tasks(user_id, cycle_id, status, id)",
                 "CREATE INDEX IF NOT EXISTS idx_mining_tasks_completed_review_status ON mining_tasks(COALESCE(json_extract(progress_json, '$.review_status'), json_extract(progress_json, '$.oos_status'), '')) WHERE status = 'completed'",
                 "CREATE INDEX IF NOT EXISTS idx_mining_tasks_user_completed_review_status ON mining_tasks(user_id, COALESCE(json_extract(progress_json, '$.review_status'), json_extract(progress_json, '$.oos_status'), '')) WHERE status = 'completed'",
@@ -2090,26 +2952,30 @@ def init_db() -> None:
                 "ALTER TABLE runtime_portfolio_items ADD COLUMN max_drawdown_pct REAL NOT NULL DEFAULT 0.0",
             ]
             
-            for stmt in statements_sqlite:
-                try:
-                    conn.execute(stmt)
-                    conn.commit()
-                except Exception:
-                    pass # SQLite 不支援 IF NOT EXISTS 的 ALTER TABLE 寫法，若報錯通常代表已存在
+            # SQLite 不支援 IF NOT EXISTS 的 ALTER TABLE 寫法，若報錯通常代表已存在
+            schema_failures = _apply_schema_statements(conn, statements_sqlite)
+            _LEASE_COLS_READY = True
 
             ensure_default_settings(conn)
             _backfill_direction_columns(conn)
             _backfill_factor_pool_combo_counts(conn)
             _backfill_task_progress_summaries(conn)
+            _backfill_payout_cycle_ids(conn)
             _activate_catalog_template_strategies(conn)
+            _record_schema_version(conn, schema_failures)
             conn.commit()
             invalidate_global_dashboard_counters(force=True)
 
     finally:
+        if not is_pg:
+            try:
+                conn.execute(f"PRAGMA busy_timeout = {_sqlite_busy_timeout_ms()};")
+            except Exception:
+                pass
         conn.close()
 
 
-def get_user_by_username(username: str) -> Optional[Dict[str, Any]]:
+def get_user_by_username(username: str, *, use_cache: bool = True) -> Optional[Dict[str, Any]]:
     log_sys_event("AUTH_LOGIN_TRACE_1", None, "成功進入 get_user_by_username 函數第一行", {"input": username})
     try:
         raw = str(username or "")
@@ -2121,6 +2987,13 @@ def get_user_by_username(username: str) -> Optional[Dict[str, Any]]:
         log_sys_event("AUTH_LOGIN_CRASH", None, f"normalize 崩潰: {e}", {})
         return None
 
+    # 認證走短 TTL 快取；決定要不要建帳號的存在性檢查請傳 use_cache=False
+    cached_uid = _user_cache_uid_for_norm(uname_norm) if use_cache else 0
+    if cached_uid > 0:
+        cached = _user_cache_get(cached_uid)
+        if cached is not None:
+            return cached
+
     log_sys_event("AUTH_LOGIN_TRACE_2", None, "準備請求資料庫連線池", {"uname_norm": uname_norm})
     try:
         conn = _conn()
@@ -2135,6 +3008,7 @@ def get_user_by_username(username: str) -> Optional[Dict[str, Any]]:
             if row:
                 row_dict = _decorate_user_row(row, default_avatar_url=_default_avatar_url_from_conn(conn))
                 log_sys_event("AUTH_LOGIN_TRACE_4", None, "SQL 查詢成功並找到用戶", {"id": row_dict.get("id")})
+                _user_cache_put(row_dict)
                 return row_dict
         except Exception as e:
             conn.rollback()
@@ -2142,7 +3016,18 @@ def get_user_by_username(username: str) -> Optional[Dict[str, Any]]:
 
         log_sys_event("AUTH_LOGIN_TRACE_5", None, "準備執行2階與3階查詢", {})
         try:
-            row2 = conn.execute("SELECT * FROM users WHERE lower(username) = ? OR username = ? LIMIT 1", (uname_norm, raw.strip())).fetchone()
+            # 只以 lower(username) 篩選才能走 idx_users_lower_username，精確比對留在 Python 端
+            raw_stripped = raw.strip()
+            rows2 = conn.execute(
+                "SELECT * FROM users WHERE lower(username) IN (?, ?) ORDER BY id LIMIT 16",
+                (uname_norm, raw_stripped.lower()),
+            ).fetchall()
+            row2 = None
+            for cand in rows2:
+                cand_name = str(dict(cand).get("username") or "")
+                if cand_name.lower() == uname_norm or cand_name == raw_stripped:
+                    row2 = cand
+                    break
             if row2:
                 log_sys_event("AUTH_LOGIN_TRACE_6", None, "2階查詢成功", {})
                 return _decorate_user_row(row2, default_avatar_url=_default_avatar_url_from_conn(conn))
@@ -2169,13 +3054,20 @@ def get_user_by_id(user_id: int) -> Optional[Dict[str, Any]]:
         uid = int(user_id)
     except Exception:
         return None
+    cached = _user_cache_get(uid)
+    if cached is not None:
+        return cached
     import time
     for attempt in range(5):
         try:
             conn = _conn()
             try:
                 row = conn.execute("SELECT * FROM users WHERE id = ? LIMIT 1", (uid,)).fetchone()
-                return _decorate_user_row(row, default_avatar_url=_default_avatar_url_from_conn(conn)) if row else None
+                if not row:
+                    return None
+                row_dict = _decorate_user_row(row, default_avatar_url=_default_avatar_url_from_conn(conn))
+                _user_cache_put(row_dict)
+                return row_dict
             finally:
                 conn.close()
         except Exception:
@@ -2216,24 +3108,17 @@ def create_user(
         raise e
 
     log_sys_event("AUTH_REG_TRACE_3", None, "連線取得成功，準備執行 INSERT", {})
+    now = _now_iso()
     try:
-        if getattr(conn, "kind", "sqlite") == "postgres":
-            row = conn.execute(
-                "INSERT INTO users (username, username_norm, password_hash, role, nickname, avatar_url, disabled, run_enabled, wallet_address, wallet_chain, created_at, profile_updated_at) VALUES (?, ?, ?, ?, ?, ?, 0, 0, ?, ?, ?, ?) RETURNING id",
-                (uname, uname_norm, pw_str, str(role or "user"), safe_nickname, safe_avatar_url, str(wallet_address or ""), str(wallet_chain or ""), _now_iso(), _now_iso())
-            ).fetchone()
-            conn.commit()
-            new_id = int((row or {}).get("id") or 0)
-            log_sys_event("AUTH_REG_TRACE_4", new_id, "INSERT 成功 (PG)", {})
-            return new_id
-
-        cur = conn.execute(
-            "INSERT INTO users (username, username_norm, password_hash, role, nickname, avatar_url, disabled, run_enabled, wallet_address, wallet_chain, created_at, profile_updated_at) VALUES (?, ?, ?, ?, ?, ?, 0, 0, ?, ?, ?, ?)",
-            (uname, uname_norm, pw_str, str(role or "user"), safe_nickname, safe_avatar_url, str(wallet_address or ""), str(wallet_chain or ""), _now_iso(), _now_iso())
-        )
+        # SQLite 3.35+ 也支援 RETURNING，兩種後端共用同一條 SQL
+        row = conn.execute(
+            "INSERT INTO users (username, username_norm, password_hash, role, nickname, avatar_url, disabled, run_enabled, wallet_address, wallet_chain, created_at, profile_updated_at) VALUES (?, ?, ?, ?, ?, ?, 0, 0, ?, ?, ?, ?) RETURNING id",
+            (uname, uname_norm, pw_str, str(role or "user"), safe_nickname, safe_avatar_url, str(wallet_address or ""), str(wallet_chain or ""), now, now)
+        ).fetchone()
         conn.commit()
-        new_id = int(cur.lastrowid)
-        log_sys_event("AUTH_REG_TRACE_4", new_id, "INSERT 成功 (SQLite)", {})
+        new_id = int(dict(row or {}).get("id") or 0)
+        _invalidate_user_cache(new_id)
+        log_sys_event("AUTH_REG_TRACE_4", new_id, f"INSERT 成功 ({getattr(conn, 'kind', 'sqlite')})", {})
         return new_id
     except Exception as e:
         conn.rollback()
@@ -2278,12 +3163,60 @@ def set_user_disabled(user_id: int, disabled: bool) -> None:
     try:
         conn.execute("UPDATE users SET disabled = ? WHERE id = ?", (1 if disabled else 0, int(user_id)))
         conn.commit()
+        _invalidate_user_cache(int(user_id))
+    finally:
+        conn.close()
+
+
+def set_user_admin(user_id: int, *, run_enabled: bool = False) -> None:
+    """把帳號設為啟用中的 admin（run_enabled=True 時一併開啟算力），並清掉該用戶快取。"""
+    conn = _conn()
+    try:
+        if run_enabled:
+            conn.execute("UPDATE users SET role = 'admin', run_enabled = 1, disabled = 0 WHERE id = ?", (int(user_id),))
+        else:
+            conn.execute("UPDATE users SET role = 'admin', disabled = 0 WHERE id = ?", (int(user_id),))
+        conn.commit()
+        _invalidate_user_cache(int(user_id))
+    finally:
+        conn.close()
+
+
+_USER_NARROW_COLUMNS = frozenset({"disabled", "run_enabled", "wallet_address", "wallet_chain", "role", "username"})
+
+
+def _get_user_cols(user_id: int, cols: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+    """只撈呼叫端需要的欄位；優先命中用戶快取，未命中才走窄 SELECT。"""
+    try:
+        uid = int(user_id)
+    except Exception:
+        return None
+    cached = _user_cache_get(uid)
+    if cached is not None:
+        return {c: cached.get(c) for c in cols}
+    for c in cols:
+        if c not in _USER_NARROW_COLUMNS:
+            raise ValueError(f"unsupported user column: {c}")
+    conn = _conn()
+    try:
+        row = conn.execute(f"SELECT {', '.join(cols)} FROM users WHERE id = ? LIMIT 1", (uid,)).fetchone()
+        return dict(row) if row else None
     finally:
         conn.close()
 
 
+def _get_user_col(user_id: int, col: str) -> Any:
+    row = _get_user_cols(user_id, (col,))
+    if row is None:
+        return None
+    return row.get(col)
+
+
 def is_user_locked(user_id: int) -> bool:
-    row = get_user_by_id(user_id)
+    try:
+        row = _get_user_cols(user_id, ("disabled",))
+    except Exception:
+        return True
     if not row:
         return True
     try:
@@ -2307,6 +3240,7 @@ def update_user_login_state(user_id: int, success: bool = True) -> None:
             try:
                 conn.execute("UPDATE users SET last_login_at = ?, run_enabled = 0 WHERE id = ?", (now, int(user_id)))
                 conn.commit()
+                _invalidate_user_cache(int(user_id))
                 log_sys_event("AUTH_STATE_TRACE_3", user_id, "users 表更新成功", {})
             except Exception as e:
                 conn.rollback()
@@ -2325,64 +3259,66 @@ def update_user_login_state(user_id: int, success: bool = True) -> None:
 
 
 def get_user_run_enabled(user_id: int) -> bool:
-    row = get_user_by_id(user_id)
-    if not row:
-        return False
     try:
-        return int(row["run_enabled"] or 0) == 1
+        return int(_get_user_col(user_id, "run_enabled") or 0) == 1
     except Exception:
         return False
 
 
+_SQL_SET_USER_RUN_ENABLED = "UPDATE users SET run_enabled = ? WHERE id = ?"
+_SQL_RECYCLE_USER_TASKS = """
+    UPDATE mining_tasks
+    SET status='assigned',
+        lease_id=NULL,
+        lease_worker_id=NULL,
+        lease_expires_at=NULL,
+        updated_at=?
+    WHERE user_id=? AND status IN ('running', 'queued')
+"""
+
+
 def set_user_run_enabled(user_id: int, enabled: bool) -> None:
     uid = int(user_id or 0)
     if uid <= 0:
         return
 
-    import time, random
-    for attempt in range(10):
+    # 鎖等待交給 _conn() 的 PRAGMA busy_timeout 在引擎內處理，不再 Python 端 sleep 重試
+    try:
+        conn = _conn()
         try:
-            conn = _conn()
-            try:
-                conn.execute("UPDATE users SET run_enabled = ? WHERE id = ?", (1 if enabled else 0, uid))
-                conn.commit() # 先存檔，避免後續報錯導致狀態遺失
+            # 開關與任務回收同一個交易；回收失敗才退回兩段寫入，開關狀態不會遺失
+            conn.execute(_SQL_SET_USER_RUN_ENABLED, (1 if enabled else 0, uid))
 
-                # 關閉時：回收該 user 所有 running/queued 任務，避免卡死或浪費算力
-                if not bool(enabled):
-                    now = _now_iso()
-                    try:
-                        conn.execute(
-                            """
-                            UPDATE mining_tasks
-                            SET status='assigned',
-                                lease_id=NULL,
-                                lease_worker_id=NULL,
-                                lease_expires_at=NULL,
-                                updated_at=?
-                            WHERE user_id=? AND status IN ('running', 'queued')
-                            """,
-                            (now, uid),
-                        )
-                        conn.commit()
-                    except Exception:
-                        conn.rollback() # 清除 Postgres 的交易死鎖狀態
-                        conn.execute(
-                            "UPDATE mining_tasks SET status='assigned', updated_at=? WHERE user_id=? AND status IN ('running', 'queued')",
-                            (now, uid),
-                        )
-                        conn.commit()
-                break
-            finally:
-                conn.close()
-        except Exception as e:
-            if attempt == 9:
-                import sys
-                print(f"[CRITICAL DB ERROR] set_user_run_enabled 放棄重試: {e}", file=sys.stderr)
-            time.sleep(random.uniform(0.1, 0.5) * (1.2 ** attempt))
+            # 關閉時：回收該 user 所有 running/queued 任務，避免卡死或浪費算力
+            if not bool(enabled):
+                now = _now_iso()
+                try:
+                    conn.execute(_SQL_RECYCLE_USER_TASKS, (now, uid))
+                except Exception as e_lease:
+                    conn.rollback() # 清除 Postgres 的交易死鎖狀態
+                    conn.execute(_SQL_SET_USER_RUN_ENABLED, (0, uid))
+                    conn.commit()
+                    _invalidate_user_cache(uid)
+                    # 只有真的缺 lease_* 欄位才退回舊版 UPDATE，其餘錯誤直接往外拋
+                    if _LEASE_COLS_READY or "lease_" not in str(e_lease).lower():
+                        raise
+                    conn.execute(
+                        "UPDATE mining_tasks SET status='assigned', updated_at=? WHERE user_id=? AND status IN ('running', 'queued')",
+                        (now, uid),
+                    )
+            conn.commit()
+            _invalidate_user_cache(uid)
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"[CRITICAL DB ERROR] set_user_run_enabled 失敗: {e}", file=_sys.stderr)
 
 
 def get_wallet_info(user_id: int) -> Dict[str, str]:
-    row = get_user_by_id(user_id)
+    try:
+        row = _get_user_cols(user_id, ("wallet_address", "wallet_chain"))
+    except Exception:
+        row = None
     if not row:
         return {"wallet_address": "", "wallet_chain": ""}
     return {
@@ -2403,43 +3339,94 @@ def set_wallet_address(user_id: int, wallet_address: str, wallet_chain: str = ""
             (str(wallet_address or ""), str(wallet_chain or ""), int(user_id)),
         )
         conn.commit()
+        _invalidate_user_cache(int(user_id))
     finally:
         conn.close()
 
 
+def _settings_cache_enabled() -> bool:
+    return str(os.environ.get("SHEEP_SETTINGS_CACHE", "1") or "1").strip().lower() not in {"0", "false", "no", "off"}
+
+
+def _invalidate_settings_cache(*keys: str) -> None:
+    now_mono = time.monotonic()
+    with _SETTINGS_CACHE["lock"]:
+        if not keys:
+            _SETTINGS_CACHE["values"].clear()
+            return
+        hold_until = now_mono + float(_SETTINGS_CACHE.get("ttl") or 0.0)
+        scope = _db_cache_scope()
+        for k in keys:
+            _SETTINGS_CACHE["values"].pop((scope, str(k)), None)
+            _SETTINGS_CACHE["hold"][(scope, str(k))] = hold_until
+
+
+def _settings_cache_get(k: str) -> Tuple[bool, Optional[str]]:
+    # 以目前資料庫 scope 區隔，切換 SHEEP_DB_PATH / SHEEP_DB_URL 後不會讀到另一個資料庫的設定
+    ck = (_db_cache_scope(), k)
+    with _SETTINGS_CACHE["lock"]:
+        hit = _SETTINGS_CACHE["values"].get(ck)
+    if hit is None or hit[0] <= time.monotonic():
+        return False, None
+    return True, hit[1]
+
+
+def _settings_cache_put(k: str, raw: Optional[str]) -> None:
+    now_mono = time.monotonic()
+    ck = (_db_cache_scope(), k)
+    with _SETTINGS_CACHE["lock"]:
+        hold = _SETTINGS_CACHE["hold"]
+        if hold.get(ck, 0.0) > now_mono:
+            return
+        hold.pop(ck, None)
+        _SETTINGS_CACHE["values"][ck] = (now_mono + float(_SETTINGS_CACHE.get("ttl") or 0.0), raw)
+
+
+def _settings_value(raw: Optional[str], default: Any) -> Any:
+    if raw is None:
+        return default
+    try:
+        return _fast_json_loads(raw)
+    except Exception:
+        return raw
+
+
+def _read_setting_raw(conn: Any, k: str) -> Optional[str]:
+    row = conn.execute("SELECT value FROM settings WHERE key = ? LIMIT 1", (k,)).fetchone()
+    if not row:
+        return None
+    return dict(row).get("value")
+
+
 def get_setting(arg1: Any, arg2: Any = None, arg3: Any = None) -> Any:
     if bool(getattr(arg1, "_is_db_conn", False)):
         conn = arg1
         k = str(arg2 or "").strip()
         default = arg3
-        if not k:
-            return default
-        row = conn.execute("SELECT value FROM settings WHERE key = ? LIMIT 1", (k,)).fetchone()
-        if not row:
-            return default
-        row_dict = dict(row)
-        try:
-            return json.loads(row_dict.get("value"))
-        except Exception:
-            return row_dict.get("value")
     else:
+        conn = None
         k = str(arg1 or "").strip()
         default = arg2
 
     if not k:
         return default
-    conn = _conn()
-    try:
-        row = conn.execute("SELECT value FROM settings WHERE key = ? LIMIT 1", (k,)).fetchone()
-        if not row:
-            return default
-        row_dict = dict(row)
+    use_cache = _settings_cache_enabled()
+    if use_cache:
+        hit, raw = _settings_cache_get(k)
+        if hit:
+            return _settings_value(raw, default)
+
+    if conn is not None:
+        raw = _read_setting_raw(conn, k)
+    else:
+        conn = _conn()
         try:
-            return json.loads(row_dict.get("value"))
-        except Exception:
-            return row_dict.get("value")
-    finally:
-        conn.close()
+            raw = _read_setting_raw(conn, k)
+        finally:
+            conn.close()
+    if use_cache:
+        _settings_cache_put(k, raw)
+    return _settings_value(raw, default)
 
 
 def set_setting(arg1: Any, arg2: Any, arg3: Any = None) -> None:
@@ -2458,6 +3445,9 @@ def set_setting(arg1: Any, arg2: Any, arg3: Any = None) -> None:
             """,
             (k, v_json, _now_iso()),
         )
+        _invalidate_settings_cache(k)
+        if k == "default_avatar_data_url":
+            _invalidate_default_avatar_cache()
         return
 
     k = str(arg1 or "").strip()
@@ -2478,6 +3468,9 @@ def set_setting(arg1: Any, arg2: Any, arg3: Any = None) -> None:
         conn.commit()
     finally:
         conn.close()
+    _invalidate_settings_cache(k)
+    if k == "default_avatar_data_url":
+        _invalidate_default_avatar_cache()
 
 
 def get_settings_details(keys: List[str]) -> Dict[str, Dict[str, Any]]:
@@ -2496,7 +3489,7 @@ def get_settings_details(keys: List[str]) -> Dict[str, Dict[str, Any]]:
             row_dict = dict(row)
             value = row_dict.get("value")
             try:
-                value = json.loads(value)
+                value = _fast_json_loads(value)
             except Exception:
                 pass
 
@@ -2511,17 +3504,201 @@ def get_settings_details(keys: List[str]) -> Dict[str, Dict[str, Any]]:
 
 
 
-def write_audit_log(user_id: Optional[int], action: str, payload: Any) -> None:
-    conn = _conn()
-    try:
-        payload_json = json.dumps(payload or {}, ensure_ascii=False)
-        conn.execute(
-            "INSERT INTO audit_logs (user_id, action, payload_json, created_at) VALUES (?, ?, ?, ?)",
-            (int(user_id) if user_id is not None else None, str(action or ""), payload_json, _now_iso()),
-        )
-        conn.commit()
+# audit_logs / worker_events / sys_monitor_events 走 write-behind：由單一背景執行緒批次寫入，不佔請求延遲
+_WRITE_BEHIND_SQL = {
+    "audit_logs": "INSERT INTO audit_logs (user_id, action, payload_json, created_at) VALUES (?, ?, ?, ?)",
+    "worker_events": "INSERT INTO worker_events (ts, user_id, worker_id, event, detail_json) VALUES (?, ?, ?, ?, ?)",
+    "sys_monitor_events": "INSERT INTO sys_monitor_events (event_type, user_id, message, detail_json, created_at) VALUES (?, ?, ?, ?, ?)",
+}
+# 佇列項目為 (scope, table, params)：scope 是入列當下的 DB（見 _db_cache_scope），
+# 背景寫入時照 scope 分組落地，切換 SHEEP_DB_PATH 之後舊列不會寫進新庫。
+# pending 數的是已入列、尚未寫完的列（含背景執行緒已取出、還在湊批的列），flush 靠它確認讀後即查看得到
+_WRITE_BEHIND: Dict[str, Any] = {
+    "queue": queue.Queue(maxsize=100000),
+    "lock": threading.Lock(),
+    "flush_lock": threading.Lock(),
+    "pending": 0,
+    "pending_cond": threading.Condition(),
+    "thread": None,
+    "batch": 500,
+    "wait_s": 0.2,
+    "flush_wait_s": 10.0,
+}
+# flush 丟進佇列的喚醒標記：讓背景執行緒結束湊批等待、立刻寫出手上的列
+_WRITE_BEHIND_WAKE = object()
+
+
+def _write_behind_enabled() -> bool:
+    return str(os.environ.get("SHEEP_DB_WRITE_BEHIND", "1") or "1").strip().lower() not in {"0", "false", "no", "off"}
+
+
+def _conn_for_scope(scope: str) -> Optional[_DBConn]:
+    """開到 scope（見 _db_cache_scope）指向的 DB；背景工作在 DB 切換後仍寫回原本的庫。"""
+    if scope == _db_cache_scope() or not scope.startswith("sqlite:"):
+        return _conn()
+    # DB 已切換：連回當初的 SQLite 檔；檔案已不存在就不要憑空建出空庫
+    path = scope[len("sqlite:"):]
+    if not os.path.exists(path):
+        return None
+    return _sqlite_conn(path)
+
+
+def _write_behind_write(items: List[Tuple[str, str, Tuple[Any, ...]]]) -> None:
+    if not items:
+        return
+    by_scope: Dict[str, Dict[str, List[Tuple[Any, ...]]]] = {}
+    for scope, table, params in items:
+        by_scope.setdefault(scope, {}).setdefault(table, []).append(params)
+    for scope, grouped in by_scope.items():
+        conn = _conn_for_scope(scope)
+        if conn is None:
+            dropped = sum(len(rows) for rows in grouped.values())
+            print(f"[DB ERROR] write-behind 目標資料庫已不存在，丟棄 {dropped} 列: {scope}", file=_sys.stderr, flush=True)
+            continue
+        try:
+            _write_behind_write_grouped(conn, grouped)
+        finally:
+            conn.close()
+
+
+def _write_behind_write_grouped(conn: Any, grouped: Dict[str, List[Tuple[Any, ...]]]) -> None:
+    try:
+        for table, rows in grouped.items():
+            conn.executemany(_WRITE_BEHIND_SQL[table], rows, batch=True)
+        conn.commit()
+        return
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+    # 批次失敗時退回逐列寫入，只丟掉真正寫不進去的那幾列
+    for table, rows in grouped.items():
+        for params in rows:
+            try:
+                conn.execute(_WRITE_BEHIND_SQL[table], params)
+                conn.commit()
+            except Exception as e:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                print(f"[DB ERROR] write-behind 寫入 {table} 失敗: {e}", file=_sys.stderr, flush=True)
+
+
+def _write_behind_done(n: int) -> None:
+    with _WRITE_BEHIND["pending_cond"]:
+        _WRITE_BEHIND["pending"] = max(0, int(_WRITE_BEHIND["pending"]) - int(n))
+        _WRITE_BEHIND["pending_cond"].notify_all()
+
+
+def _write_behind_drain(first: Optional[Tuple[str, str, Tuple[Any, ...]]], limit: int, wait_s: float) -> List[Tuple[str, str, Tuple[Any, ...]]]:
+    q = _WRITE_BEHIND["queue"]
+    items: List[Tuple[str, str, Tuple[Any, ...]]] = [first] if first is not None else []
+    deadline = time.monotonic() + max(0.0, float(wait_s))
+    while len(items) < limit:
+        remaining = deadline - time.monotonic()
+        try:
+            item = q.get(timeout=remaining) if remaining > 0 else q.get_nowait()
+        except queue.Empty:
+            break
+        if item is _WRITE_BEHIND_WAKE:
+            # 有人在等 flush：不再湊批，改成只收佇列裡現成的列
+            deadline = 0.0
+            continue
+        items.append(item)
+    return items
+
+
+def _write_behind_write_locked(items: List[Tuple[str, str, Tuple[Any, ...]]]) -> None:
+    try:
+        with _WRITE_BEHIND["flush_lock"]:
+            _write_behind_write(items)
     finally:
-        conn.close()
+        _write_behind_done(len(items))
+
+
+def _write_behind_loop() -> None:
+    q = _WRITE_BEHIND["queue"]
+    while True:
+        try:
+            first = q.get()
+            if first is _WRITE_BEHIND_WAKE:
+                continue
+            # 湊批等待不持有 flush_lock，讀取端的 flush 不必陪著等滿 wait_s
+            items = _write_behind_drain(first, int(_WRITE_BEHIND["batch"]), float(_WRITE_BEHIND["wait_s"]))
+            _write_behind_write_locked(items)
+        except Exception as e:
+            print(f"[DB ERROR] write-behind 背景寫入失敗: {e}", file=_sys.stderr, flush=True)
+            time.sleep(0.5)
+
+
+def _write_behind_put(table: str, params: Tuple[Any, ...]) -> None:
+    item = (_db_cache_scope(), table, params)
+    if not _write_behind_enabled():
+        _write_behind_write([item])
+        return
+    with _WRITE_BEHIND["lock"]:
+        t = _WRITE_BEHIND.get("thread")
+        if t is None or not t.is_alive():
+            t = threading.Thread(target=_write_behind_loop, name="sheep-db-write-behind", daemon=True)
+            t.start()
+            _WRITE_BEHIND["thread"] = t
+    with _WRITE_BEHIND["pending_cond"]:
+        _WRITE_BEHIND["pending"] = int(_WRITE_BEHIND["pending"]) + 1
+    try:
+        _WRITE_BEHIND["queue"].put_nowait(item)
+    except queue.Full:
+        # 佇列塞滿代表背景寫入跟不上，退回同步寫入而不是丟資料
+        _write_behind_done(1)
+        _write_behind_write([item])
+
+
+def flush_write_behind() -> None:
+    """把尚未寫入的 audit_logs / worker_events / sys_monitor_events 佇列同步寫完（程式結束或需要讀後即查時呼叫）。
+
+    先自己把佇列裡的列寫掉，再等背景執行緒寫完它已取出的那一批；回傳時呼叫前入列的列都已落地。
+    """
+    while True:
+        items = _write_behind_drain(None, int(_WRITE_BEHIND["batch"]), 0.0)
+        if not items:
+            break
+        try:
+            _write_behind_write_locked(items)
+        except Exception as e:
+            print(f"[DB ERROR] write-behind flush 失敗: {e}", file=_sys.stderr, flush=True)
+            return
+
+    cond = _WRITE_BEHIND["pending_cond"]
+    with cond:
+        if int(_WRITE_BEHIND["pending"]) <= 0:
+            return
+    try:
+        _WRITE_BEHIND["queue"].put_nowait(_WRITE_BEHIND_WAKE)
+    except queue.Full:
+        pass
+    deadline = time.monotonic() + float(_WRITE_BEHIND["flush_wait_s"])
+    with cond:
+        while int(_WRITE_BEHIND["pending"]) > 0:
+            remaining = deadline - time.monotonic()
+            t = _WRITE_BEHIND.get("thread")
+            if remaining <= 0 or t is None or not t.is_alive():
+                break
+            cond.wait(timeout=min(remaining, 0.5))
+
+
+try:
+    atexit.register(flush_write_behind)
+except Exception:
+    pass
+
+
+def write_audit_log(user_id: Optional[int], action: str, payload: Any) -> None:
+    payload_json = json.dumps(payload or {}, ensure_ascii=False)
+    _write_behind_put(
+        "audit_logs",
+        (int(user_id) if user_id is not None else None, str(action or ""), payload_json, _now_iso()),
+    )
 
 def create_api_token(user_id: int, ttl_seconds: int, name: str = "worker") -> dict:
     log_sys_event("AUTH_TOKEN_STEP_1", user_id, "進入核發 API Token 函數", {"ttl": ttl_seconds, "name": name})
@@ -2537,22 +3714,14 @@ def create_api_token(user_id: int, ttl_seconds: int, name: str = "worker") -> di
         return {}
 
     try:
-        if getattr(conn, "kind", "sqlite") == "postgres":
-            row = conn.execute(
-                "INSERT INTO api_tokens (user_id, token, name, expires_at, created_at) VALUES (?, ?, ?, ?, ?) RETURNING id",
-                (user_id, token, name, expires_at, _now_iso())
-            ).fetchone()
-            conn.commit()
-            log_sys_event("AUTH_TOKEN_STEP_2", user_id, "成功核發 API Token (PG)", {})
-            return {"token_id": int((row or {}).get("id") or 0), "token": token, "expires_at": expires_at, "issued_at": _now_iso()}
-
-        cur = conn.execute(
-            "INSERT INTO api_tokens (user_id, token, name, expires_at, created_at) VALUES (?, ?, ?, ?, ?)",
-            (user_id, token, name, expires_at, _now_iso())
-        )
+        issued_at = _now_iso()
+        row = conn.execute(
+            "INSERT INTO api_tokens (user_id, token, name, expires_at, created_at) VALUES (?, ?, ?, ?, ?) RETURNING id",
+            (user_id, token, name, expires_at, issued_at)
+        ).fetchone()
         conn.commit()
-        log_sys_event("AUTH_TOKEN_STEP_2", user_id, "成功核發 API Token (SQLite)", {})
-        return {"token_id": cur.lastrowid, "token": token, "expires_at": expires_at, "issued_at": _now_iso()}
+        log_sys_event("AUTH_TOKEN_STEP_2", user_id, f"成功核發 API Token ({getattr(conn, 'kind', 'sqlite')})", {})
+        return {"token_id": int(dict(row or {}).get("id") or 0), "token": token, "expires_at": expires_at, "issued_at": issued_at}
     except Exception as e:
         conn.rollback()
         import traceback
@@ -2601,26 +3770,64 @@ def list_api_tokens_for_user(user_id: int, name: str = "") -> list:
                 "SELECT * FROM api_tokens WHERE user_id = ? ORDER BY id DESC",
                 (int(user_id),),
             )
-        return [dict(row) for row in cur.fetchall()]
+        return _fetchall_dicts(cur)
     finally:
         conn.close()
 
+_VERIFY_TOKEN_USER_COLUMNS: Tuple[str, ...] = (
+    "id", "username", "username_norm", "password_hash", "role", "nickname", "avatar_url",
+    "disabled", "run_enabled", "wallet_address", "wallet_chain", "created_at", "last_login_at", "profile_updated_at",
+)
+_VERIFY_TOKEN_SQL = (
+    "SELECT t.*, "
+    + ", ".join(f"u.{col} AS u__{col}" for col in _VERIFY_TOKEN_USER_COLUMNS)
+    + " FROM api_tokens t JOIN users u ON u.id = t.user_id WHERE t.token = ? AND t.expires_at >= ? LIMIT 1"
+)
+
+
 def verify_api_token(token: str) -> Optional[dict]:
     conn = _conn()
     try:
-        row = conn.execute("SELECT * FROM api_tokens WHERE token = ? LIMIT 1", (token,)).fetchone()
+        # token 與 user 一次 JOIN 撈回，過期判斷下推到 SQL
+        row = conn.execute(_VERIFY_TOKEN_SQL, (token, _now_iso())).fetchone()
         if not row: return None
-        if _now_iso() > row["expires_at"]: return None
-        user = conn.execute("SELECT * FROM users WHERE id = ?", (row["user_id"],)).fetchone()
-        if not user: return None
-        return {"user": dict(user), "token": dict(row)}
+        token_row: Dict[str, Any] = {}
+        user_row: Dict[str, Any] = {}
+        for key, value in dict(row).items():
+            if key.startswith("u__"):
+                user_row[key[3:]] = value
+            else:
+                token_row[key] = value
+        return {"user": user_row, "token": token_row}
     except Exception as e:
         print(f"[DB ERROR] verify_api_token: {e}")
         return None
     finally:
         conn.close()
 
+_API_TOKEN_TOUCH: Dict[str, Any] = {
+    "last": {},
+    "interval": 60.0,
+    "lock": threading.Lock(),
+}
+
+
 def touch_api_token(token_id: int, ip: str = "", user_agent: str = "") -> None:
+    # 滑動效期只需分鐘級精度，同一 token 60 秒內只寫一次
+    try:
+        tid = int(token_id or 0)
+    except Exception:
+        tid = 0
+    now_mono = time.monotonic()
+    with _API_TOKEN_TOUCH["lock"]:
+        last_touch = _API_TOKEN_TOUCH["last"]
+        if tid > 0 and now_mono - float(last_touch.get(tid, -1e18)) < float(_API_TOKEN_TOUCH["interval"]):
+            return
+        if tid > 0:
+            last_touch[tid] = now_mono
+            if len(last_touch) > 50000:
+                last_touch.clear()
+                last_touch[tid] = now_mono
     conn = _conn()
     try:
         # [專家級修復] 更新最近活動時間，避免使用者活躍期間 Token 無預警過期
@@ -2639,7 +3846,55 @@ def touch_api_token(token_id: int, ip: str = "", user_agent: str = "") -> None:
 # [專家修復] 已移除重複宣告的 _db_path 與 _conn 函式，防止模組載入時發生路徑解析覆蓋衝突。
 from datetime import datetime as _safe_dt, timezone as _safe_tz, timedelta as _safe_td
 
+def _invalidate_active_cycle_cache() -> None:
+    with _ACTIVE_CYCLE_CACHE["lock"]:
+        _ACTIVE_CYCLE_CACHE["value"] = None
+        _ACTIVE_CYCLE_CACHE["expires_at"] = 0.0
+        _ACTIVE_CYCLE_CACHE["rollover_checked_at"] = 0.0
+
+
+def _active_cycle_cache_sync_scope_locked() -> None:
+    # 快取的週期屬於哪個資料庫；SHEEP_DB_PATH / SHEEP_DB_URL 換掉後整筆作廢，視為未命中
+    scope = _db_cache_scope()
+    if _ACTIVE_CYCLE_CACHE["scope"] != scope:
+        _ACTIVE_CYCLE_CACHE["value"] = None
+        _ACTIVE_CYCLE_CACHE["expires_at"] = 0.0
+        _ACTIVE_CYCLE_CACHE["rollover_checked_at"] = 0.0
+        _ACTIVE_CYCLE_CACHE["scope"] = scope
+
+
+def _active_cycle_cache_get() -> Optional[Dict[str, Any]]:
+    with _ACTIVE_CYCLE_CACHE["lock"]:
+        _active_cycle_cache_sync_scope_locked()
+        cached_cycle = _ACTIVE_CYCLE_CACHE.get("value")
+        if cached_cycle and float(_ACTIVE_CYCLE_CACHE.get("expires_at") or 0.0) > time.monotonic():
+            return dict(cached_cycle)
+    return None
+
+
+def _active_cycle_cache_put(cycle: Dict[str, Any]) -> None:
+    with _ACTIVE_CYCLE_CACHE["lock"]:
+        _active_cycle_cache_sync_scope_locked()
+        _ACTIVE_CYCLE_CACHE["value"] = dict(cycle)
+        _ACTIVE_CYCLE_CACHE["expires_at"] = time.monotonic() + float(_ACTIVE_CYCLE_CACHE.get("ttl") or 0.0)
+
+
 def ensure_cycle_rollover() -> None:
+    # 週期一週才換一次，60 秒內檢查過且快取未到期就跳過
+    now_mono = time.monotonic()
+    with _ACTIVE_CYCLE_CACHE["lock"]:
+        _active_cycle_cache_sync_scope_locked()
+        cached_cycle = _ACTIVE_CYCLE_CACHE.get("value")
+        checked_at = float(_ACTIVE_CYCLE_CACHE.get("rollover_checked_at") or 0.0)
+        interval = float(_ACTIVE_CYCLE_CACHE.get("rollover_interval") or 0.0)
+    if (
+        cached_cycle
+        and checked_at > 0.0
+        and now_mono - checked_at < interval
+        and _now_iso() <= str(cached_cycle.get("end_ts") or "")
+    ):
+        return
+
     conn = _conn()
     try:
         cur = conn.execute("SELECT id, start_ts, end_ts FROM mining_cycles WHERE status = 'active' ORDER BY id DESC LIMIT 1")
@@ -2652,19 +3907,16 @@ def ensure_cycle_rollover() -> None:
             conn.execute("INSERT INTO mining_cycles (name, status, start_ts, end_ts) VALUES (?, ?, ?, ?)",
                             ("Cycle 1", "active", now_str, end_ts))
             conn.commit()
+            _invalidate_active_cycle_cache()
         else:
             if now_str > active["end_ts"]:
                 conn.execute("UPDATE mining_cycles SET status = 'completed' WHERE id = ?", (active["id"],))
                 
                 new_end = (now_dt + _safe_td(days=7)).isoformat()
-                if getattr(conn, "kind", "sqlite") == "postgres":
-                    row_cyc = conn.execute("INSERT INTO mining_cycles (name, status, start_ts, end_ts) VALUES (?, ?, ?, ?) RETURNING id",
-                                    (f"Cycle {active['id'] + 1}", "active", now_str, new_end)).fetchone()
-                    new_cycle_id = int((row_cyc or {}).get("id") or 0)
-                else:
-                    cur2 = conn.execute("INSERT INTO mining_cycles (name, status, start_ts, end_ts) VALUES (?, ?, ?, ?)",
-                                    (f"Cycle {active['id'] + 1}", "active", now_str, new_end))
-                    new_cycle_id = int(cur2.lastrowid)
+                # SQLite 3.35+ 與 PostgreSQL 皆支援 RETURNING，不必再依 backend 分岔取 lastrowid
+                row_cyc = conn.execute("INSERT INTO mining_cycles (name, status, start_ts, end_ts) VALUES (?, ?, ?, ?) RETURNING id",
+                                (f"Cycle {active['id'] + 1}", "active", now_str, new_end)).fetchone()
+                new_cycle_id = int(dict(row_cyc or {}).get("id") or 0)
                 
                 if new_cycle_id <= 0:
                     raise ValueError(f"無法取得新週期的 ID (new_cycle_id={new_cycle_id})，資料庫方言解析異常")
@@ -2720,21 +3972,48 @@ def ensure_cycle_rollover() -> None:
                     )
                     
                 conn.commit()
+                _invalidate_active_cycle_cache()
+            else:
+                with _ACTIVE_CYCLE_CACHE["lock"]:
+                    _active_cycle_cache_sync_scope_locked()
+                    _ACTIVE_CYCLE_CACHE["rollover_checked_at"] = now_mono
     except Exception:
         pass
     finally:
         conn.close()
 
+_SQL_ACTIVE_CYCLE_ROW = "SELECT id, name, status, start_ts, end_ts FROM mining_cycles WHERE status = 'active' ORDER BY id DESC LIMIT 1"
+
+
+def _active_cycle_id(conn: Any) -> int:
+    """在呼叫端既有連線上取 active 週期 id；命中 get_active_cycle 的 TTL 快取就不查表，查到後順手回填快取"""
+    cached_cycle = _active_cycle_cache_get()
+    if cached_cycle:
+        return int(cached_cycle.get("id") or 0)
+    row = conn.execute(_SQL_ACTIVE_CYCLE_ROW).fetchone()
+    if not row:
+        return 0
+    out = dict(row)
+    _active_cycle_cache_put(out)
+    return int(out.get("id") or 0)
+
+
 def get_active_cycle() -> dict:
     import time
+    # active 週期查詢頻繁，10 秒 TTL 快取（找不到時不快取）
+    cached_cycle = _active_cycle_cache_get()
+    if cached_cycle:
+        return cached_cycle
     for attempt in range(5):
         try:
             conn = _conn()
             try:
-                cur = conn.execute("SELECT id, name, status, start_ts, end_ts FROM mining_cycles WHERE status = 'active' ORDER BY id DESC LIMIT 1")
+                cur = conn.execute(_SQL_ACTIVE_CYCLE_ROW)
                 row = cur.fetchone()
                 if row:
-                    return dict(row)
+                    out = dict(row)
+                    _active_cycle_cache_put(out)
+                    return out
                 return {}
             finally:
                 conn.close()
@@ -2753,7 +4032,7 @@ def list_factor_pools(cycle_id: int) -> list:
             conn = _conn()
             try:
                 cur = conn.execute("SELECT * FROM factor_pools WHERE cycle_id = ?", (int(cycle_id),))
-                rows = [dict(row) for row in cur.fetchall()]
+                rows = _fetchall_dicts(cur)
                 
                 if not rows:
                     last_p_cycle = conn.execute("SELECT cycle_id FROM factor_pools ORDER BY cycle_id DESC LIMIT 1").fetchone()
@@ -2761,6 +4040,9 @@ def list_factor_pools(cycle_id: int) -> list:
                         source_cid = last_p_cycle["cycle_id"]
                         print(f"[DB MAINTENANCE] 偵測到週期 {cycle_id} 缺乏 Pool 資料，啟動從週期 {source_cid} 繼承程序...")
                         try:
+                            # [專家級修復] SQLite 先取寫鎖再讀 SUM 與複製，避免兩個請求同時繼承造成 Pool 重複
+                            if getattr(conn, "kind", "sqlite") != "postgres":
+                                conn.execute("BEGIN IMMEDIATE")
                             source_combo_total = _clamp_nonnegative_int(
                                 (
                                     dict(
@@ -2772,17 +4054,23 @@ def list_factor_pools(cycle_id: int) -> list:
                                     )
                                 ).get("total")
                             )
-                            conn.execute("""
+                            cur_copy = conn.execute("""
                                 INSERT INTO factor_pools (cycle_id, name, external_key, symbol, direction, timeframe_min, years, family, grid_spec_json, risk_spec_json, num_partitions, seed, param_combo_count, active, created_at)
                                 SELECT ?, name, COALESCE(external_key, ''), symbol, COALESCE(direction, 'long'), timeframe_min, years, family, grid_spec_json, risk_spec_json, num_partitions, seed, COALESCE(param_combo_count, 0), active, ?
                                 FROM factor_pools WHERE cycle_id = ? AND active = 1
-                            """, (cycle_id, _now_iso(), source_cid))
-                            if source_combo_total > 0:
+                                AND NOT EXISTS (SELECT 1 FROM factor_pools target WHERE target.cycle_id = ?)
+                            """, (cycle_id, _now_iso(), source_cid, cycle_id))
+                            if source_combo_total > 0 and int(getattr(cur_copy, "rowcount", 0) or 0) > 0:
                                 _bump_global_dashboard_counter(conn, _GLOBAL_COUNTER_TOTAL_POOL_COMBOS, source_combo_total)
                             conn.commit()
+                            _invalidate_active_pool_cache(int(cycle_id))
                             cur = conn.execute("SELECT * FROM factor_pools WHERE cycle_id = ?", (cycle_id,))
-                            rows = [dict(row) for row in cur.fetchall()]
+                            rows = _fetchall_dicts(cur)
                         except Exception as rescue_e:
+                            try:
+                                conn.rollback()
+                            except Exception:
+                                pass
                             import traceback
                             print(f"[FATAL DB ERROR] Pool 跨週期繼承失敗: {rescue_e}\n{traceback.format_exc()}")
                 for row in rows:
@@ -3035,7 +4323,6 @@ def log_sys_event(event_type: str, user_id: Optional[int], message: str, detail:
 
     import sys
     import json
-    import threading
     import traceback
 
     safe_message = redact_text(message)
@@ -3047,14 +4334,13 @@ def log_sys_event(event_type: str, user_id: Optional[int], message: str, detail:
     # 第一道防線：直接印到 Docker Console，就算資料庫炸了也看得到
     print(f"[SYS_EVENT] {event_type} | UID:{user_id} | MSG:{safe_message} | DETAIL:{payload_str}", file=sys.stderr, flush=True)
 
+    params = (event_type, user_id, safe_message, payload_str, _now_iso())
+
     def _write_event():
         try:
             conn = _conn()
             try:
-                conn.execute(
-                    "INSERT INTO sys_monitor_events (event_type, user_id, message, detail_json, created_at) VALUES (?, ?, ?, ?, ?)",
-                    (event_type, user_id, safe_message, payload_str, _now_iso())
-                )
+                conn.execute(_WRITE_BEHIND_SQL["sys_monitor_events"], params)
                 conn.commit()
             finally:
                 conn.close()
@@ -3067,9 +4353,34 @@ def log_sys_event(event_type: str, user_id: Optional[int], message: str, detail:
         _write_event()
         return
 
-    # 第二道防線：丟進背景執行緒，主程式不需等待寫入完成，徹底消滅日誌引發的連環卡死
-    t = threading.Thread(target=_write_event, daemon=True)
-    t.start()
+    # 第二道防線：交給 write-behind 背景執行緒批次寫入，不再每筆事件各開一條執行緒
+    try:
+        _write_behind_put("sys_monitor_events", params)
+    except Exception:
+        _write_event()
+
+
+# 派發任務多列 VALUES 每批筆數上限（7 個參數 x 100 = 700，低於舊版 SQLite 的 999 上限）
+_ASSIGN_TASKS_INSERT_CHUNK = 100
+
+
+@lru_cache(maxsize=64)
+def _assign_tasks_insert_sql(kind: str, n: int) -> str:
+    # Postgres 端同分區只要還有 assigned/running/queued/completed 任務就不重派；SQLite 維持原本只看分區是否出現過
+    status_filter = " AND t.status IN ('assigned', 'running', 'queued', 'completed')" if kind == "postgres" else ""
+    values = ", ".join("(?, ?, ?, ?, ?, ?, ?)" for _ in range(int(n)))
+    return (
+        f"WITH v(user_id, pool_id, cycle_id, partition_idx, num_partitions, created_at, updated_at) AS (VALUES {values}) "
+        "INSERT INTO mining_tasks (user_id, pool_id, cycle_id, partition_idx, num_partitions, status, created_at, updated_at) "
+        "SELECT v.user_id, v.pool_id, v.cycle_id, v.partition_idx, v.num_partitions, 'assigned', v.created_at, v.updated_at FROM v "
+        "WHERE NOT EXISTS (SELECT 1 FROM mining_tasks t WHERE t.pool_id = v.pool_id AND t.partition_idx = v.partition_idx "
+        f"AND t.cycle_id = v.cycle_id{status_filter}) "
+        # 並發派發搶到同一分區時撞唯一索引的列直接略過（不帶 conflict target，任一唯一索引皆適用），
+        # 不讓單一衝突拖垮整批；略過的列不會出現在 RETURNING，派發數照樣正確
+        "ON CONFLICT DO NOTHING "
+        "RETURNING id"
+    )
+
 
 def assign_tasks_for_user(user_id: int, cycle_id: int = 0, min_tasks: int = 2, max_tasks: int = 6, preferred_family: str = "") -> None:
     """[專家級修復] 原子性任務派發，完全消滅競態條件與重複分配
@@ -3079,164 +4390,136 @@ def assign_tasks_for_user(user_id: int, cycle_id: int = 0, min_tasks: int = 2, m
     2. 單一交易完成讀取 → 檢查 → 派發，無中斷窗口
     3. 插入前驗證分區未被佔用（INSERT ... SELECT ... WHERE NOT EXISTS）
     """
-    import time, random
-    for attempt in range(5):
+    import random
+    # 鎖等待交給 PRAGMA busy_timeout，不在 Python 端 sleep 後重跑整段
+    try:
+        conn = _conn()
         try:
-            conn = _conn()
-            try:
-                # [獨家修復] 立即加鎖，防止並發請求在此用戶的派發過程中介入
-                if getattr(conn, "kind", "sqlite") == "postgres":
-                    # PostgreSQL：行鎖定
-                    conn.execute("SELECT 1 FROM users WHERE id = ? FOR UPDATE", (user_id,))
-                else:
-                    # SQLite：表鎖定
-                    try:
-                        conn.execute("PRAGMA query_only = FALSE")
-                    except Exception:
-                        pass
+            # [獨家修復] 立即加鎖，防止並發請求在此用戶的派發過程中介入
+            if getattr(conn, "kind", "sqlite") == "postgres":
+                # PostgreSQL：行鎖定
+                conn.execute("SELECT 1 FROM users WHERE id = ? FOR UPDATE", (user_id,))
+            else:
+                # SQLite：表鎖定
+                try:
+                    conn.execute("PRAGMA query_only = FALSE")
+                except Exception:
+                    pass
                 
+            if cycle_id <= 0:
+                cycle_id = _active_cycle_id(conn)
                 if cycle_id <= 0:
-                    cycle_row = conn.execute("SELECT id FROM mining_cycles WHERE status = 'active' ORDER BY id DESC LIMIT 1").fetchone()
-                    if not cycle_row: 
-                        log_sys_event("TASK_ASSIGN_FAIL", user_id, "找不到 Active 狀態的週期，無法派發", {})
-                        return
-                    cycle_id = cycle_row["id"]
+                    log_sys_event("TASK_ASSIGN_FAIL", user_id, "找不到 Active 狀態的週期，無法派發", {})
+                    return
                 
-                # [改進] 使用 COUNT 而非 FETCHALL，減少記憶體開銷
-                cur = conn.execute("SELECT COUNT(*) as c FROM mining_tasks WHERE user_id = ? AND status IN ('assigned', 'running', 'queued') AND cycle_id = ?", (user_id, cycle_id))
-                row = cur.fetchone()
-                if row is None:
-                    current_tasks = 0
-                else:
-                    try:
-                        current_tasks = int(row["c"] or 0)
-                    except Exception:
-                        current_tasks = int(row[0] or 0)
+            # [改進] 使用 COUNT 而非 FETCHALL，減少記憶體開銷
+            # 等值欄位在前、IN 清單在後，對齊 idx_mining_tasks_user_cycle_status_id (user_id, cycle_id, status, id) 做索引範圍掃描
+            cur = conn.execute("SELECT COUNT(*) as c FROM mining_tasks WHERE user_id = ? AND cycle_id = ? AND status IN ('assigned', 'running', 'queued')", (user_id, cycle_id))
+            row = cur.fetchone()
+            if row is None:
+                current_tasks = 0
+            else:
+                try:
+                    current_tasks = int(row["c"] or 0)
+                except Exception:
+                    current_tasks = int(row[0] or 0)
                 
-                if current_tasks >= min_tasks:
-                    # 靜謐無聲返回，避免日誌污染
-                    break
+            if current_tasks >= min_tasks:
+                # 靜謐無聲返回，避免日誌污染
+                return
                     
-                needed = min(max_tasks - current_tasks, min_tasks - current_tasks)
-                if needed <= 0:
-                    break
+            needed = min(max_tasks - current_tasks, min_tasks - current_tasks)
+            if needed <= 0:
+                return
                 
-                # 池列表查詢（維持原邏輯）
-                pools = _list_active_assignment_pools(conn, cycle_id, preferred_family)
+            # 池列表查詢（維持原邏輯）
+            pools = _list_active_assignment_pools(conn, cycle_id, preferred_family)
                     
-                if not pools:
-                    # 緊急繼承邏輯（維持原樣）
-                    try:
-                        last_p_cycle = conn.execute("SELECT cycle_id FROM factor_pools WHERE active = 1 AND cycle_id > 0 ORDER BY cycle_id DESC LIMIT 1").fetchone()
-                        if last_p_cycle and last_p_cycle["cycle_id"] != cycle_id:
-                            source_cid = last_p_cycle["cycle_id"]
-                            log_sys_event("TASK_ASSIGN_RESCUE", user_id, f"偵測到週期 {cycle_id} 缺乏 Pool，緊急從週期 {source_cid} 繼承", {"source_cid": source_cid})
+            if not pools:
+                # 緊急繼承邏輯（維持原樣）
+                try:
+                    last_p_cycle = conn.execute("SELECT cycle_id FROM factor_pools WHERE active = 1 AND cycle_id > 0 ORDER BY cycle_id DESC LIMIT 1").fetchone()
+                    if last_p_cycle and last_p_cycle["cycle_id"] != cycle_id:
+                        source_cid = last_p_cycle["cycle_id"]
+                        log_sys_event("TASK_ASSIGN_RESCUE", user_id, f"偵測到週期 {cycle_id} 缺乏 Pool，緊急從週期 {source_cid} 繼承", {"source_cid": source_cid})
                             
-                            conn.execute("""
-                                INSERT INTO factor_pools (cycle_id, name, external_key, symbol, direction, timeframe_min, years, family, grid_spec_json, risk_spec_json, num_partitions, seed, param_combo_count, active, created_at)
-                                SELECT ?, name, COALESCE(external_key, ''), symbol, COALESCE(direction, 'long'), timeframe_min, years, family, grid_spec_json, risk_spec_json, num_partitions, seed, COALESCE(param_combo_count, 0), active, ?
-                                FROM factor_pools WHERE cycle_id = ? AND active = 1
-                            """, (cycle_id, _now_iso(), source_cid))
-                            conn.commit()
-                            _invalidate_active_pool_cache(cycle_id)
-                            pools = _list_active_assignment_pools(conn, cycle_id, preferred_family)
-                    except Exception as rescue_e:
-                        conn.rollback()
-                        import traceback
-                        log_sys_event("TASK_ASSIGN_RESCUE_FAIL", user_id, f"緊急繼承 Pool 失敗: {rescue_e}", {"trace": traceback.format_exc()})
+                        conn.execute("""
+                            INSERT INTO factor_pools (cycle_id, name, external_key, symbol, direction, timeframe_min, years, family, grid_spec_json, risk_spec_json, num_partitions, seed, param_combo_count, active, created_at)
+                            SELECT ?, name, COALESCE(external_key, ''), symbol, COALESCE(direction, 'long'), timeframe_min, years, family, grid_spec_json, risk_spec_json, num_partitions, seed, COALESCE(param_combo_count, 0), active, ?
+                            FROM factor_pools WHERE cycle_id = ? AND active = 1
+                        """, (cycle_id, _now_iso(), source_cid))
+                        conn.commit()
+                        _invalidate_active_pool_cache(cycle_id)
+                        pools = _list_active_assignment_pools(conn, cycle_id, preferred_family)
+                except Exception as rescue_e:
+                    conn.rollback()
+                    import traceback
+                    log_sys_event("TASK_ASSIGN_RESCUE_FAIL", user_id, f"緊急繼承 Pool 失敗: {rescue_e}", {"trace": traceback.format_exc()})
 
-                if not pools:
-                    log_sys_event("TASK_ASSIGN_FAIL", user_id, f"目前週期 {cycle_id} 無活躍策略池，停止派發", {"cycle_id": cycle_id})
-                    break
-                
-                # [改進] 使用集合快速查詢已佔用分區
-                assigned_count = 0
-                pool_list = [dict(p) for p in pools]
-                sample_size = min(len(pool_list), max(64, needed * 12))
-                if sample_size > 0 and sample_size < len(pool_list):
-                    pool_list = random.sample(pool_list, sample_size)
-                else:
-                    random.shuffle(pool_list)
-                now_str = _now_iso()
+            if not pools:
+                log_sys_event("TASK_ASSIGN_FAIL", user_id, f"目前週期 {cycle_id} 無活躍策略池，停止派發", {"cycle_id": cycle_id})
+                return
                 
-                for p in pool_list:
-                    if assigned_count >= needed:
-                        break
-                        
-                    pid = int(p["id"])
-                    num_parts = int(p["num_partitions"])
-                    if num_parts <= 0:
+            # 一次撈出已佔用分區，在 Python 端選好要派發的分區
+            pool_list = [dict(p) for p in pools]
+            sample_size = min(len(pool_list), max(64, needed * 12))
+            if sample_size > 0 and sample_size < len(pool_list):
+                pool_list = random.sample(pool_list, sample_size)
+            else:
+                random.shuffle(pool_list)
+            now_str = _now_iso()
+
+            taken_by_pool: Dict[int, set] = {}
+            pool_ids = [int(p["id"]) for p in pool_list]
+            for start in range(0, len(pool_ids), 500):
+                chunk = pool_ids[start : start + 500]
+                placeholders = ",".join("?" for _ in chunk)
+                taken_rows = conn.execute(
+                    f"SELECT DISTINCT pool_id, partition_idx FROM mining_tasks WHERE cycle_id = ? AND pool_id IN ({placeholders})",
+                    [cycle_id] + chunk,
+                ).fetchall()
+                for t in taken_rows:
+                    if t["partition_idx"] is None:
                         continue
+                    taken_by_pool.setdefault(int(t["pool_id"]), set()).add(int(t["partition_idx"]))
 
-                    taken_rows = conn.execute(
-                        "SELECT DISTINCT partition_idx FROM mining_tasks WHERE cycle_id = ? AND pool_id = ?",
-                        (cycle_id, pid),
-                    ).fetchall()
-                    taken_parts = {
-                        int(t["partition_idx"])
-                        for t in taken_rows
-                        if t.get("partition_idx") is not None
-                    }
-                    available_parts = [part_idx for part_idx in range(num_parts) if part_idx not in taken_parts]
-                    
-                    if not available_parts:
-                        continue
-                    
-                    random.shuffle(available_parts)
-                    
-                    for chosen_part in available_parts[:needed - assigned_count]:
-                        try:
-                            # [原子性插入] 使用 INSERT ... WHERE NOT EXISTS 防止重複分配
-                            if getattr(conn, "kind", "sqlite") == "postgres":
-                                cur_insert = conn.execute("""
-                                    INSERT INTO mining_tasks (user_id, pool_id, cycle_id, partition_idx, num_partitions, status, created_at, updated_at)
-                                    SELECT ?, ?, ?, ?, ?, 'assigned', ?, ?
-                                    WHERE NOT EXISTS (
-                                        SELECT 1 FROM mining_tasks 
-                                        WHERE pool_id = ? AND partition_idx = ? AND cycle_id = ? 
-                                        AND status IN ('assigned', 'running', 'queued', 'completed')
-                                    )
-                                """, (user_id, pid, cycle_id, chosen_part, num_parts, now_str, now_str,
-                                      pid, chosen_part, cycle_id))
-                            else:
-                                # SQLite 版本
-                                cur_insert = conn.execute("""
-                                    INSERT INTO mining_tasks (user_id, pool_id, cycle_id, partition_idx, num_partitions, status, created_at, updated_at)
-                                    SELECT ?, ?, ?, ?, ?, 'assigned', ?, ?
-                                    WHERE NOT EXISTS (
-                                        SELECT 1 FROM mining_tasks 
-                                        WHERE pool_id = ? AND partition_idx = ? AND cycle_id = ?
-                                    )
-                                """, (user_id, pid, cycle_id, chosen_part, num_parts, now_str, now_str,
-                                      pid, chosen_part, cycle_id))
-                            try:
-                                inserted = int(getattr(cur_insert, "rowcount", 0) or 0)
-                            finally:
-                                try:
-                                    cur_insert.close()
-                                except Exception:
-                                    pass
-                            if inserted <= 0:
-                                continue
-                            assigned_count += 1
-                            taken_parts.add(chosen_part)
-                        except Exception as insert_e:
-                            # 忽略唯一性衝突（另一個請求搶先了）
-                            if "UNIQUE" not in str(insert_e).upper():
-                                raise
-                                
-                if assigned_count > 0:
-                    conn.commit()
-                    log_sys_event("TASK_ASSIGN_SUCCESS", user_id, f"成功派發了 {assigned_count} 個新任務", {"needed": needed, "assigned": assigned_count})
-                break
-            finally:
-                conn.close()
-        except Exception as e:
-            if attempt == 4:
-                import traceback
-                err_str = traceback.format_exc()
-                log_sys_event("TASK_ASSIGN_CRASH", user_id, f"派發任務時發生嚴重例外: {e}", {"trace": err_str})
-            time.sleep(0.05 * (2 ** attempt))
+            insert_rows: List[Tuple[Any, ...]] = []
+            for p in pool_list:
+                if len(insert_rows) >= needed:
+                    break
+                pid = int(p["id"])
+                num_parts = int(p["num_partitions"])
+                if num_parts <= 0:
+                    continue
+                taken_parts = taken_by_pool.get(pid) or set()
+                available_parts = [part_idx for part_idx in range(num_parts) if part_idx not in taken_parts]
+                if not available_parts:
+                    continue
+                random.shuffle(available_parts)
+                for chosen_part in available_parts[:needed - len(insert_rows)]:
+                    insert_rows.append((user_id, pid, cycle_id, chosen_part, num_parts, now_str, now_str))
+
+            # [原子性插入] 使用 INSERT ... WHERE NOT EXISTS 防止重複分配
+            # 整批分區併成一條多列 INSERT ... RETURNING id，寫入筆數直接數 RETURNING
+            assigned_count = 0
+            kind = str(getattr(conn, "kind", "sqlite") or "sqlite")
+            for start in range(0, len(insert_rows), _ASSIGN_TASKS_INSERT_CHUNK):
+                chunk = insert_rows[start : start + _ASSIGN_TASKS_INSERT_CHUNK]
+                returned = conn.execute(
+                    _assign_tasks_insert_sql(kind, len(chunk)),
+                    [v for row in chunk for v in row],
+                ).fetchall()
+                assigned_count += len(returned or [])
+
+            if assigned_count > 0:
+                conn.commit()
+                log_sys_event("TASK_ASSIGN_SUCCESS", user_id, f"成功派發了 {assigned_count} 個新任務", {"needed": needed, "assigned": assigned_count})
+        finally:
+            conn.close()
+    except Exception as e:
+        import traceback
+        err_str = traceback.format_exc()
+        log_sys_event("TASK_ASSIGN_CRASH", user_id, f"派發任務時發生嚴重例外: {e}", {"trace": err_str})
 def _safe_listdir(dir_path: str) -> List[str]:
     try:
         return [os.path.join(dir_path, x) for x in os.listdir(dir_path)]
@@ -3262,7 +4545,14 @@ def _read_factor_pools_from_sqlite(db_path: str) -> List[Dict[str, Any]]:
             timeout_s = 2.0
         timeout_s = max(0.2, min(30.0, float(timeout_s)))
 
-        conn = sqlite3.connect(path, timeout=timeout_s, check_same_thread=False)
+        # 掃描的是第三方/舊 db：以唯讀 URI 開啟，不對別人的檔案取寫鎖；
+        # 沒有 -wal 副檔時再加 immutable=1 連鎖定與 WAL 檢查都省掉（有 -wal 時加了會漏讀已提交的頁面）
+        from urllib.parse import quote as _url_quote
+        abs_path = os.path.abspath(str(db_path))
+        uri = f"file:{_url_quote(abs_path)}?mode=ro"
+        if not os.path.exists(abs_path + "-wal"):
+            uri += "&immutable=1"
+        conn = sqlite3.connect(uri, uri=True, timeout=timeout_s, check_same_thread=False)
         conn.row_factory = sqlite3.Row
     except Exception:
         return []
@@ -3357,33 +4647,12 @@ def recover_factor_pools_from_local(cycle_id: int, search_roots: Optional[List[s
 
     report["scanned_files"] = len(db_files)
 
-    # 讀取目前 cycle 已有 pools，做去重 key
-    existing_keys = set()
-    try:
-        cur_conn = _conn()
-        try:
-            if _sqlite_has_table(cur_conn, "factor_pools"):
-                for r in cur_conn.execute("SELECT name, symbol, timeframe_min, years, family, grid_spec_json, risk_spec_json, num_partitions, seed FROM factor_pools WHERE cycle_id = ?", (int(cycle_id),)).fetchall():
-                    key = (
-                        str(r["name"] or ""),
-                        str(r["symbol"] or ""),
-                        int(r["timeframe_min"] or 0),
-                        int(r["years"] or 0),
-                        str(r["family"] or ""),
-                        str(r["grid_spec_json"] or ""),
-                        str(r["risk_spec_json"] or ""),
-                        int(r["num_partitions"] or 0),
-                        int(r["seed"] or 0),
-                    )
-                    existing_keys.add(key)
-        finally:
-            cur_conn.close()
-    except Exception as e:
-        report["errors"].append(f"讀取既有 pools 失敗: {e}")
-
-    # 掃描舊 db 並匯入
+    # 掃描舊 db，先在記憶體收齊所有要匯入的列
     imported = 0
     skipped = 0
+    insert_rows: List[Tuple[Any, ...]] = []
+    insert_sources: List[str] = []
+    now_str = _now_iso()
     for p in db_files:
         rows = _read_factor_pools_from_sqlite(p)
         if not rows:
@@ -3408,45 +4677,91 @@ def recover_factor_pools_from_local(cycle_id: int, search_roots: Optional[List[s
                 seed = int(r.get("seed") or 0)
                 active = int(r.get("active") or 0)
 
-                key = (
-                    name, symbol, timeframe_min, years, family,
-                    grid_spec_json, risk_spec_json, num_partitions, seed
-                )
-                if key in existing_keys:
-                    skipped += 1
-                    continue
-
                 combo_count = _param_combo_count_value(family, grid_spec_json, risk_spec_json)
-                conn = _conn()
-                try:
-                    conn.execute(
-                        """
-                        INSERT INTO factor_pools (cycle_id, name, symbol, timeframe_min, years, family, grid_spec_json, risk_spec_json, num_partitions, seed, param_combo_count, active, created_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        """,
-                        (int(cycle_id), name, symbol, timeframe_min, years, family, grid_spec_json, risk_spec_json, num_partitions, seed, combo_count, 1 if active else 0, _now_iso())
+                insert_rows.append(
+                    (
+                        int(cycle_id), name, symbol, timeframe_min, years, family, grid_spec_json, risk_spec_json, num_partitions, seed, combo_count, 1 if active else 0, now_str,
+                        int(cycle_id), name, symbol, timeframe_min, years, family, grid_spec_json, risk_spec_json, num_partitions, seed,
                     )
-                    if int(combo_count or 0) > 0:
-                        _bump_global_dashboard_counter(conn, _GLOBAL_COUNTER_TOTAL_POOL_COMBOS, combo_count)
-                    conn.commit()
-                finally:
-                    conn.close()
-
-                existing_keys.add(key)
-                imported += 1
+                )
+                insert_sources.append(p)
             except Exception as e:
                 report["errors"].append(f"匯入失敗 {p}: {e}")
 
+    # 單一交易寫入，去重交給 WHERE NOT EXISTS；以 COALESCE 比照匯入端的正規化，NULL 欄位的舊 pool 才認得出重複
+    if insert_rows:
+        insert_sql = """
+            INSERT INTO factor_pools (cycle_id, name, symbol, timeframe_min, years, family, grid_spec_json, risk_spec_json, num_partitions, seed, param_combo_count, active, created_at)
+            SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+            WHERE NOT EXISTS (
+                SELECT 1 FROM factor_pools
+                WHERE cycle_id = ? AND COALESCE(name, '') = ? AND COALESCE(symbol, '') = ?
+                  AND COALESCE(timeframe_min, 0) = ? AND COALESCE(years, 0) = ? AND COALESCE(family, '') = ?
+                  AND COALESCE(grid_spec_json, '') = ? AND COALESCE(risk_spec_json, '') = ?
+                  AND COALESCE(num_partitions, 0) = ? AND COALESCE(seed, 0) = ?
+            )
+        """
+        combo_sum_sql = "SELECT COALESCE(SUM(param_combo_count), 0) AS c FROM factor_pools WHERE cycle_id = ?"
+        try:
+            conn = _conn()
+        except Exception as e:
+            report["errors"].append(f"匯入失敗: {e}")
+            conn = None
+        if conn is not None:
+            try:
+                try:
+                    before_row = conn.execute(combo_sum_sql, (int(cycle_id),)).fetchone()
+                    cur_insert = conn.executemany(insert_sql, insert_rows)
+                    batch_imported = max(0, int(getattr(cur_insert, "rowcount", 0) or 0))
+                    after_row = conn.execute(combo_sum_sql, (int(cycle_id),)).fetchone()
+                    # 被去重略過的列不會寫入，所以組合數增量以寫入前後的 SUM 差值為準
+                    combo_total = int((dict(after_row or {}).get("c") or 0)) - int((dict(before_row or {}).get("c") or 0))
+                    if combo_total > 0:
+                        _bump_global_dashboard_counter(conn, _GLOBAL_COUNTER_TOTAL_POOL_COMBOS, combo_total)
+                    conn.commit()
+                    imported = batch_imported
+                    skipped += len(insert_rows) - batch_imported
+                except Exception:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        pass
+                    # 批次失敗時退回逐列寫入，只放棄出錯的那一列
+                    for row, src in zip(insert_rows, insert_sources):
+                        try:
+                            cur_row = conn.execute(insert_sql, row)
+                            if int(getattr(cur_row, "rowcount", 0) or 0) <= 0:
+                                skipped += 1
+                                continue
+                            if int(row[10] or 0) > 0:
+                                _bump_global_dashboard_counter(conn, _GLOBAL_COUNTER_TOTAL_POOL_COMBOS, int(row[10]))
+                            conn.commit()
+                            imported += 1
+                        except Exception as e:
+                            try:
+                                conn.rollback()
+                            except Exception:
+                                pass
+                            report["errors"].append(f"匯入失敗 {src}: {e}")
+            finally:
+                conn.close()
+        if imported > 0:
+            _invalidate_active_pool_cache(int(cycle_id))
+
     report["imported"] = int(imported)
     report["skipped_duplicates"] = int(skipped)
     return report
 def list_tasks_for_user(user_id: int, cycle_id: int = 0, limit: int = 500) -> list:
     import time, random
     last_err = None
+    try:
+        flush_task_progress()
+    except Exception as e:
+        print(f"[DB ERROR] list_tasks_for_user flush 進度失敗: {e}")
     for attempt in range(15):
         try:
-            conn = _conn()
-            try:
+            # 純讀取：借唯讀連線，WAL 下不與心跳/進度寫入搶寫鎖
+            with _conn_ro() as conn:
                 params: List[Any] = [int(user_id)]
                 query = """
                     SELECT t.*, p.name as pool_name, p.symbol, p.timeframe_min, p.family
@@ -3462,9 +4777,7 @@ def list_tasks_for_user(user_id: int, cycle_id: int = 0, limit: int = 500) -> li
                     query += " LIMIT ?"
                     params.append(int(limit))
                 cur = conn.execute(query, params)
-                return [dict(row) for row in cur.fetchall()]
-            finally:
-                conn.close()
+                return _fetchall_dicts(cur)
         except Exception as e:
             last_err = e
             time.sleep(random.uniform(0.1, 0.5) * (1.2 ** attempt))
@@ -3561,24 +4874,53 @@ def count_review_pipeline_tasks_for_user(user_id: int, cycle_id: int) -> int:
     finally:
         conn.close()
 
+def _user_status_list_sql(base: str, alias: str) -> Dict[Tuple[bool, bool], str]:
+    """預先組好 (依 user 過濾?, 依 status 過濾?) 四種固定 SQL 字串，呼叫時只挑一條，不再逐次串接"""
+    variants: Dict[Tuple[bool, bool], str] = {}
+    for by_user in (False, True):
+        for by_status in (False, True):
+            query = base
+            if by_user:
+                query += f" AND {alias}.user_id = ?"
+            if by_status:
+                query += f" AND {alias}.status = ?"
+            variants[(by_user, by_status)] = query + f" ORDER BY {alias}.id DESC LIMIT ?"
+    return variants
+
+
+def _user_status_list_params(user_id: int, status: str, limit: int) -> Tuple[Tuple[bool, bool], List[Any]]:
+    params: List[Any] = []
+    if user_id > 0:
+        params.append(user_id)
+    if status:
+        params.append(status)
+    params.append(limit)
+    return (user_id > 0, bool(status)), params
+
+
+_SQL_LIST_SUBMISSIONS = _user_status_list_sql(
+    "SELECT s.*, u.username, p.name as pool_name, p.symbol, p.timeframe_min, p.family FROM submissions s LEFT JOIN users u ON s.user_id = u.id LEFT JOIN factor_pools p ON s.pool_id = p.id WHERE 1=1",
+    "s",
+)
+_SQL_LIST_STRATEGIES = _user_status_list_sql(
+    "SELECT s.*, u.username, u.nickname, u.avatar_url, p.name as pool_name, p.symbol, p.timeframe_min, p.family FROM strategies s LEFT JOIN users u ON s.user_id = u.id LEFT JOIN factor_pools p ON s.pool_id = p.id WHERE 1=1",
+    "s",
+)
+_SQL_LIST_PAYOUTS = _user_status_list_sql(
+    "SELECT p.*, u.username FROM payouts p LEFT JOIN users u ON p.user_id = u.id WHERE 1=1",
+    "p",
+)
+
+
 def list_submissions(user_id: int = 0, status: str = "", limit: int = 300) -> list:
     import time
     for attempt in range(5):
         try:
             conn = _conn()
             try:
-                query = "SELECT s.*, u.username, p.name as pool_name, p.symbol, p.timeframe_min, p.family FROM submissions s LEFT JOIN users u ON s.user_id = u.id LEFT JOIN factor_pools p ON s.pool_id = p.id WHERE 1=1"
-                params = []
-                if user_id > 0:
-                    query += " AND s.user_id = ?"
-                    params.append(user_id)
-                if status:
-                    query += " AND s.status = ?"
-                    params.append(status)
-                query += " ORDER BY s.id DESC LIMIT ?"
-                params.append(limit)
-                cur = conn.execute(query, params)
-                return [dict(row) for row in cur.fetchall()]
+                variant, params = _user_status_list_params(user_id, status, limit)
+                cur = conn.execute(_SQL_LIST_SUBMISSIONS[variant], params)
+                return _fetchall_dicts(cur)
             finally:
                 conn.close()
         except Exception as e:
@@ -3588,11 +4930,20 @@ def list_submissions(user_id: int = 0, status: str = "", limit: int = 300) -> li
             time.sleep(0.1 * (2 ** attempt))
     return []
 
+# 管理總覽只投影表格會用到的欄位
+_SQL_LIST_TASK_OVERVIEW = (
+    "SELECT t.id, t.user_id, t.pool_id, t.cycle_id, t.partition_idx, t.num_partitions, t.status, t.progress_json, "
+    "t.progress_combos_done, t.progress_combos_total, t.last_heartbeat, t.created_at, t.updated_at, "
+    "u.username, p.name as pool_name, p.symbol, p.timeframe_min, p.family "
+    "FROM mining_tasks t LEFT JOIN users u ON t.user_id = u.id LEFT JOIN factor_pools p ON t.pool_id = p.id ORDER BY t.id DESC LIMIT ?"
+)
+
+
 def list_task_overview(limit: int = 500) -> list:
     conn = _conn()
     try:
-        cur = conn.execute("SELECT t.*, u.username, p.name as pool_name, p.symbol, p.timeframe_min, p.family FROM mining_tasks t LEFT JOIN users u ON t.user_id = u.id LEFT JOIN factor_pools p ON t.pool_id = p.id ORDER BY t.id DESC LIMIT ?", (limit,))
-        return [dict(row) for row in cur.fetchall()]
+        cur = conn.execute(_SQL_LIST_TASK_OVERVIEW, (limit,))
+        return _fetchall_dicts(cur)
     except Exception as e:
         print(f"[DB ERROR] list_task_overview: {e}")
         return []
@@ -3605,17 +4956,8 @@ def list_strategies(user_id: int = 0, status: str = "", limit: int = 200) -> lis
         try:
             conn = _conn()
             try:
-                query = "SELECT s.*, u.username, u.nickname, u.avatar_url, p.name as pool_name, p.symbol, p.timeframe_min, p.family FROM strategies s LEFT JOIN users u ON s.user_id = u.id LEFT JOIN factor_pools p ON s.pool_id = p.id WHERE 1=1"
-                params = []
-                if user_id > 0:
-                    query += " AND s.user_id = ?"
-                    params.append(user_id)
-                if status:
-                    query += " AND s.status = ?"
-                    params.append(status)
-                query += " ORDER BY s.id DESC LIMIT ?"
-                params.append(limit)
-                cur = conn.execute(query, params)
+                variant, params = _user_status_list_params(user_id, status, limit)
+                cur = conn.execute(_SQL_LIST_STRATEGIES[variant], params)
                 return [_normalize_strategy_row(row) for row in cur.fetchall()]
             finally:
                 conn.close()
@@ -3822,18 +5164,9 @@ def count_review_ready_tasks(user_id: int = 0) -> int:
 def list_payouts(user_id: int = 0, status: str = "", limit: int = 200) -> list:
     conn = _conn()
     try:
-        query = "SELECT p.*, u.username FROM payouts p LEFT JOIN users u ON p.user_id = u.id WHERE 1=1"
-        params = []
-        if user_id > 0:
-            query += " AND p.user_id = ?"
-            params.append(user_id)
-        if status:
-            query += " AND p.status = ?"
-            params.append(status)
-        query += " ORDER BY p.id DESC LIMIT ?"
-        params.append(limit)
-        cur = conn.execute(query, params)
-        return [dict(row) for row in cur.fetchall()]
+        variant, params = _user_status_list_params(user_id, status, limit)
+        cur = conn.execute(_SQL_LIST_PAYOUTS[variant], params)
+        return _fetchall_dicts(cur)
     except Exception as e:
         print(f"[DB ERROR] list_payouts: {e}")
         return []
@@ -3841,27 +5174,23 @@ def list_payouts(user_id: int = 0, status: str = "", limit: int = 200) -> list:
         conn.close()
 
 def list_candidates(task_id: int, limit: int = 50) -> list:
-    conn = _conn()
     try:
-        cur = conn.execute("SELECT * FROM candidates WHERE task_id = ? ORDER BY score DESC LIMIT ?", (task_id, limit))
-        return [_normalize_candidate_row(row) for row in cur.fetchall()]
+        with _conn_ro() as conn:
+            cur = conn.execute("SELECT * FROM candidates WHERE task_id = ? ORDER BY score DESC LIMIT ?", (task_id, limit))
+            return [_normalize_candidate_row(row) for row in cur.fetchall()]
     except Exception as e:
         print(f"[DB ERROR] list_candidates: {e}")
         return []
-    finally:
-        conn.close()
 
 def get_pool(pool_id: int) -> Optional[dict]:
-    conn = _conn()
     try:
-        row = conn.execute("SELECT * FROM factor_pools WHERE id = ?", (pool_id,)).fetchone()
-        if not row: return None
-        return _normalize_pool_row(row)
+        with _conn_ro() as conn:
+            row = conn.execute("SELECT * FROM factor_pools WHERE id = ?", (pool_id,)).fetchone()
+            if not row: return None
+            return _normalize_pool_row(row)
     except Exception as e:
         print(f"[DB ERROR] get_pool: {e}")
         return None
-    finally:
-        conn.close()
 
 def get_db_info() -> dict:
     return {"kind": "sqlite3"}
@@ -3895,11 +5224,30 @@ def delete_tasks_for_pool(cycle_id: int, pool_id: int) -> int:
     finally:
         conn.close()
         
+def _snapshot_factor_pools(cycle_id: int) -> List[Dict[str, Any]]:
+    """list_factor_pools 的短 TTL 快取版；回傳淺拷貝，呼叫端可安全地掛上 tasks 等欄位"""
+    cid = int(cycle_id)
+    scope = _db_cache_scope()
+    with _SNAPSHOT_POOL_CACHE["lock"]:
+        hit = _SNAPSHOT_POOL_CACHE["values"].get(cid)
+        # scope 不同代表是切換前另一個資料庫的 Pool，視為未命中
+        if hit and time.monotonic() < float(hit[0]) and hit[1] == scope:
+            return [dict(p) for p in hit[2]]
+    pools = list_factor_pools(cid)
+    # 空清單不快取：list_factor_pools 可能正在繼承上一週期的 Pool
+    if pools:
+        expires_at = time.monotonic() + float(_SNAPSHOT_POOL_CACHE.get("ttl") or 5.0)
+        with _SNAPSHOT_POOL_CACHE["lock"]:
+            _SNAPSHOT_POOL_CACHE["values"][cid] = (expires_at, scope, [dict(p) for p in pools])
+    return [dict(p) for p in pools]
+
+
 def get_global_progress_snapshot(cycle_id: int) -> dict:
     conn = _conn()
     t0 = time.time()
     try:
-        pools = list_factor_pools(int(cycle_id))
+        # Pool 清單幾乎不變，5 秒內共用同一份
+        pools = _snapshot_factor_pools(int(cycle_id))
         pools_by_id: Dict[int, Dict[str, Any]] = {}
         for p in pools:
             try:
@@ -3911,22 +5259,13 @@ def get_global_progress_snapshot(cycle_id: int) -> dict:
 
         # 快路徑：用 window function 在 DB 端直接「每個 (pool_id, partition_idx) 只取最佳那筆」
         # 這會把原本 Python 逐筆掃描 + 去重，變成 DB 一次做完，效能差距是量級級別
+        # 排名只讀窄欄位（idx_mining_tasks_snapshot_cover），勝出的那筆才回表取寬欄位
         try:
             cur = conn.execute(
                 """
                 WITH ranked AS (
                     SELECT
                         t.id,
-                        t.user_id,
-                        t.pool_id,
-                        t.cycle_id,
-                        t.partition_idx,
-                        t.num_partitions,
-                        t.status,
-                        t.progress_json,
-                        t.last_heartbeat,
-                        t.created_at,
-                        t.updated_at,
                         ROW_NUMBER() OVER (
                             PARTITION BY t.pool_id, t.partition_idx
                             ORDER BY
@@ -3942,19 +5281,31 @@ def get_global_progress_snapshot(cycle_id: int) -> dict:
                     FROM mining_tasks t
                     WHERE t.cycle_id = ?
                 )
-                SELECT r.*, u.username AS username
+                SELECT
+                    m.id,
+                    m.user_id,
+                    m.pool_id,
+                    m.cycle_id,
+                    m.partition_idx,
+                    m.num_partitions,
+                    m.status,
+                    m.progress_json,
+                    m.last_heartbeat,
+                    m.created_at,
+                    m.updated_at,
+                    u.username AS username
                 FROM ranked r
-                LEFT JOIN users u ON u.id = r.user_id
+                JOIN mining_tasks m ON m.id = r.id
+                LEFT JOIN users u ON u.id = m.user_id
                 WHERE r.rn = 1
-                ORDER BY r.pool_id ASC, r.partition_idx ASC
+                ORDER BY m.pool_id ASC, m.partition_idx ASC
                 """,
                 (int(cycle_id),),
             )
 
-            for row in cur.fetchall():
-                t = dict(row)
+            for t in _fetchall_dicts(cur):
                 try:
-                    t["progress"] = json.loads(t.get("progress_json") or "{}")
+                    t["progress"] = _fast_json_loads(t.get("progress_json") or "{}")
                 except Exception:
                     t["progress"] = {}
 
@@ -3970,34 +5321,17 @@ def get_global_progress_snapshot(cycle_id: int) -> dict:
         except Exception as fast_e:
             # 安全 fallback：如果 SQLite 版本/環境不支援 window function，就退回舊邏輯
             # 但仍然縮小欄位，避免 SELECT t.* 造成不必要的資料搬運
-            def _status_rank(s: str) -> int:
-                if s == "completed":
-                    return 3
-                if s == "running":
-                    return 2
-                if s == "assigned":
-                    return 1
-                return 0
-
-            def _pick_better(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
-                sa = str(a.get("status") or "")
-                sb = str(b.get("status") or "")
-                ra = _status_rank(sa)
-                rb = _status_rank(sb)
-                if rb != ra:
-                    return b if rb > ra else a
-                ta = str(a.get("updated_at") or a.get("created_at") or "")
-                tb = str(b.get("updated_at") or b.get("created_at") or "")
-                if tb != ta:
-                    return b if tb > ta else a
-                ia = int(a.get("id") or 0)
-                ib = int(b.get("id") or 0)
-                return b if ib > ia else a
-
-            for p in pools:
-                pool_id = int(p.get("id") or 0)
+            # 每列只算一次排序鍵 (狀態權重, 時間, id)
+            status_rank = {"completed": 3, "running": 2, "assigned": 1}
+
+            # 以 IN 清單分批撈回所有 pool 的任務，避免 N+1
+            best_by_pool: Dict[int, Dict[int, Dict[str, Any]]] = {}
+            pool_ids = [pid for pid in pools_by_id.keys() if pid > 0]
+            for start in range(0, len(pool_ids), 500):
+                chunk = pool_ids[start : start + 500]
+                placeholders = ",".join("?" for _ in chunk)
                 cur2 = conn.execute(
-                    """
+                    f"""
                     SELECT
                         t.id, t.user_id, t.pool_id, t.cycle_id,
                         t.partition_idx, t.num_partitions,
@@ -4006,30 +5340,41 @@ def get_global_progress_snapshot(cycle_id: int) -> dict:
                         u.username AS username
                     FROM mining_tasks t
                     LEFT JOIN users u ON u.id = t.user_id
-                    WHERE t.pool_id = ? AND t.cycle_id = ?
+                    WHERE t.cycle_id = ? AND t.pool_id IN ({placeholders})
                     """,
-                    (pool_id, int(cycle_id)),
+                    [int(cycle_id)] + chunk,
                 )
-
-                best: Dict[int, Dict[str, Any]] = {}
-                for row in cur2.fetchall():
-                    t = dict(row)
+                for t in _fetchall_dicts(cur2):
                     try:
-                        t["progress"] = json.loads(t.get("progress_json") or "{}")
+                        pid = int(t.get("pool_id") or 0)
                     except Exception:
-                        t["progress"] = {}
-
+                        pid = 0
                     try:
                         idx = int(t.get("partition_idx") or 0)
                     except Exception:
                         idx = 0
+                    key = (
+                        status_rank.get(str(t.get("status") or ""), 0),
+                        str(t.get("updated_at") or t.get("created_at") or ""),
+                        int(t.get("id") or 0),
+                    )
+                    best = best_by_pool.setdefault(pid, {})
+                    prev = best.get(idx)
+                    if prev is None or key > prev[0]:
+                        best[idx] = (key, t)
 
-                    if idx not in best:
-                        best[idx] = t
-                    else:
-                        best[idx] = _pick_better(best[idx], t)
-
-                p["tasks"] = [best[k] for k in sorted(best.keys())]
+            # 只有每個分區勝出的那筆才需要解析 progress_json
+            for pid, best in best_by_pool.items():
+                p = pools_by_id.get(pid)
+                if p is None:
+                    continue
+                tasks_sorted = [best[k][1] for k in sorted(best.keys())]
+                for t in tasks_sorted:
+                    try:
+                        t["progress"] = _fast_json_loads(t.get("progress_json") or "{}")
+                    except Exception:
+                        t["progress"] = {}
+                p["tasks"] = tasks_sorted
 
             print(f"[DB WARN] get_global_progress_snapshot fallback used: {fast_e}")
 
@@ -4048,7 +5393,20 @@ def get_global_progress_snapshot(cycle_id: int) -> dict:
 def get_global_paid_payout_sum_usdt(cycle_id: int) -> float:
     conn = _conn()
     try:
-        # 優先以 cycle_id 精準計算（payouts -> strategies -> factor_pools）
+        # payouts.cycle_id 已反正規化，走 idx_payouts_cycle_status_amount 聚合
+        try:
+            cur = conn.execute(
+                "SELECT SUM(amount_usdt) AS s FROM payouts WHERE cycle_id = ? AND status = 'paid'",
+                (int(cycle_id),),
+            )
+            row = cur.fetchone()
+            return float(row["s"] or 0.0) if row else 0.0
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+        # 欄位尚未遷移時以 join 精準計算（payouts -> strategies -> factor_pools）
         try:
             cur = conn.execute(
                 """
@@ -4096,6 +5454,9 @@ def create_factor_pool(
         symbols = ["BTC_USDT", "ETH_USDT"]
         tfs = [1, 5, 15, 30, 60, 240, 1440]
         targets = [(s, t) for s in symbols for t in tfs]
+    # 沒有目標就不開連線：下方的 IN (...) 會變成 IN ()，且 SQLite 已先以 BEGIN IMMEDIATE 取了寫鎖
+    if not targets:
+        return ids
 
     normalized_direction = normalize_direction(direction, reverse=parse_json_object(risk_spec).get("reverse_mode"), default="long")
     normalized_risk_spec = _normalize_risk_spec(normalized_direction, risk_spec)
@@ -4107,66 +5468,63 @@ def create_factor_pool(
     conn = _conn()
     try:
         created_combo_total = 0
+        # 整批擴展共用同一個 created_at
+        now = _now_iso()
+        # SQLite 先取寫鎖，「查既有 Pool -> 插入缺的」之間不會被插隊
+        if getattr(conn, "kind", "sqlite") != "postgres":
+            conn.execute("BEGIN IMMEDIATE")
+        # 修正：精準檢查是否已存在於該週期，避免重複建立導致任務派發混亂（原本每個 target 一次 SELECT，改為整批一次查）
+        target_symbols = sorted({str(s) for s, _ in targets})
+        target_tfs = sorted({int(t) for _, t in targets})
+        existing_ids: Dict[Tuple[str, int], int] = {}
+        for row in conn.execute(
+            f"""
+            SELECT id, symbol, timeframe_min FROM factor_pools
+            WHERE cycle_id = ? AND family = ?
+              AND symbol IN ({",".join("?" for _ in target_symbols)})
+              AND timeframe_min IN ({",".join("?" for _ in target_tfs)})
+            ORDER BY id ASC
+            """,
+            (cycle_id, family, *target_symbols, *target_tfs),
+        ).fetchall():
+            existing_ids.setdefault((str(row["symbol"]), int(row["timeframe_min"])), int(row["id"]))
+
+        grid_spec_json = json.dumps(grid_spec, ensure_ascii=False)
+        risk_spec_json = json.dumps(normalized_risk_spec, ensure_ascii=False)
         for s, t in targets:
-            # 修正：精準檢查是否已存在於該週期，避免重複建立導致任務派發混亂
-            exist = conn.execute("SELECT id FROM factor_pools WHERE cycle_id=? AND symbol=? AND timeframe_min=? AND family=?", (cycle_id, s, t, family)).fetchone()
-            if exist:
-                ids.append(exist["id"])
+            exist_id = existing_ids.get((str(s), int(t)))
+            if exist_id is not None:
+                ids.append(exist_id)
                 continue
 
             expanded_name = f"{name} [{s}_{t}m]" if auto_expand else name
-            if getattr(conn, "kind", "sqlite") == "postgres":
-                row_pool = conn.execute(
-                    """
-                    INSERT INTO factor_pools (cycle_id, name, external_key, symbol, direction, timeframe_min, years, family, grid_spec_json, risk_spec_json, num_partitions, seed, param_combo_count, active, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING id
-                    """,
-                    (
-                        cycle_id,
-                        expanded_name,
-                        str(external_key or ""),
-                        s,
-                        normalized_direction,
-                        t,
-                        int(years),
-                        family,
-                        json.dumps(grid_spec, ensure_ascii=False),
-                        json.dumps(normalized_risk_spec, ensure_ascii=False),
-                        normalized_num_partitions,
-                        normalized_seed,
-                        param_combo_count,
-                        1 if active else 0,
-                        _now_iso(),
-                    )
-                ).fetchone()
-                ids.append(int((row_pool or {}).get("id") or 0))
-                created_combo_total += int(param_combo_count or 0)
-            else:
-                cur = conn.execute(
-                    """
-                    INSERT INTO factor_pools (cycle_id, name, external_key, symbol, direction, timeframe_min, years, family, grid_spec_json, risk_spec_json, num_partitions, seed, param_combo_count, active, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        cycle_id,
-                        expanded_name,
-                        str(external_key or ""),
-                        s,
-                        normalized_direction,
-                        t,
-                        int(years),
-                        family,
-                        json.dumps(grid_spec, ensure_ascii=False),
-                        json.dumps(normalized_risk_spec, ensure_ascii=False),
-                        normalized_num_partitions,
-                        normalized_seed,
-                        param_combo_count,
-                        1 if active else 0,
-                        _now_iso(),
-                    )
+            row_pool = conn.execute(
+                """
+                INSERT INTO factor_pools (cycle_id, name, external_key, symbol, direction, timeframe_min, years, family, grid_spec_json, risk_spec_json, num_partitions, seed, param_combo_count, active, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING id
+                """,
+                (
+                    cycle_id,
+                    expanded_name,
+                    str(external_key or ""),
+                    s,
+                    normalized_direction,
+                    t,
+                    int(years),
+                    family,
+                    grid_spec_json,
+                    risk_spec_json,
+                    normalized_num_partitions,
+                    normalized_seed,
+                    param_combo_count,
+                    1 if active else 0,
+                    now,
                 )
-                ids.append(int(cur.lastrowid))
-                created_combo_total += int(param_combo_count or 0)
+            ).fetchone()
+            new_id = int(dict(row_pool or {}).get("id") or 0)
+            ids.append(new_id)
+            existing_ids[(str(s), int(t))] = new_id
+            created_combo_total += int(param_combo_count or 0)
         if created_combo_total > 0:
             _bump_global_dashboard_counter(conn, _GLOBAL_COUNTER_TOTAL_POOL_COMBOS, created_combo_total)
         conn.commit()
@@ -4174,19 +5532,46 @@ def create_factor_pool(
         invalidate_global_dashboard_counters(force=True)
         return ids
     except Exception as e:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
         print(f"[DB ERROR] create_factor_pool fatal: {e}")
         raise
     finally:
         conn.close()
 
+_CANDIDATE_DISK_LOCKS: Dict[str, Any] = {"lock": threading.Lock(), "values": {}}
+
+
+def _candidate_disk_lock(file_path: str) -> threading.Lock:
+    with _CANDIDATE_DISK_LOCKS["lock"]:
+        lk = _CANDIDATE_DISK_LOCKS["values"].get(file_path)
+        if lk is None:
+            lk = threading.Lock()
+            _CANDIDATE_DISK_LOCKS["values"][file_path] = lk
+        return lk
+
+
 def save_candidate_to_disk(task_id: int, user_id: int, pool_id: int, data: dict):
-    """將跑過的組合數據存入檔案系統而非資料庫，提升管理效率與安全性"""
-    base_dir = os.path.join(os.getcwd(), "data", "storage", f"pool_{pool_id}", f"task_{task_id}")
-    os.makedirs(base_dir, exist_ok=True)
-    file_path = os.path.join(base_dir, f"user_{user_id}_{int(time.time()*1000)}.json")
-    try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    """將跑過的組合數據存入檔案系統而非資料庫，提升管理效率與安全性
+
+    每個任務一個 JSONL 檔（一行一筆）；同程序以每檔 Lock、跨程序以 flock 保護追加寫入。
+    """
+    base_dir = os.path.join(os.getcwd(), "data", "storage", f"pool_{pool_id}")
+    file_path = os.path.join(base_dir, f"task_{task_id}.jsonl")
+    try:
+        os.makedirs(base_dir, exist_ok=True)
+        line = _fast_json_line({"user_id": int(user_id), "ts": _now_iso(), "data": data})
+        with _candidate_disk_lock(file_path):
+            with open(file_path, "ab") as f:
+                if _fcntl is not None:
+                    _fcntl.flock(f.fileno(), _fcntl.LOCK_EX)
+                try:
+                    f.write(line)
+                finally:
+                    if _fcntl is not None:
+                        _fcntl.flock(f.fileno(), _fcntl.LOCK_UN)
         return file_path
     except Exception as e:
         print(f"[DISK STORAGE ERROR] {e}")
@@ -4363,43 +5748,24 @@ def save_runtime_portfolio_snapshot(
 
     conn = _conn()
     try:
-        if getattr(conn, "kind", "sqlite") == "postgres":
-            row = conn.execute(
-                """
-                INSERT INTO runtime_portfolio_snapshots (scope, user_id, published_by, updated_at, source, strategy_count, summary_json, checksum)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                RETURNING id
-                """,
-                (
-                    scope_text,
-                    owner_user_id if owner_user_id > 0 else None,
-                    published_by_id if published_by_id > 0 else None,
-                    ts,
-                    str(source or "holy_grail_runtime"),
-                    len(normalized_items),
-                    json.dumps(summary_payload, ensure_ascii=False),
-                    checksum_value,
-                ),
-            ).fetchone()
-            snapshot_id = int((row or {}).get("id") or 0)
-        else:
-            cur = conn.execute(
-                """
-                INSERT INTO runtime_portfolio_snapshots (scope, user_id, published_by, updated_at, source, strategy_count, summary_json, checksum)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    scope_text,
-                    owner_user_id if owner_user_id > 0 else None,
-                    published_by_id if published_by_id > 0 else None,
-                    ts,
-                    str(source or "holy_grail_runtime"),
-                    len(normalized_items),
-                    json.dumps(summary_payload, ensure_ascii=False),
-                    checksum_value,
-                ),
-            )
-            snapshot_id = int(cur.lastrowid)
+        row = conn.execute(
+            """
+            INSERT INTO runtime_portfolio_snapshots (scope, user_id, published_by, updated_at, source, strategy_count, summary_json, checksum)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            RETURNING id
+            """,
+            (
+                scope_text,
+                owner_user_id if owner_user_id > 0 else None,
+                published_by_id if published_by_id > 0 else None,
+                ts,
+                str(source or "holy_grail_runtime"),
+                len(normalized_items),
+                json.dumps(summary_payload, ensure_ascii=False),
+                checksum_value,
+            ),
+        ).fetchone()
+        snapshot_id = int(dict(row or {}).get("id") or 0)
 
         for item in normalized_items:
             conn.execute(
@@ -4655,50 +6021,28 @@ def create_announcement(
         normalized_published_at = str(published_at or "").strip()
         if normalized_status == "published" and not normalized_published_at:
             normalized_published_at = now
-        if getattr(conn, "kind", "sqlite") == "postgres":
-            row = conn.execute(
-                """
-                INSERT INTO announcements (
-                    slug, status, title, preview_text, body_markdown, body_html,
-                    author_user_id, published_at, created_at, updated_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                RETURNING *
-                """,
-                (
-                    normalized_slug,
-                    normalized_status,
-                    str(title or "").strip(),
-                    str(preview_text or "").strip(),
-                    str(body_markdown or ""),
-                    str(body_html or ""),
-                    int(author_user_id or 0) or None,
-                    normalized_published_at or None,
-                    now,
-                    now,
-                ),
-            ).fetchone()
-        else:
-            cur = conn.execute(
-                """
-                INSERT INTO announcements (
-                    slug, status, title, preview_text, body_markdown, body_html,
-                    author_user_id, published_at, created_at, updated_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    normalized_slug,
-                    normalized_status,
-                    str(title or "").strip(),
-                    str(preview_text or "").strip(),
-                    str(body_markdown or ""),
-                    str(body_html or ""),
-                    int(author_user_id or 0) or None,
-                    normalized_published_at or None,
-                    now,
-                    now,
-                ),
-            )
-            row = conn.execute("SELECT * FROM announcements WHERE id = ?", (int(cur.lastrowid),)).fetchone()
+        # SQLite 3.35+ 也支援 RETURNING *，新增後不必再多一次 SELECT 取回整列
+        row = conn.execute(
+            """
+            INSERT INTO announcements (
+                slug, status, title, preview_text, body_markdown, body_html,
+                author_user_id, published_at, created_at, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            RETURNING *
+            """,
+            (
+                normalized_slug,
+                normalized_status,
+                str(title or "").strip(),
+                str(preview_text or "").strip(),
+                str(body_markdown or ""),
+                str(body_html or ""),
+                int(author_user_id or 0) or None,
+                normalized_published_at or None,
+                now,
+                now,
+            ),
+        ).fetchone()
         conn.commit()
         return _announcement_row(row) if row else {}
     finally:
@@ -5016,8 +6360,8 @@ def get_submission(sub_id: int) -> Optional[dict]:
         row = conn.execute("SELECT s.*, c.params_json FROM submissions s LEFT JOIN candidates c ON s.candidate_id = c.id WHERE s.id = ?", (sub_id,)).fetchone()
         if not row: return None
         d = dict(row)
-        d["audit"] = json.loads(d.get("audit_json") or "{}")
-        d["params_json"] = json.loads(d.get("params_json") or "{}")
+        d["audit"] = _fast_json_loads(d.get("audit_json") or "{}")
+        d["params_json"] = _fast_json_loads(d.get("params_json") or "{}")
         return d
     finally:
         conn.close()
@@ -5035,46 +6379,28 @@ def create_strategy_from_submission(sub_id: int, allocation_pct: float, note: st
     try:
         sub = conn.execute("SELECT * FROM submissions WHERE id = ?", (sub_id,)).fetchone()
         if not sub: return 0
-        cand = conn.execute("SELECT params_json, direction FROM candidates WHERE id = ?", (sub["candidate_id"],)).fetchone()
+        cand = dict(conn.execute("SELECT params_json, direction FROM candidates WHERE id = ?", (sub["candidate_id"],)).fetchone() or {})
         params = cand["params_json"] if cand else "{}"
-        direction = _infer_direction(direction=(cand or {}).get("direction"), params_json=params)
+        direction = _infer_direction(direction=cand.get("direction"), params_json=params)
         normalized_params = _normalize_strategy_params_payload(params, direction=direction)
-        
-        if getattr(conn, "kind", "sqlite") == "postgres":
-            row = conn.execute(
-                "INSERT INTO strategies (submission_id, user_id, pool_id, direction, params_json, status, allocation_pct, note, created_at, expires_at, external_key) VALUES (?, ?, ?, ?, ?, 'active', ?, ?, ?, ?, ?) RETURNING id",
-                (
-                    sub_id,
-                    sub["user_id"],
-                    sub["pool_id"],
-                    direction,
-                    json.dumps(normalized_params, ensure_ascii=False),
-                    allocation_pct,
-                    note,
-                    _now_iso(),
-                    "2099-12-31T23:59:59Z",
-                    "",
-                )
-            ).fetchone()
-            new_id = int((row or {}).get("id") or 0)
-        else:
-            cur = conn.execute(
-                "INSERT INTO strategies (submission_id, user_id, pool_id, direction, params_json, status, allocation_pct, note, created_at, expires_at, external_key) VALUES (?, ?, ?, ?, ?, 'active', ?, ?, ?, ?, ?)",
-                (
-                    sub_id,
-                    sub["user_id"],
-                    sub["pool_id"],
-                    direction,
-                    json.dumps(normalized_params, ensure_ascii=False),
-                    allocation_pct,
-                    note,
-                    _now_iso(),
-                    "2099-12-31T23:59:59Z",
-                    "",
-                )
+
+        # SQLite 3.35+ 與 PostgreSQL 皆支援 RETURNING，單一路徑取回新 id
+        row = conn.execute(
+            "INSERT INTO strategies (submission_id, user_id, pool_id, direction, params_json, status, allocation_pct, note, created_at, expires_at, external_key) VALUES (?, ?, ?, ?, ?, 'active', ?, ?, ?, ?, ?) RETURNING id",
+            (
+                sub_id,
+                sub["user_id"],
+                sub["pool_id"],
+                direction,
+                json.dumps(normalized_params, ensure_ascii=False),
+                allocation_pct,
+                note,
+                _now_iso(),
+                "2099-12-31T23:59:59Z",
+                "",
             )
-            new_id = int(cur.lastrowid)
-            
+        ).fetchone()
+        new_id = int(dict(row or {}).get("id") or 0)
         conn.commit()
         return new_id
     finally:
@@ -5105,25 +6431,85 @@ def payout_exists(strategy_id: int, week_start_ts: str) -> bool:
     finally:
         conn.close()
 
+_SQL_INSERT_PAYOUT = """
+INSERT INTO payouts (strategy_id, user_id, week_start_ts, amount_usdt, status, created_at, cycle_id)
+VALUES (?, ?, ?, ?, 'unpaid', ?, (
+    SELECT fp.cycle_id
+    FROM strategies s
+    JOIN factor_pools fp ON fp.id = s.pool_id
+    WHERE s.id = ?
+))
+RETURNING id
+"""
+_SQL_INSERT_WEEKLY_CHECK = "INSERT INTO weekly_checks (strategy_id, week_start_ts, week_end_ts, return_pct, max_drawdown_pct, trades, eligible, checked_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+
+
 def create_payout(strategy_id: int, user_id: int, week_start_ts: str, amount_usdt: float) -> int:
     conn = _conn()
     try:
-        cur = conn.execute("INSERT INTO payouts (strategy_id, user_id, week_start_ts, amount_usdt, status, created_at) VALUES (?, ?, ?, ?, 'unpaid', ?)",
-                           (strategy_id, user_id, week_start_ts, amount_usdt, _now_iso()))
+        row = conn.execute(_SQL_INSERT_PAYOUT, (strategy_id, user_id, week_start_ts, amount_usdt, _now_iso(), strategy_id)).fetchone()
         conn.commit()
-        return cur.lastrowid
+        return int(dict(row or {}).get("id") or 0)
     finally:
         conn.close()
 
 def create_weekly_check(strategy_id: int, week_start_ts: str, week_end_ts: str, return_pct: float, max_drawdown_pct: float, trades: int, eligible: bool) -> None:
     conn = _conn()
     try:
-        conn.execute("INSERT INTO weekly_checks (strategy_id, week_start_ts, week_end_ts, return_pct, max_drawdown_pct, trades, eligible, checked_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        conn.execute(_SQL_INSERT_WEEKLY_CHECK,
                      (strategy_id, week_start_ts, week_end_ts, return_pct, max_drawdown_pct, trades, 1 if eligible else 0, _now_iso()))
         conn.commit()
     finally:
         conn.close()
 
+def record_weekly_settlement(
+    strategy_id: int,
+    user_id: int,
+    week_start_ts: str,
+    week_end_ts: str,
+    return_pct: float,
+    max_drawdown_pct: float,
+    trades: int,
+    eligible: bool,
+    payout_amount_usdt: float = 0.0,
+) -> int:
+    """週結算一次寫完：weekly_check + 不合格停權 + 發放紀錄（同週不重複），回傳新 payout id（未發放為 0）。
+
+    「查重 -> 寫入」在同一個交易、同一把寫鎖內，不會重複發放。
+    """
+    conn = _conn()
+    try:
+        if getattr(conn, "kind", "sqlite") != "postgres":
+            conn.execute("BEGIN IMMEDIATE")
+        now = _now_iso()
+        conn.execute(
+            _SQL_INSERT_WEEKLY_CHECK,
+            (strategy_id, week_start_ts, week_end_ts, return_pct, max_drawdown_pct, trades, 1 if eligible else 0, now),
+        )
+        if not eligible:
+            conn.execute("UPDATE strategies SET status = 'disqualified' WHERE id = ?", (strategy_id,))
+        payout_id = 0
+        if eligible and float(payout_amount_usdt or 0.0) > 0.0:
+            exists = conn.execute(
+                "SELECT 1 FROM payouts WHERE strategy_id = ? AND week_start_ts = ?", (strategy_id, week_start_ts)
+            ).fetchone()
+            if not exists:
+                row = conn.execute(
+                    _SQL_INSERT_PAYOUT,
+                    (strategy_id, user_id, week_start_ts, float(payout_amount_usdt), now, strategy_id),
+                ).fetchone()
+                payout_id = int(dict(row or {}).get("id") or 0)
+        conn.commit()
+        return payout_id
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
+    finally:
+        conn.close()
+
 def set_payout_paid(payout_id: int, txid: str) -> None:
     conn = _conn()
     try:
@@ -5133,110 +6519,346 @@ def set_payout_paid(payout_id: int, txid: str) -> None:
         conn.close()
 
 def get_task(task_id: int) -> Optional[dict]:
-    conn = _conn()
-    try:
+    flush_task_progress(int(task_id))
+    with _conn_ro() as conn:
         row = conn.execute("SELECT t.*, p.family, p.symbol, p.timeframe_min, p.years, p.grid_spec_json, p.risk_spec_json, p.seed, p.name as pool_name FROM mining_tasks t LEFT JOIN factor_pools p ON t.pool_id = p.id WHERE t.id = ?", (task_id,)).fetchone()
         return dict(row) if row else None
-    finally:
-        conn.close()
 
-def update_task_progress(task_id: int, progress: dict) -> None:
-    import random, time
-    summary = _task_progress_summary(progress)
-    for attempt in range(15):
-        try:
-            conn = _conn()
-            try:
-                old_done = _read_task_done_counter(conn, int(task_id))
-                conn.execute(
-                    """
-                    UPDATE mining_tasks
-                    SET progress_json = ?, progress_combos_done = ?, progress_combos_total = ?, progress_elapsed_s = ?, updated_at = ?, last_heartbeat = ?
-                    WHERE id = ?
-                    """,
-                    (
-                        json.dumps(progress, ensure_ascii=False),
-                        int(summary["combos_done"]),
-                        int(summary["combos_total"]),
-                        float(summary["elapsed_s"]),
-                        _now_iso(),
-                        _now_iso(),
-                        task_id,
-                    )
-                )
-                _refresh_task_done_counter_delta(conn, int(task_id), summary["combos_done"], old_done=old_done)
-                conn.commit()
-                invalidate_global_dashboard_counters()
-                break
-            finally:
-                conn.close()
-        except Exception as e:
-            if attempt == 14:
-                print(f"[CRITICAL DB ERROR] update_task_progress 放棄重試: {e}")
-                # 吞下錯誤，絕對不拋出異常，防止執行緒崩潰導致任務被標記為 error
-                break
-            time.sleep(random.uniform(0.1, 0.5) * (1.2 ** attempt))
+# 高頻寫入的 SQL 固定成模組常數，穩定命中 statement cache
+_SQL_UPDATE_TASK_PROGRESS = (
+    "UPDATE mining_tasks SET progress_json = ?, progress_combos_done = ?, progress_combos_total = ?, progress_elapsed_s = ?, updated_at = ?, last_heartbeat = ? "
+    "WHERE id = ?"
+)
+_SQL_UPDATE_TASK_STATUS = "UPDATE mining_tasks SET status = ?, updated_at = ?, last_heartbeat = ? WHERE id = ?"
+_SQL_TASK_HEARTBEAT = "UPDATE mining_tasks SET last_heartbeat = ? WHERE id = ? AND user_id = ?"
+_SQL_WORKER_TOUCH = "UPDATE workers SET last_seen_at = ?, last_task_id = ?, avg_cps = COALESCE(avg_cps, 0) * ? + ? WHERE worker_id = ?"
+# 沒有實質變化的 worker 心跳不命中 UPDATE；last_seen_at 最多落後 _WORKER_TOUCH_MIN_INTERVAL_S 秒
+_WORKER_TOUCH_MIN_INTERVAL_S = 5
+_WORKER_TOUCH_CPS_EPS = 0.01
+_SQL_WORKER_TOUCH_IF_CHANGED = {
+    "sqlite": _SQL_WORKER_TOUCH + (
+        f" AND (ABS(COALESCE(avg_cps, 0) * ? + ? - COALESCE(avg_cps, 0)) > {_WORKER_TOUCH_CPS_EPS}"
+        " OR last_task_id IS NOT ? OR last_seen_at IS NULL OR last_seen_at < ?)"
+    ),
+    "postgres": _SQL_WORKER_TOUCH + (
+        f" AND (ABS(COALESCE(avg_cps, 0) * ? + ? - COALESCE(avg_cps, 0)) > {_WORKER_TOUCH_CPS_EPS}"
+        " OR last_task_id IS DISTINCT FROM ? OR last_seen_at IS NULL OR last_seen_at < ?)"
+    ),
+}
+_WORKER_TOUCH_ALPHA = 0.15
+_SQL_UPSERT_WORKER = """
+    INSERT INTO workers (worker_id, user_id, kind, version, protocol, created_at, last_seen_at, meta_json)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(worker_id) DO UPDATE SET
+        user_id=excluded.user_id,
+        kind=excluded.kind,
+        version=excluded.version,
+        protocol=excluded.protocol,
+        last_seen_at=excluded.last_seen_at,
+        meta_json=excluded.meta_json
+"""
+_SQL_CLAIM_TASK_FOR_RUN = "UPDATE mining_tasks SET status = 'running', updated_at = ? WHERE id = ? AND status IN ('assigned', 'queued')"
+_SQL_INSERT_CANDIDATES_HEAD = "INSERT INTO candidates (task_id, user_id, pool_id, direction, params_json, metrics_json, score, created_at, is_submitted) VALUES "
+_SQL_INSERT_CANDIDATE_ROW = "(?, ?, ?, ?, ?, ?, ?, ?, ?)"
+_SQL_INSERT_AUTO_SUBMISSIONS_HEAD = "INSERT INTO submissions (candidate_id, user_id, pool_id, status, audit_json, submitted_at) VALUES "
+_SQL_INSERT_AUTO_SUBMISSION_ROW = "(?, ?, ?, 'approved', '{}', ?)"
+_SQL_INSERT_AUTO_STRATEGIES_HEAD = (
+    "INSERT INTO strategies (submission_id, user_id, pool_id, direction, params_json, status, allocation_pct, note, created_at, expires_at, external_key) VALUES "
+)
+_SQL_INSERT_AUTO_STRATEGY_ROW = "(?, ?, ?, ?, ?, 'active', 1.0, 'Auto-Deploy', ?, ?, '')"
 
-def update_task_status(task_id: int, status: str, finished: bool = False) -> None:
-    import random, time
-    for attempt in range(15):
+
+def _worker_touch_rows(items: List[Tuple[str, Optional[int], float, float, str]]) -> List[Tuple[Any, ...]]:
+    stale_before = _iso_add_seconds(-_WORKER_TOUCH_MIN_INTERVAL_S)
+    return [(now, tid, m, a, wid, m, a, tid, stale_before) for now, tid, m, a, wid in items]
+
+
+# 進度與心跳合併寫入，由背景執行緒每 250ms 單一交易落地；讀取任務狀態的入口會先 flush 該任務
+_PROGRESS_COALESCER: Dict[str, Any] = {
+    "progress": {},
+    "heartbeats": {},
+    # worker_id -> [last_seen_at, last_task_id, mult, add]；多筆 EMA 樣本摺成 avg_cps * mult + add
+    "worker_touches": {},
+    # worker_id -> upsert_worker 的參數列；每個 worker 請求都會 upsert，同一週期只留最後一筆
+    "worker_upserts": {},
+    "interval": 0.25,
+    "thread": None,
+    "lock": threading.Lock(),
+    "flush_lock": threading.Lock(),
+}
+
+
+def _progress_coalesce_enabled() -> bool:
+    return str(os.environ.get("SHEEP_DB_PROGRESS_COALESCE", "1") or "1").strip().lower() not in {"0", "false", "no", "off"}
+
+
+def _progress_coalescer_loop() -> None:
+    while True:
+        time.sleep(float(_PROGRESS_COALESCER.get("interval") or 0.25))
         try:
-            conn = _conn()
-            try:
-                conn.execute(
-                    "UPDATE mining_tasks SET status = ?, updated_at = ?, last_heartbeat = ? WHERE id = ?", 
-                    (status, _now_iso(), _now_iso(), task_id)
-                )
-                conn.commit()
-                break
-            finally:
-                conn.close()
+            flush_task_progress()
         except Exception as e:
-            if attempt == 14:
-                print(f"[CRITICAL DB ERROR] update_task_status 放棄重試: {e}")
-                # 吞下錯誤，絕對不拋出異常
-                break
-            time.sleep(random.uniform(0.1, 0.5) * (1.2 ** attempt))
+            print(f"[DB ERROR] 進度合併寫入失敗: {e}", file=_sys.stderr, flush=True)
 
-def clear_candidates_for_task(task_id: int) -> None:
-    conn = _conn()
+
+def _ensure_progress_coalescer() -> None:
+    with _PROGRESS_COALESCER["lock"]:
+        t = _PROGRESS_COALESCER.get("thread")
+        if t is None or not t.is_alive():
+            t = threading.Thread(target=_progress_coalescer_loop, name="sheep-db-progress", daemon=True)
+            t.start()
+            _PROGRESS_COALESCER["thread"] = t
+
+
+def _merge_worker_touch(older: List[Any], newer: List[Any]) -> List[Any]:
+    # 先套 older 再套 newer：x -> (x * m1 + a1) * m2 + a2
+    return [newer[0], newer[1], float(older[2]) * float(newer[2]), float(older[3]) * float(newer[2]) + float(newer[3])]
+
+
+def _write_task_progress_batch(
+    conn: Any,
+    progress_items: List[Tuple[int, str, Dict[str, Any]]],
+    heartbeat_items: List[Tuple[str, int, int]],
+    worker_touch_items: Optional[List[Tuple[str, Optional[int], float, float, str]]] = None,
+    worker_upsert_items: Optional[List[Tuple[Any, ...]]] = None,
+) -> None:
+    """在呼叫端的交易內寫入一批進度與心跳（不 commit）；全站已挖組合數的增量彙總後只 bump 一次"""
+    if progress_items:
+        # task id 在入列時已轉成 int、summary 由 _task_progress_summary 保證為 int/float，迴圈內不再逐欄重轉型
+        task_ids = [tid for tid, _, _ in progress_items]
+        old_done: Dict[int, int] = {}
+        for start in range(0, len(task_ids), 500):
+            chunk = task_ids[start : start + 500]
+            placeholders = ",".join("?" for _ in chunk)
+            for r in conn.execute(
+                f"SELECT id, progress_combos_done FROM mining_tasks WHERE id IN ({placeholders})",
+                chunk,
+            ).fetchall():
+                rd = dict(r)
+                old_done[int(rd["id"])] = _clamp_nonnegative_int(rd.get("progress_combos_done"))
+        now = _now_iso()
+        rows = []
+        delta = 0
+        for tid, progress_json, summary in progress_items:
+            done = summary["combos_done"]
+            rows.append((progress_json, done, summary["combos_total"], summary["elapsed_s"], now, now, tid))
+            prev = old_done.get(tid)
+            if prev is not None and done > prev:
+                delta += done - prev
+        conn.executemany(_SQL_UPDATE_TASK_PROGRESS, rows, batch=True)
+        if delta > 0:
+            _bump_global_dashboard_counter(conn, _GLOBAL_COUNTER_GLOBAL_MINED_COMBOS, delta)
+    if heartbeat_items:
+        conn.executemany(_SQL_TASK_HEARTBEAT, heartbeat_items, batch=True)
+    # upsert 要先於 touch：新 worker 的列建好後，同批的 EMA 樣本才套得上
+    if worker_upsert_items:
+        conn.executemany(_SQL_UPSERT_WORKER, worker_upsert_items, batch=True)
+    if worker_touch_items:
+        kind = str(getattr(conn, "kind", "sqlite") or "sqlite")
+        conn.executemany(
+            _SQL_WORKER_TOUCH_IF_CHANGED.get(kind, _SQL_WORKER_TOUCH_IF_CHANGED["sqlite"]),
+            _worker_touch_rows(worker_touch_items),
+            batch=True,
+        )
+
+
+def _progress_write_one(conn: Any, label: str, write: Callable[[], None]) -> None:
     try:
-        conn.execute("DELETE FROM candidates WHERE task_id = ?", (task_id,))
+        write()
         conn.commit()
-    finally:
-        conn.close()
-
-def insert_candidate(task_id: int, user_id: int, pool_id: int, params: dict, metrics: dict, score: float) -> int:
-    import time
-    for attempt in range(8):
+    except Exception as e:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        print(f"[DB ERROR] 合併寫入 {label} 失敗，已丟棄該筆: {e}", file=_sys.stderr, flush=True)
+
+
+def flush_task_progress(task_id: Optional[int] = None) -> None:
+    """把合併中的進度/心跳同步寫入；指定 task_id 時只寫該任務"""
+    with _PROGRESS_COALESCER["flush_lock"]:
+        with _PROGRESS_COALESCER["lock"]:
+            pending_progress: Dict[int, Tuple[str, Dict[str, Any]]] = _PROGRESS_COALESCER["progress"]
+            pending_hb: Dict[Tuple[int, int], str] = _PROGRESS_COALESCER["heartbeats"]
+            pending_touch: Dict[str, List[Any]] = _PROGRESS_COALESCER["worker_touches"]
+            pending_upsert: Dict[str, Tuple[Any, ...]] = _PROGRESS_COALESCER["worker_upserts"]
+            if not pending_progress and not pending_hb and not pending_touch and not pending_upsert:
+                return
+            if task_id is None:
+                progress_snapshot = dict(pending_progress)
+                hb_snapshot = dict(pending_hb)
+                touch_snapshot = dict(pending_touch)
+                upsert_snapshot = dict(pending_upsert)
+                pending_progress.clear()
+                pending_hb.clear()
+                pending_touch.clear()
+                pending_upsert.clear()
+            else:
+                tid = int(task_id)
+                progress_snapshot = {tid: pending_progress.pop(tid)} if tid in pending_progress else {}
+                hb_snapshot = {k: pending_hb.pop(k) for k in [k for k in pending_hb if k[0] == tid]}
+                touch_snapshot = {}
+                upsert_snapshot = {}
+        if not progress_snapshot and not hb_snapshot and not touch_snapshot and not upsert_snapshot:
+            return
+        progress_items = [(tid, pj, summ) for tid, (pj, summ) in progress_snapshot.items()]
+        heartbeat_items = [(ts, tid, uid) for (tid, uid), ts in hb_snapshot.items()]
+        touch_items = [(v[0], v[1], float(v[2]), float(v[3]), wid) for wid, v in touch_snapshot.items()]
+        upsert_items = list(upsert_snapshot.values())
         try:
             conn = _conn()
+        except Exception:
+            # 連線都拿不到時整批放回佇列等下一輪，但不覆蓋期間又進來的較新進度
+            with _PROGRESS_COALESCER["lock"]:
+                for tid, item in progress_snapshot.items():
+                    _PROGRESS_COALESCER["progress"].setdefault(tid, item)
+                for key, ts in hb_snapshot.items():
+                    _PROGRESS_COALESCER["heartbeats"].setdefault(key, ts)
+                for wid, item in touch_snapshot.items():
+                    newer = _PROGRESS_COALESCER["worker_touches"].get(wid)
+                    _PROGRESS_COALESCER["worker_touches"][wid] = _merge_worker_touch(item, newer) if newer else item
+                for wid, params in upsert_snapshot.items():
+                    _PROGRESS_COALESCER["worker_upserts"].setdefault(wid, params)
+            raise
+        try:
             try:
-                pool = conn.execute("SELECT direction, risk_spec_json FROM factor_pools WHERE id = ?", (int(pool_id),)).fetchone()
-                direction = _infer_direction(
-                    direction=(pool or {}).get("direction") if pool else None,
-                    params_json=params,
-                    risk_spec_json=(pool or {}).get("risk_spec_json") if pool else None,
-                )
-                if getattr(conn, "kind", "sqlite") == "postgres":
-                    row = conn.execute(
-                        "INSERT INTO candidates (task_id, user_id, pool_id, direction, params_json, metrics_json, score, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?) RETURNING id",
-                        (
-                            task_id,
-                            user_id,
-                            pool_id,
-                            direction,
-                            json.dumps(params, ensure_ascii=False),
-                            json.dumps(metrics, ensure_ascii=False),
-                            score,
-                            _now_iso(),
-                        )
-                    ).fetchone()
-                    conn.commit()
-                    return int((row or {}).get("id") or 0)
+                _write_task_progress_batch(conn, progress_items, heartbeat_items, touch_items, upsert_items)
+                conn.commit()
+            except Exception:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                # 批次失敗時退回逐筆寫入，只丟掉真正寫不進去的那幾筆；
+                # 不再整批放回佇列，否則一筆壞資料會每 250ms 重試失敗、卡住之後所有進度與心跳
+                for item in progress_items:
+                    _progress_write_one(conn, "progress", lambda: _write_task_progress_batch(conn, [item], []))
+                for hb in heartbeat_items:
+                    _progress_write_one(conn, "heartbeat", lambda: _write_task_progress_batch(conn, [], [hb]))
+                # upsert 要先於 touch，新 worker 的列建好後 EMA 樣本才套得上
+                for params in upsert_items:
+                    _progress_write_one(conn, "worker_upsert", lambda: _write_task_progress_batch(conn, [], [], None, [params]))
+                for touch in touch_items:
+                    _progress_write_one(conn, "worker_touch", lambda: _write_task_progress_batch(conn, [], [], [touch]))
+        finally:
+            conn.close()
+    if progress_items:
+        invalidate_global_dashboard_counters()
 
-                cur = conn.execute(
-                    "INSERT INTO candidates (task_id, user_id, pool_id, direction, params_json, metrics_json, score, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+
+def _flush_task_progress_at_exit() -> None:
+    try:
+        flush_task_progress()
+    except Exception as e:
+        print(f"[DB ERROR] 結束前進度寫入失敗: {e}", file=_sys.stderr, flush=True)
+
+
+try:
+    atexit.register(_flush_task_progress_at_exit)
+except Exception:
+    pass
+
+
+def update_task_progress(task_id: int, progress: dict) -> None:
+    tid = int(task_id)
+    summary = _task_progress_summary(progress)
+    if _progress_coalesce_enabled():
+        # 進度在入列當下就序列化，呼叫端之後再改 dict 也不影響待寫入的內容
+        progress_json = _fast_json_dumps(progress)
+        _lease_progress_forget(tid)
+        with _PROGRESS_COALESCER["lock"]:
+            _PROGRESS_COALESCER["progress"][tid] = (progress_json, summary)
+        _ensure_progress_coalescer()
+        return
+    # 鎖等待交給 _conn() 的 PRAGMA busy_timeout 在引擎內處理，不再 Python 端 sleep 重試
+    try:
+        conn = _conn()
+        try:
+            _lease_progress_forget(tid)
+            _write_task_progress_batch(conn, [(tid, _fast_json_dumps(progress), summary)], [])
+            conn.commit()
+        finally:
+            conn.close()
+        invalidate_global_dashboard_counters()
+    except Exception as e:
+        # 吞下錯誤，絕對不拋出異常，防止執行緒崩潰導致任務被標記為 error
+        print(f"[CRITICAL DB ERROR] update_task_progress 寫入失敗: {e}")
+
+def update_task_status(task_id: int, status: str, finished: bool = False) -> None:
+    try:
+        flush_task_progress(int(task_id))
+    except Exception as e:
+        print(f"[DB ERROR] update_task_status flush 進度失敗: {e}")
+    try:
+        conn = _conn()
+        try:
+            now = _now_iso()
+            conn.execute(_SQL_UPDATE_TASK_STATUS, (status, now, now, task_id))
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        # 吞下錯誤，絕對不拋出異常
+        print(f"[CRITICAL DB ERROR] update_task_status 寫入失敗: {e}")
+
+def clear_candidates_for_task(task_id: int) -> None:
+    conn = _conn()
+    try:
+        conn.execute("DELETE FROM candidates WHERE task_id = ?", (task_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# _insert_rows_returning 每批筆數上限（最寬的候選列 9 個參數 x 100 = 900，低於舊版 SQLite 的 999 上限）
+_INSERT_ROWS_RETURNING_CHUNK = 100
+
+
+def _insert_rows_returning(conn: Any, head: str, row_sql: str, values: List[Tuple[Any, ...]], returning: str) -> List[Tuple[int, ...]]:
+    """以多列 VALUES ... RETURNING 分批寫入，回傳依 id 排序的 RETURNING 欄位 tuple（第一欄必須是 id）。
+
+    同一語句內配發的 id 遞增，排序後即對應 values 的順序；呼叫端負責 commit。
+    """
+    cols = [c.strip() for c in returning.split(",")]
+    # 只取整數欄位，走 tuple 列游標
+    run = getattr(conn, "execute_tuples", None) or conn.execute
+    out: List[Tuple[int, ...]] = []
+    for start in range(0, len(values), _INSERT_ROWS_RETURNING_CHUNK):
+        chunk = values[start : start + _INSERT_ROWS_RETURNING_CHUNK]
+        sql = head + ", ".join(row_sql for _ in chunk) + " RETURNING " + returning
+        returned = run(sql, [v for row in chunk for v in row]).fetchall()
+        rows = []
+        for r in returned:
+            if isinstance(r, dict):
+                rows.append(tuple(int(r.get(c) or 0) for c in cols))
+            else:
+                rows.append(tuple(int(v or 0) for v in r))
+        out.extend(sorted(rows))
+    return out
+
+
+def insert_candidates(task_id: int, user_id: int, pool_id: int, items: List[Tuple[dict, dict, float]]) -> List[int]:
+    """批次寫入同一任務的多筆候選 (params, metrics, score)，回傳與 items 同順序的 candidate id。
+
+    以多列 VALUES ... RETURNING id 一次送出；同一語句內配發的 id 遞增，排序後即對應 items 順序。
+    """
+    rows = list(items or [])
+    if not rows:
+        return []
+    try:
+        conn = _conn()
+        try:
+            pool = conn.execute("SELECT direction, risk_spec_json FROM factor_pools WHERE id = ?", (int(pool_id),)).fetchone()
+            pool = dict(pool or {})
+            now = _now_iso()
+            values: List[Tuple[Any, ...]] = []
+            for params, metrics, score in rows:
+                direction = _infer_direction(
+                    direction=pool.get("direction") if pool else None,
+                    params_json=params,
+                    risk_spec_json=pool.get("risk_spec_json") if pool else None,
+                )
+                values.append(
                     (
                         task_id,
                         user_id,
@@ -5245,24 +6867,27 @@ def insert_candidate(task_id: int, user_id: int, pool_id: int, params: dict, met
                         json.dumps(params, ensure_ascii=False),
                         json.dumps(metrics, ensure_ascii=False),
                         score,
-                        _now_iso(),
+                        now,
+                        0,
                     )
                 )
-                conn.commit()
-                return cur.lastrowid
-            finally:
-                conn.close()
-        except Exception as e:
-            if attempt == 7:
-                print(f"[DB ERROR] insert_candidate 失敗: {e}")
-                raise e
-            time.sleep(0.1 * (1.5 ** attempt))
-    return 0
+            ids = _insert_rows_returning(conn, _SQL_INSERT_CANDIDATES_HEAD, _SQL_INSERT_CANDIDATE_ROW, values, "id")
+            conn.commit()
+            return [int(r[0]) for r in ids]
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"[DB ERROR] insert_candidates 失敗: {e}")
+        raise e
+
+def insert_candidate(task_id: int, user_id: int, pool_id: int, params: dict, metrics: dict, score: float) -> int:
+    ids = insert_candidates(task_id, user_id, pool_id, [(params, metrics, score)])
+    return int(ids[0]) if ids else 0
 
 def claim_task_for_run(task_id: int) -> bool:
     conn = _conn()
     try:
-        cur = conn.execute("UPDATE mining_tasks SET status = 'running', updated_at = ? WHERE id = ? AND status IN ('assigned', 'queued')", (_now_iso(), task_id))
+        cur = conn.execute(_SQL_CLAIM_TASK_FOR_RUN, (_now_iso(), task_id))
         conn.commit()
         return cur.rowcount > 0
     finally:
@@ -5271,15 +6896,11 @@ def claim_task_for_run(task_id: int) -> bool:
 def create_submission(candidate_id: int, user_id: int, pool_id: int, audit: dict) -> int:
     conn = _conn()
     try:
-        if getattr(conn, "kind", "sqlite") == "postgres":
-            row = conn.execute("INSERT INTO submissions (candidate_id, user_id, pool_id, audit_json, submitted_at) VALUES (?, ?, ?, ?, ?) RETURNING id",
-                               (candidate_id, user_id, pool_id, json.dumps(audit, ensure_ascii=False), _now_iso())).fetchone()
-            sub_id = int((row or {}).get("id") or 0)
-        else:
-            cur = conn.execute("INSERT INTO submissions (candidate_id, user_id, pool_id, audit_json, submitted_at) VALUES (?, ?, ?, ?, ?)",
-                               (candidate_id, user_id, pool_id, json.dumps(audit, ensure_ascii=False), _now_iso()))
-            sub_id = int(cur.lastrowid)
-            
+        row = conn.execute(
+            "INSERT INTO submissions (candidate_id, user_id, pool_id, audit_json, submitted_at) VALUES (?, ?, ?, ?, ?) RETURNING id",
+            (candidate_id, user_id, pool_id, json.dumps(audit, ensure_ascii=False), _now_iso()),
+        ).fetchone()
+        sub_id = int(dict(row or {}).get("id") or 0)
         conn.execute("UPDATE candidates SET is_submitted = 1 WHERE id = ?", (candidate_id,))
         conn.commit()
         return sub_id
@@ -5314,13 +6935,15 @@ def set_data_hash(symbol: str, tf_min: int, years: int, data_hash: str, ts: str)
         conn.close()
 
 def worker_heartbeat(worker_id: str, user_id: int, task_id: int = None) -> None:
+    if task_id is not None and _progress_coalesce_enabled():
+        with _PROGRESS_COALESCER["lock"]:
+            _PROGRESS_COALESCER["heartbeats"][(int(task_id), int(user_id))] = _now_iso()
+        _ensure_progress_coalescer()
+        return
     conn = _conn()
     try:
         if task_id is not None:
-            conn.execute(
-                "UPDATE mining_tasks SET last_heartbeat = ? WHERE id = ? AND user_id = ?",
-                (_now_iso(), task_id, user_id)
-            )
+            conn.execute(_SQL_TASK_HEARTBEAT, (_now_iso(), task_id, user_id))
             conn.commit()
     except Exception as e:
         print(f"[DB ERROR] worker_heartbeat 失敗: {e}")
@@ -5328,15 +6951,10 @@ def worker_heartbeat(worker_id: str, user_id: int, task_id: int = None) -> None:
         conn.close()
 
 def insert_worker_event(user_id: Optional[int], worker_id: Optional[str], event: str, detail: Any) -> None:
-    conn = _conn()
-    try:
-        conn.execute(
-            "INSERT INTO worker_events (ts, user_id, worker_id, event, detail_json) VALUES (?, ?, ?, ?, ?)",
-            (_now_iso(), int(user_id) if user_id is not None else None, str(worker_id or ""), str(event or ""), json.dumps(detail or {}, ensure_ascii=False)),
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    _write_behind_put(
+        "worker_events",
+        (_now_iso(), int(user_id) if user_id is not None else None, str(worker_id or ""), str(event or ""), json.dumps(detail or {}, ensure_ascii=False)),
+    )
 
 def upsert_worker(worker_id: str, user_id: int, version: str, protocol: int, meta: dict) -> None:
     wid = str(worker_id or "").strip()
@@ -5353,24 +6971,19 @@ def upsert_worker(worker_id: str, user_id: int, version: str, protocol: int, met
     except Exception:
         kind = "worker"
 
+    params = (wid, uid if uid > 0 else None, str(kind), str(version or ""), int(protocol or 0), now, now, json.dumps(meta or {}, ensure_ascii=False))
+    if _progress_coalesce_enabled():
+        # 每個 worker 請求都會走到這裡，交給進度合併執行緒批次寫入
+        with _PROGRESS_COALESCER["lock"]:
+            _PROGRESS_COALESCER["worker_upserts"][wid] = params
+        _ensure_progress_coalescer()
+        return
+
     conn = _conn()
     try:
         # [專家級修復] 徹底移除這裡的 CREATE TABLE 腳本！
         # 建表任務已由 init_db 統一處理，這裡只做純粹的資料寫入，消滅所有 PostgreSQL 語法衝突與連線懸空
-        conn.execute(
-            """
-            INSERT INTO workers (worker_id, user_id, kind, version, protocol, created_at, last_seen_at, meta_json)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(worker_id) DO UPDATE SET
-                user_id=excluded.user_id,
-                kind=excluded.kind,
-                version=excluded.version,
-                protocol=excluded.protocol,
-                last_seen_at=excluded.last_seen_at,
-                meta_json=excluded.meta_json
-            """,
-            (wid, uid if uid > 0 else None, str(kind), str(version or ""), int(protocol or 0), now, now, json.dumps(meta or {}, ensure_ascii=False)),
-        )
+        conn.execute(_SQL_UPSERT_WORKER, params)
         conn.commit()
     finally:
         conn.close()
@@ -5379,12 +6992,25 @@ def _worker_mark_finish(worker_id: str, ok: bool, cps: float = 0.0, err: str = "
     wid = str(worker_id or "").strip()
     if not wid:
         return
+    with _PROGRESS_COALESCER["lock"]:
+        upsert_pending = wid in _PROGRESS_COALESCER["worker_upserts"]
+    if upsert_pending:
+        # 新 worker 的列可能還在合併佇列裡，先落地，下面的 UPDATE 才有列可改
+        flush_task_progress()
     conn = _conn()
     try:
         now = _now_iso()
+        # SQLite 先取寫鎖再讀 avg_cps：讀-改-寫在同一交易內，一次 commit，並發 finish 也不會互相覆蓋 EMA
+        if getattr(conn, "kind", "sqlite") != "postgres":
+            conn.execute("BEGIN IMMEDIATE")
         # 簡單 EMA 平滑 avg_cps（避免亂跳）
-        row = conn.execute("SELECT avg_cps, tasks_done, tasks_fail FROM workers WHERE worker_id=? LIMIT 1", (wid,)).fetchone()
-        prev = float(row["avg_cps"]) if row and row.get("avg_cps") is not None else 0.0
+        row = dict(conn.execute("SELECT avg_cps, tasks_done, tasks_fail FROM workers WHERE worker_id=? LIMIT 1", (wid,)).fetchone() or {})
+        prev = float(row["avg_cps"]) if row.get("avg_cps") is not None else 0.0
+        # 尚在合併佇列中的 worker_touch_progress 樣本先套上，EMA 才不會漏算
+        with _PROGRESS_COALESCER["lock"]:
+            pending_touch = _PROGRESS_COALESCER["worker_touches"].pop(wid, None)
+        if pending_touch:
+            prev = prev * float(pending_touch[2]) + float(pending_touch[3])
         alpha = 0.25
         new_avg = (alpha * float(cps)) + ((1 - alpha) * float(prev))
 
@@ -5393,32 +7019,47 @@ def _worker_mark_finish(worker_id: str, ok: bool, cps: float = 0.0, err: str = "
                 "UPDATE workers SET last_seen_at=?, last_task_id=?, tasks_done=tasks_done+1, avg_cps=? , last_error='' WHERE worker_id=?",
                 (now, int(task_id) if task_id else None, float(new_avg), wid),
             )
-            insert_worker_event(owner_user_id if owner_user_id > 0 else None, wid, "task_finish_ok", {"task_id": int(task_id), "cps": float(cps)})
+            event = ("task_finish_ok", {"task_id": int(task_id), "cps": float(cps)})
         else:
             conn.execute(
                 "UPDATE workers SET last_seen_at=?, last_task_id=?, tasks_fail=tasks_fail+1, avg_cps=? , last_error=? WHERE worker_id=?",
                 (now, int(task_id) if task_id else None, float(new_avg), str(err or "")[:600], wid),
             )
-            insert_worker_event(owner_user_id if owner_user_id > 0 else None, wid, "task_finish_fail", {"task_id": int(task_id), "error": str(err or "")[:600]})
+            event = ("task_finish_fail", {"task_id": int(task_id), "error": str(err or "")[:600]})
 
         conn.commit()
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
     finally:
         conn.close()
+    # 事件在 commit 之後才送出：同步寫入路徑不必等本交易的寫鎖
+    insert_worker_event(owner_user_id if owner_user_id > 0 else None, wid, event[0], event[1])
 
 def worker_touch_progress(worker_id: str, cps: float = 0.0, task_id: int = 0) -> None:
     wid = str(worker_id or "").strip()
     if not wid:
         return
+    alpha = _WORKER_TOUCH_ALPHA
+    if _progress_coalesce_enabled():
+        # 心跳型更新交給合併執行緒；EMA 是仿射變換，多筆樣本可精確摺成一次 UPDATE
+        with _PROGRESS_COALESCER["lock"]:
+            touches = _PROGRESS_COALESCER["worker_touches"]
+            sample = [_now_iso(), int(task_id) if task_id else None, 1.0 - alpha, alpha * float(cps)]
+            prev_item = touches.get(wid)
+            touches[wid] = _merge_worker_touch(prev_item, sample) if prev_item else sample
+        _ensure_progress_coalescer()
+        return
     conn = _conn()
     try:
         now = _now_iso()
-        row = conn.execute("SELECT avg_cps FROM workers WHERE worker_id=? LIMIT 1", (wid,)).fetchone()
-        prev = float(row["avg_cps"]) if row and row.get("avg_cps") is not None else 0.0
-        alpha = 0.15
-        new_avg = (alpha * float(cps)) + ((1 - alpha) * float(prev))
+        kind = str(getattr(conn, "kind", "sqlite") or "sqlite")
         conn.execute(
-            "UPDATE workers SET last_seen_at=?, last_task_id=?, avg_cps=? WHERE worker_id=?",
-            (now, int(task_id) if task_id else None, float(new_avg), wid),
+            _SQL_WORKER_TOUCH_IF_CHANGED.get(kind, _SQL_WORKER_TOUCH_IF_CHANGED["sqlite"]),
+            _worker_touch_rows([(now, int(task_id) if task_id else None, 1.0 - alpha, alpha * float(cps), wid)])[0],
         )
         conn.commit()
     except Exception:
@@ -5426,36 +7067,53 @@ def worker_touch_progress(worker_id: str, cps: float = 0.0, task_id: int = 0) ->
     finally:
         conn.close()
 
+_SQL_WORKER_STATS_COUNTS = """
+    SELECT
+        (SELECT COUNT(*) FROM workers) AS total_workers,
+        (SELECT COUNT(*) FROM workers WHERE last_seen_at >= ?) AS active_workers,
+        (SELECT COUNT(*) FROM worker_events WHERE ts >= ? AND event = 'task_finish_ok') AS ok_n,
+        (SELECT COUNT(*) FROM worker_events WHERE ts >= ? AND event = 'task_finish_fail') AS fail_n
+"""
+_SQL_WORKER_STATS_LIST = (
+    "SELECT worker_id, kind, version, protocol, last_seen_at, last_task_id, tasks_done, tasks_fail, avg_cps, last_error "
+    "FROM workers ORDER BY last_seen_at DESC LIMIT 200"
+)
+
+
 def get_worker_stats_snapshot(window_seconds: int = 60) -> Dict[str, Any]:
     win_s = int(max(10, min(3600, int(window_seconds or 60))))
+    # 管理頁輪詢共用短 TTL 快取，四個計數合併成單一語句
+    cache_key = (_db_kind(), _db_path(), win_s)
+    now_ts = time.time()
+    with _WORKER_STATS_CACHE["lock"]:
+        hit = _WORKER_STATS_CACHE["values"].get(cache_key)
+    if hit and hit[0] > now_ts:
+        cached = dict(hit[1])
+        cached["workers"] = [dict(w) for w in hit[1].get("workers") or []]
+        return cached
+
     now_dt = datetime.now(timezone.utc)
     cutoff = (now_dt - timedelta(seconds=win_s)).isoformat()
     active_cutoff = (now_dt - timedelta(seconds=30)).isoformat()
 
-    conn = _conn()
+    # worker_events 走 write-behind，計數前先把佇列落地，否則 ok/fail 會落後一個 flush 週期又被快取住
+    flush_write_behind()
+    conn = _conn_ro()
     try:
-        total = conn.execute("SELECT COUNT(*) as c FROM workers").fetchone()
-        total_workers = int(total["c"] or 0) if total else 0
-
-        act = conn.execute("SELECT COUNT(*) as c FROM workers WHERE last_seen_at >= ?", (active_cutoff,)).fetchone()
-        active_workers = int(act["c"] or 0) if act else 0
-
-        okr = conn.execute("SELECT COUNT(*) as c FROM worker_events WHERE ts >= ? AND event = 'task_finish_ok'", (cutoff,)).fetchone()
-        far = conn.execute("SELECT COUNT(*) as c FROM worker_events WHERE ts >= ? AND event = 'task_finish_fail'", (cutoff,)).fetchone()
-        ok_n = int(okr["c"] or 0) if okr else 0
-        fail_n = int(far["c"] or 0) if far else 0
+        counts = dict(conn.execute(_SQL_WORKER_STATS_COUNTS, (active_cutoff, cutoff, cutoff)).fetchone() or {})
+        total_workers = int(counts.get("total_workers") or 0)
+        active_workers = int(counts.get("active_workers") or 0)
+        ok_n = int(counts.get("ok_n") or 0)
+        fail_n = int(counts.get("fail_n") or 0)
 
         denom = float(max(1, ok_n + fail_n))
         fail_rate = float(fail_n) / denom
 
         tasks_per_min = float(ok_n) / (float(win_s) / 60.0)
 
-        rows = conn.execute(
-            "SELECT worker_id, kind, version, protocol, last_seen_at, last_task_id, tasks_done, tasks_fail, avg_cps, last_error FROM workers ORDER BY last_seen_at DESC LIMIT 200"
-        ).fetchall()
-        workers = [dict(r) for r in rows] if rows else []
+        workers = _fetchall_dicts(conn.execute(_SQL_WORKER_STATS_LIST))
 
-        return {
+        stats = {
             "window_seconds": win_s,
             "active_workers": int(active_workers),
             "total_workers": int(total_workers),
@@ -5467,6 +7125,9 @@ def get_worker_stats_snapshot(window_seconds: int = 60) -> Dict[str, Any]:
         }
     finally:
         conn.close()
+    with _WORKER_STATS_CACHE["lock"]:
+        _WORKER_STATS_CACHE["values"][cache_key] = (time.time() + float(_WORKER_STATS_CACHE["ttl"]), stats)
+    return dict(stats, workers=[dict(w) for w in workers])
 
 def claim_next_task(user_id: int, worker_id: str) -> Optional[dict]:
     import uuid
@@ -5641,69 +7302,146 @@ def finish_task_with_lease(task_id: int, user_id: int, worker_id: str, lease_id:
 def utc_now_iso() -> str:
     return _now_iso()
 
+# 僵屍任務回收以 UPDATE ... RETURNING 在資料庫內改寫 phase，不逐列往返
+_SQL_ZOMBIE_WHERE = "WHERE (status IN ('running', 'syncing') AND last_heartbeat < ?) OR status = 'error'"
+# 分批回收、各自 commit，避免長時間佔住寫鎖；Postgres 加 SKIP LOCKED
+_CLEANUP_BATCH_ROWS = 1000
+_SQL_ZOMBIE_BATCH_SQLITE = f"WHERE id IN (SELECT id FROM mining_tasks {_SQL_ZOMBIE_WHERE} ORDER BY id LIMIT ?)"
+_SQL_ZOMBIE_BATCH_PG = f"WHERE id IN (SELECT id FROM mining_tasks {_SQL_ZOMBIE_WHERE} ORDER BY id LIMIT ? FOR UPDATE SKIP LOCKED)"
+_SQL_ZOMBIE_STATUS = "CASE WHEN COALESCE(attempt, 0) + 1 >= 4 THEN 'completed' ELSE 'assigned' END"
+_SQL_ZOMBIE_PHASE = "CASE WHEN COALESCE(attempt, 0) + 1 >= 4 THEN 'error' ELSE 'queued' END"
+_SQL_ZOMBIE_PHASE_MSG = (
+    "CASE WHEN COALESCE(attempt, 0) + 1 >= 4 THEN 'task_failed' "
+    "ELSE 'requeued_after_timeout_attempt_' || CAST(COALESCE(attempt, 0) + 1 AS TEXT) END"
+)
+_SQL_ZOMBIE_RECYCLE_SQLITE = f"""
+    UPDATE mining_tasks
+    SET status = {_SQL_ZOMBIE_STATUS},
+        attempt = COALESCE(attempt, 0) + 1,
+        updated_at = ?,
+        progress_json = json_set(
+            CASE WHEN json_valid(progress_json) THEN progress_json ELSE '{{}}' END,
+            '$.phase', {_SQL_ZOMBIE_PHASE},
+            '$.phase_msg', {_SQL_ZOMBIE_PHASE_MSG},
+            '$.last_error', 'zombie_timeout',
+            '$.updated_at', ?
+        )
+    {_SQL_ZOMBIE_BATCH_SQLITE}
+    RETURNING id, attempt, status
+"""
+_SQL_ZOMBIE_RECYCLE_PG = f"""
+    UPDATE mining_tasks
+    SET status = {_SQL_ZOMBIE_STATUS},
+        attempt = COALESCE(attempt, 0) + 1,
+        updated_at = ?,
+        progress_json = (
+            COALESCE(NULLIF(progress_json, ''), '{{}}')::jsonb
+            || jsonb_build_object(
+                'phase', {_SQL_ZOMBIE_PHASE},
+                'phase_msg', {_SQL_ZOMBIE_PHASE_MSG},
+                'last_error', 'zombie_timeout',
+                'updated_at', CAST(? AS TEXT)
+            )
+        )::text
+    {_SQL_ZOMBIE_BATCH_PG}
+    RETURNING id, attempt, status
+"""
+
+
+def _clean_zombie_tasks_rowwise(conn: Any, cutoff_iso: str) -> int:
+    """舊版逐列回收：set-based UPDATE 失敗（例如 Postgres 遇到非法 JSON 無法轉型）時的後備路徑。"""
+    count = 0
+    rows = conn.execute(
+        "SELECT id, progress_json, progress_combos_done, status, attempt FROM mining_tasks WHERE (status IN ('running', 'syncing') AND last_heartbeat < ?) OR status = 'error'",
+        (cutoff_iso,),
+    ).fetchall()
+
+    now = _now_iso()
+    updates_completed: List[Tuple[Any, ...]] = []
+    updates_assigned: List[Tuple[Any, ...]] = []
+    mined_delta = 0
+    for raw_row in rows:
+        row = dict(raw_row or {})
+        tid = int(row["id"])
+        attempt = int(row["attempt"] or 0) + 1
+        old_done = _clamp_nonnegative_int(row.get("progress_combos_done"))
+        try:
+            prog = _fast_json_loads(row["progress_json"] or "{}")
+        except Exception:
+            prog = {}
+
+        if attempt >= 4:
+            prog["phase"] = "error"
+            prog["phase_msg"] = "task_failed"
+            prog["last_error"] = "zombie_timeout"
+            prog["updated_at"] = now
+            summary = _task_progress_summary(prog)
+            mined_delta += max(0, int(summary["combos_done"] - old_done))
+            updates_completed.append((attempt, now, json.dumps(prog, ensure_ascii=False), int(summary["combos_done"]), int(summary["combos_total"]), float(summary["elapsed_s"]), tid))
+        else:
+            prog["phase"] = "queued"
+            prog["phase_msg"] = f"requeued_after_timeout_attempt_{attempt}"
+            prog["last_error"] = "zombie_timeout"
+            prog["updated_at"] = now
+            summary = _task_progress_summary(prog)
+            mined_delta += max(0, int(summary["combos_done"] - old_done))
+            updates_assigned.append((attempt, now, json.dumps(prog, ensure_ascii=False), int(summary["combos_done"]), int(summary["combos_total"]), float(summary["elapsed_s"]), tid))
+        count += 1
+
+    for p in updates_completed:
+        conn.execute(
+            "UPDATE mining_tasks SET status = 'completed', attempt = ?, updated_at = ?, progress_json = ?, progress_combos_done = ?, progress_combos_total = ?, progress_elapsed_s = ? WHERE id = ?",
+            p,
+        )
+        log_sys_event("ZOMBIE_TASK_KILLED", None, f"Zombie task marked completed: {p[6]}", {"task_id": p[6], "attempt": p[0]})
+    for p in updates_assigned:
+        conn.execute(
+            "UPDATE mining_tasks SET status = 'assigned', attempt = ?, updated_at = ?, progress_json = ?, progress_combos_done = ?, progress_combos_total = ?, progress_elapsed_s = ? WHERE id = ?",
+            p,
+        )
+        log_sys_event("ZOMBIE_TASK_RECYCLED", None, f"Zombie task recycled: {p[6]}", {"task_id": p[6], "attempt": p[0]})
+    if mined_delta != 0:
+        _bump_global_dashboard_counter(conn, _GLOBAL_COUNTER_GLOBAL_MINED_COMBOS, mined_delta)
+    if count > 0:
+        conn.commit()
+    return count
+
+
 def clean_zombie_tasks(timeout_minutes: int = 15) -> int:
     """Recycle stale running/syncing tasks and sync progress summary columns."""
     conn = _conn()
     count = 0
     try:
         from datetime import datetime, timedelta, timezone
-        import json
 
         cutoff_dt = datetime.now(timezone.utc) - timedelta(minutes=timeout_minutes)
         cutoff_iso = cutoff_dt.isoformat()
-        rows = conn.execute(
-            "SELECT id, progress_json, progress_combos_done, status, attempt FROM mining_tasks WHERE (status IN ('running', 'syncing') AND last_heartbeat < ?) OR status = 'error'",
-            (cutoff_iso,),
-        ).fetchall()
-
         now = _now_iso()
-        updates_completed: List[Tuple[Any, ...]] = []
-        updates_assigned: List[Tuple[Any, ...]] = []
-        mined_delta = 0
-        for raw_row in rows:
-            row = dict(raw_row or {})
-            tid = int(row["id"])
-            attempt = int(row["attempt"] or 0) + 1
-            old_done = _clamp_nonnegative_int(row.get("progress_combos_done"))
+        sql = _SQL_ZOMBIE_RECYCLE_PG if _db_kind() == "postgres" else _SQL_ZOMBIE_RECYCLE_SQLITE
+        while True:
             try:
-                prog = json.loads(row["progress_json"] or "{}")
+                # 只改 phase 類欄位，progress_combos_* 摘要欄位在每次進度寫入時已同步，沿用原值即可
+                rows = _fetchall_dicts(conn.execute(sql, (now, now, cutoff_iso, _CLEANUP_BATCH_ROWS)))
             except Exception:
-                prog = {}
-
-            if attempt >= 4:
-                prog["phase"] = "error"
-                prog["phase_msg"] = "task_failed"
-                prog["last_error"] = "zombie_timeout"
-                prog["updated_at"] = now
-                summary = _task_progress_summary(prog)
-                mined_delta += max(0, int(summary["combos_done"] - old_done))
-                updates_completed.append((attempt, now, json.dumps(prog, ensure_ascii=False), int(summary["combos_done"]), int(summary["combos_total"]), float(summary["elapsed_s"]), tid))
-            else:
-                prog["phase"] = "queued"
-                prog["phase_msg"] = f"requeued_after_timeout_attempt_{attempt}"
-                prog["last_error"] = "zombie_timeout"
-                prog["updated_at"] = now
-                summary = _task_progress_summary(prog)
-                mined_delta += max(0, int(summary["combos_done"] - old_done))
-                updates_assigned.append((attempt, now, json.dumps(prog, ensure_ascii=False), int(summary["combos_done"]), int(summary["combos_total"]), float(summary["elapsed_s"]), tid))
-            count += 1
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                count += _clean_zombie_tasks_rowwise(conn, cutoff_iso)
+                break
+            conn.commit()
 
-        for p in updates_completed:
-            conn.execute(
-                "UPDATE mining_tasks SET status = 'completed', attempt = ?, updated_at = ?, progress_json = ?, progress_combos_done = ?, progress_combos_total = ?, progress_elapsed_s = ? WHERE id = ?",
-                p,
-            )
-            log_sys_event("ZOMBIE_TASK_KILLED", None, f"Zombie task marked completed: {p[6]}", {"task_id": p[6], "attempt": p[0]})
-        for p in updates_assigned:
-            conn.execute(
-                "UPDATE mining_tasks SET status = 'assigned', attempt = ?, updated_at = ?, progress_json = ?, progress_combos_done = ?, progress_combos_total = ?, progress_elapsed_s = ? WHERE id = ?",
-                p,
-            )
-            log_sys_event("ZOMBIE_TASK_RECYCLED", None, f"Zombie task recycled: {p[6]}", {"task_id": p[6], "attempt": p[0]})
-        if mined_delta != 0:
-            _bump_global_dashboard_counter(conn, _GLOBAL_COUNTER_GLOBAL_MINED_COMBOS, mined_delta)
+            for row in sorted(rows, key=lambda r: int(r.get("id") or 0)):
+                tid = int(row.get("id") or 0)
+                attempt = int(row.get("attempt") or 0)
+                if str(row.get("status") or "") == "completed":
+                    log_sys_event("ZOMBIE_TASK_KILLED", None, f"Zombie task marked completed: {tid}", {"task_id": tid, "attempt": attempt})
+                else:
+                    log_sys_event("ZOMBIE_TASK_RECYCLED", None, f"Zombie task recycled: {tid}", {"task_id": tid, "attempt": attempt})
+                count += 1
+            if len(rows) < _CLEANUP_BATCH_ROWS:
+                break
         if count > 0:
-            conn.commit()
             invalidate_global_dashboard_counters(force=True)
         return count
     except Exception as e:
@@ -5734,7 +7472,7 @@ def clean_zombie_tasks(timeout_minutes: int = 15) -> int:
             tid = row["id"]
             attempt = int(row["attempt"] or 0) + 1
             try:
-                prog = json.loads(row["progress_json"] or "{}")
+                prog = _fast_json_loads(row["progress_json"] or "{}")
             except Exception:
                 prog = {}
             
@@ -5785,6 +7523,7 @@ def update_user_nickname(user_id: int, nickname: str) -> None:
             (safe_nick, _now_iso(), int(user_id)),
         )
         conn.commit()
+        _invalidate_user_cache(int(user_id))
     except Exception as e:
         print(f"[DB ERROR] update_user_nickname: {e}")
         raise
@@ -5809,6 +7548,7 @@ def update_user_profile(user_id: int, *, nickname: Optional[str] = None, avatar_
             (next_nickname, next_avatar_url, _now_iso(), int(user_id)),
         )
         conn.commit()
+        _invalidate_user_cache(int(user_id))
         fresh = conn.execute("SELECT * FROM users WHERE id = ? LIMIT 1", (int(user_id),)).fetchone()
         return _decorate_user_row(fresh, default_avatar_url=_default_avatar_url_from_conn(conn)) if fresh else {}
     finally:
@@ -5818,6 +7558,7 @@ def update_user_profile(user_id: int, *, nickname: Optional[str] = None, avatar_
 def set_default_avatar_url(avatar_url: str) -> str:
     safe_avatar = _sanitize_avatar_url(avatar_url)
     set_setting("default_avatar_data_url", safe_avatar)
+    _invalidate_user_cache()
     return safe_avatar
 
 
@@ -6014,12 +7755,15 @@ def _leaderboard_postgres_recent_agg(conn: Any, cutoff_iso: str, window_end_iso:
 
 
 def _leaderboard_python_fallback(conn: Any, cutoff_iso: str, window_end_iso: str) -> Dict[str, List[Dict[str, Any]]]:
+    # 用 C 實作的 fromisoformat，解析後立即轉成 UTC
     def _parse_iso(value: Any) -> Optional[datetime]:
         text = str(value or "").strip()
         if not text:
             return None
+        if text[-1] in "Zz":
+            text = text[:-1] + "+00:00"
         try:
-            return datetime.fromisoformat(text.replace("Z", "+00:00"))
+            return datetime.fromisoformat(text).astimezone(timezone.utc)
         except Exception:
             return None
 
@@ -6074,12 +7818,13 @@ def _leaderboard_python_fallback(conn: Any, cutoff_iso: str, window_end_iso: str
 
         for row in rows:
             entry = dict(row or {})
-            activity_dt = _parse_iso(entry.get("activity_at")) or _parse_iso(entry.get("created_at"))
+            created_dt = _parse_iso(entry.get("created_at"))
+            activity_dt = _parse_iso(entry.get("activity_at")) or created_dt
             if activity_dt is None:
                 continue
-            if cutoff_dt is not None and activity_dt.astimezone(timezone.utc) < cutoff_dt.astimezone(timezone.utc):
+            if cutoff_dt is not None and activity_dt < cutoff_dt:
                 continue
-            if window_end_dt is not None and activity_dt.astimezone(timezone.utc) > window_end_dt.astimezone(timezone.utc):
+            if window_end_dt is not None and activity_dt > window_end_dt:
                 continue
             try:
                 combos_done = max(0.0, float(entry.get("progress_combos_done") or 0.0))
@@ -6101,14 +7846,10 @@ def _leaderboard_python_fallback(conn: Any, cutoff_iso: str, window_end_iso: str
                         elapsed_s = max(0.0, float(progress.get("elapsed_s") or progress.get("elapsed") or 0.0))
                     except Exception:
                         elapsed_s = max(0.0, float(elapsed_s or 0.0))
-            created_dt = _parse_iso(entry.get("created_at"))
             derived_elapsed_s = 0.0
             if activity_dt is not None and created_dt is not None:
                 try:
-                    derived_elapsed_s = max(
-                        0.0,
-                        float((activity_dt.astimezone(timezone.utc) - created_dt.astimezone(timezone.utc)).total_seconds()),
-                    )
+                    derived_elapsed_s = max(0.0, float((activity_dt - created_dt).total_seconds()))
                 except Exception:
                     derived_elapsed_s = 0.0
             elapsed_s = max(float(elapsed_s or 0.0), float(derived_elapsed_s or 0.0))
@@ -6181,12 +7922,100 @@ def _leaderboard_python_fallback(conn: Any, cutoff_iso: str, window_end_iso: str
     return {"combos": combos_rows, "time": time_rows}
 
 
+# 排行榜單段查詢：(類別, 輸出欄名, SQL, 是否帶 cutoff 參數, 型別)；v 統一轉成 DOUBLE PRECISION，UNION ALL 兩種方言都能對齊型別
+_LEADERBOARD_SECTIONS: List[Tuple[str, str, str, bool, Any]] = [
+    (
+        "score",
+        "max_score",
+        """
+            SELECT u.id AS uid, u.username, u.nickname, u.avatar_url, CAST(MAX(c.score) AS DOUBLE PRECISION) as v
+            FROM candidates c
+            JOIN users u ON c.user_id = u.id
+            WHERE c.created_at >= ?
+            GROUP BY u.id, u.username, u.nickname, u.avatar_url
+            ORDER BY v DESC
+            LIMIT 300
+        """,
+        True,
+        float,
+    ),
+    (
+        "points",
+        "total_usdt",
+        """
+            SELECT u.id AS uid, u.username, u.nickname, u.avatar_url, CAST(SUM(p.amount_usdt) AS DOUBLE PRECISION) as v
+            FROM payouts p
+            JOIN users u ON p.user_id = u.id
+            WHERE p.created_at >= ?
+            GROUP BY u.id, u.username, u.nickname, u.avatar_url
+            ORDER BY v DESC
+            LIMIT 300
+        """,
+        True,
+        float,
+    ),
+    (
+        "qualified_strategies",
+        "active_strategy_count",
+        """
+            SELECT u.id AS uid, u.username, u.nickname, u.avatar_url, CAST(COUNT(st.id) AS DOUBLE PRECISION) as v
+            FROM strategies st
+            JOIN users u ON st.user_id = u.id
+            WHERE COALESCE(st.status, '') = 'active'
+            GROUP BY u.id, u.username, u.nickname, u.avatar_url
+            ORDER BY v DESC, u.id ASC
+            LIMIT 300
+        """,
+        False,
+        int,
+    ),
+]
+
+
+def _leaderboard_fetch_sections(conn: Any, cutoff_iso: str, default_avatar_url: str) -> Dict[str, List[Dict[str, Any]]]:
+    buckets: Dict[str, List[Dict[str, Any]]] = {cat: [] for cat, _, _, _, _ in _LEADERBOARD_SECTIONS}
+    try:
+        fused_sql = "\nUNION ALL\n".join(
+            f"SELECT '{cat}' AS cat, s.uid, s.username, s.nickname, s.avatar_url, s.v FROM ({sql}) s"
+            for cat, _, sql, _, _ in _LEADERBOARD_SECTIONS
+        )
+        params = tuple(cutoff_iso for _, _, _, uses_cutoff, _ in _LEADERBOARD_SECTIONS if uses_cutoff)
+        for r in _fetchall_dicts(conn.execute(fused_sql, params)):
+            buckets.setdefault(str(r.get("cat") or ""), []).append(r)
+    except Exception as e:
+        print(f"[DB WARN] Leaderboard fused section query failed, querying sections one by one: {e}")
+        buckets = {}
+        for cat, _, sql, uses_cutoff, _ in _LEADERBOARD_SECTIONS:
+            try:
+                buckets[cat] = _fetchall_dicts(conn.execute(sql, (cutoff_iso,) if uses_cutoff else None))
+            except Exception as section_err:
+                print(f"[DB WARN] Leaderboard {cat} query failed: {section_err}")
+                buckets[cat] = []
+
+    out: Dict[str, List[Dict[str, Any]]] = {}
+    for cat, field, _, _, cast in _LEADERBOARD_SECTIONS:
+        rows = [r for r in buckets.get(cat) or [] if r.get("v") is not None]
+        # UNION ALL 不保證各段內的順序，依原 ORDER BY 在 Python 端重排
+        rows.sort(key=lambda r: (-float(r["v"]), int(r.get("uid") or 0)))
+        decorated: List[Dict[str, Any]] = []
+        for r in rows:
+            value = cast(r.pop("v"))
+            if cat != "score" and value <= 0:
+                continue
+            r.pop("cat", None)
+            r.pop("uid", None)
+            r[field] = value
+            decorated.append(_decorate_user_row(r, default_avatar_url=default_avatar_url))
+        out[cat] = decorated
+    return out
+
+
 def get_leaderboard_stats(period_hours: int = 720) -> dict:
     """
     專家級聚合查詢：一次性撈取排行榜所需的所有維度數據。
     period_hours: 1 (1h), 24 (24h), 720 (30d)
     """
-    conn = _conn()
+    conn = _conn_ro()
     try:
         hours = max(1, min(720, int(period_hours or 720)))
         now_dt = datetime.now(timezone.utc)
@@ -6223,27 +8052,29 @@ def get_leaderboard_stats(period_hours: int = 720) -> dict:
                     results["combos"] = []
                     results["time"] = []
         else:
-            done_expr, _, elapsed_expr = _get_progress_summary_columns(conn)
+            # 直接加總 NOT NULL 的反正規化欄位，先依 user_id 聚合再 JOIN users
             sql_combos = """
-                SELECT u.username, u.nickname, u.avatar_url, COUNT(t.id) as task_count,
-                       SUM(""" + done_expr + """) as total_done
-                FROM mining_tasks t
-                JOIN users u ON t.user_id = u.id
-                WHERE COALESCE(t.last_heartbeat, t.updated_at, t.created_at) >= ?
-                  AND COALESCE(t.last_heartbeat, t.updated_at, t.created_at) <= ?
-                  AND t.status IN ('running', 'completed')
-                GROUP BY u.id, u.username, u.nickname, u.avatar_url
-                ORDER BY total_done DESC
+                SELECT u.username, u.nickname, u.avatar_url, agg.task_count, agg.total_done
+                FROM (
+                    SELECT t.user_id, COUNT(t.id) as task_count, SUM(t.progress_combos_done) as total_done
+                    FROM mining_tasks t
+                    WHERE COALESCE(t.last_heartbeat, t.updated_at, t.created_at) >= ?
+                      AND COALESCE(t.last_heartbeat, t.updated_at, t.created_at) <= ?
+                      AND t.status IN ('running', 'completed')
+                    GROUP BY t.user_id
+                ) agg
+                JOIN users u ON agg.user_id = u.id
+                ORDER BY agg.total_done DESC
                 LIMIT 300
             """
             sql_time = """
-                WITH task_elapsed AS (
+                SELECT u.username, u.nickname, u.avatar_url, agg.total_seconds
+                FROM (
                     SELECT
-                        t.id,
                         t.user_id,
-                        MAX(
+                        SUM(
                             MAX(
-                                """ + elapsed_expr + """,
+                                t.progress_elapsed_s,
                                 CASE
                                     WHEN COALESCE(t.created_at, '') = '' THEN 0.0
                                     ELSE MAX(
@@ -6252,19 +8083,15 @@ def get_leaderboard_stats(period_hours: int = 720) -> dict:
                                     )
                                 END
                             )
-                        ) as elapsed_s
+                        ) as total_seconds
                     FROM mining_tasks t
                     WHERE COALESCE(t.last_heartbeat, t.updated_at, t.created_at) >= ?
                       AND COALESCE(t.last_heartbeat, t.updated_at, t.created_at) <= ?
                       AND t.status IN ('running', 'completed')
-                    GROUP BY t.id, t.user_id
-                )
-                SELECT u.username, u.nickname, u.avatar_url,
-                       SUM(te.elapsed_s) as total_seconds
-                FROM task_elapsed te
-                JOIN users u ON te.user_id = u.id
-                GROUP BY u.id, u.username, u.nickname, u.avatar_url
-                ORDER BY total_seconds DESC
+                    GROUP BY t.user_id
+                ) agg
+                JOIN users u ON agg.user_id = u.id
+                ORDER BY agg.total_seconds DESC
                 LIMIT 300
             """
             try:
@@ -6278,24 +8105,11 @@ def get_leaderboard_stats(period_hours: int = 720) -> dict:
                 print(f"[DB WARN] Leaderboard combos query failed: {e}")
                 results["combos"] = []
 
-        sql_score = """
-            SELECT u.username, u.nickname, u.avatar_url, MAX(c.score) as max_score
-            FROM candidates c
-            JOIN users u ON c.user_id = u.id
-            WHERE c.created_at >= ?
-            GROUP BY u.id, u.username, u.nickname, u.avatar_url
-            ORDER BY max_score DESC
-            LIMIT 300
-        """
-        try:
-            rows = conn.execute(sql_score, (cutoff_iso,)).fetchall()
-            results["score"] = [
-                _decorate_user_row(dict(r), default_avatar_url=default_avatar_url)
-                for r in rows
-                if r["max_score"] is not None
-            ]
-        except Exception:
-            results["score"] = []
+        # 三個榜單合併成單一 UNION ALL 查詢；失敗時才逐段各查一次
+        sections = _leaderboard_fetch_sections(conn, cutoff_iso, default_avatar_url)
+        results["score"] = sections["score"]
+        results["points"] = sections["points"]
+        results["qualified_strategies"] = sections["qualified_strategies"]
 
         if db_kind != "postgres":
             try:
@@ -6319,26 +8133,6 @@ def get_leaderboard_stats(period_hours: int = 720) -> dict:
                 except Exception as e:
                     print(f"[DB WARN] Leaderboard python fallback failed: {e}")
 
-        sql_points = """
-            SELECT u.username, u.nickname, u.avatar_url, SUM(p.amount_usdt) as total_usdt
-            FROM payouts p
-            JOIN users u ON p.user_id = u.id
-            WHERE p.created_at >= ?
-            GROUP BY u.id, u.username, u.nickname, u.avatar_url
-            ORDER BY total_usdt DESC
-            LIMIT 300
-        """
-        try:
-            rows = conn.execute(sql_points, (cutoff_iso,)).fetchall()
-            results["points"] = [
-                _decorate_user_row(dict(r), default_avatar_url=default_avatar_url)
-                for r in rows
-                if r["total_usdt"] is not None and float(r["total_usdt"]) > 0
-            ]
-        except Exception as e:
-            print(f"[DB WARN] Leaderboard points query failed: {e}")
-            results["points"] = []
-
         if not results["points"]:
             sql_points_all_time = """
                 SELECT u.username, u.nickname, u.avatar_url, SUM(p.amount_usdt) as total_usdt
@@ -6405,26 +8199,6 @@ def get_leaderboard_stats(period_hours: int = 720) -> dict:
                     except Exception as e:
                         print(f"[DB WARN] Leaderboard all-time points fallback query failed: {e}")
 
-        sql_qualified_strategies = """
-            SELECT u.username, u.nickname, u.avatar_url, COUNT(st.id) as active_strategy_count
-            FROM strategies st
-            JOIN users u ON st.user_id = u.id
-            WHERE COALESCE(st.status, '') = 'active'
-            GROUP BY u.id, u.username, u.nickname, u.avatar_url
-            ORDER BY active_strategy_count DESC, u.id ASC
-            LIMIT 300
-        """
-        try:
-            rows = conn.execute(sql_qualified_strategies).fetchall()
-            results["qualified_strategies"] = [
-                _decorate_user_row(dict(r), default_avatar_url=default_avatar_url)
-                for r in rows
-                if r["active_strategy_count"] is not None and int(r["active_strategy_count"]) > 0
-            ]
-        except Exception as e:
-            print(f"[DB WARN] Leaderboard qualified_strategies query failed: {e}")
-            results["qualified_strategies"] = []
-
         return results
     except Exception as e:
         print(f"[DB ERROR] get_leaderboard_stats: {e}")
@@ -6454,6 +8228,26 @@ def _lease_extend_seconds() -> int:
 _LAST_REAP_TS = 0.0
 _REAP_LOCK = __import__("threading").Lock()
 
+# 背景回收每個 tick 都跑同一條 UPDATE：固定成模組常數，SQLite 端由 cached_statements 重用同一條 statement
+_SQL_REAP_EXPIRED_RUNNING_SET = (
+    "UPDATE mining_tasks SET status='assigned', lease_id=NULL, lease_worker_id=NULL, lease_expires_at=NULL, updated_at=? "
+    "WHERE id IN (SELECT id FROM mining_tasks WHERE status='running' AND lease_expires_at IS NOT NULL AND lease_expires_at < ? "
+    "ORDER BY id LIMIT ?"
+)
+# 同 clean_zombie_tasks：每批最多 _CLEANUP_BATCH_ROWS 列，Postgres 挑選時跳過正被 worker 鎖住的列
+_SQL_REAP_EXPIRED_RUNNING = {
+    "sqlite": _SQL_REAP_EXPIRED_RUNNING_SET + ")",
+    "postgres": _SQL_REAP_EXPIRED_RUNNING_SET + " FOR UPDATE SKIP LOCKED)",
+}
+
+
+def _reap_expired_running_batch(conn: _DBConn) -> int:
+    now = _utc_now_iso()
+    sql = _SQL_REAP_EXPIRED_RUNNING.get(str(getattr(conn, "kind", "sqlite") or "sqlite"), _SQL_REAP_EXPIRED_RUNNING["sqlite"])
+    cur = conn.execute(sql, (now, now, _CLEANUP_BATCH_ROWS))
+    return int(cur.rowcount or 0)
+
+
 def _reap_expired_running(conn: _DBConn) -> int:
     global _LAST_REAP_TS
     import time
@@ -6465,137 +8259,188 @@ def _reap_expired_running(conn: _DBConn) -> int:
         return 0
     try:
         _LAST_REAP_TS = time.time()
-        now = _utc_now_iso()
-        cur = conn.execute(
-            """
-            UPDATE mining_tasks
-            SET status='assigned', lease_id=NULL, lease_worker_id=NULL, lease_expires_at=NULL, updated_at=?
-            WHERE status='running' AND lease_expires_at IS NOT NULL AND lease_expires_at < ?
-            """,
-            (now, now),
-        )
-        return int(cur.rowcount or 0)
+        return _reap_expired_running_batch(conn)
     except Exception:
         return 0
     finally:
         _REAP_LOCK.release()
 
-def claim_next_task_any(worker_id: str) -> Optional[dict]:
-    # compute token 專用：跨用戶派工（只派給 run_enabled=1）
-    wid = str(worker_id or "").strip()
-    if not wid:
-        return None
 
-    lease_s = _lease_seconds_default()
-    lease_id = _uuid.uuid4().hex
-    now = _utc_now_iso()
-    exp = _iso_add_seconds(lease_s)
+# 過期 lease 由背景執行緒回收（首次派工時啟動，SHEEP_LEASE_REAPER=0 退回同步回收），只跑最近派工所在的 DB
+_LEASE_REAPER: Dict[str, Any] = {
+    "thread": None,
+    "scope": "",
+    "lock": threading.Lock(),
+}
 
-    conn = _conn()
-    try:
-        _reap_expired_running(conn)
-        c_row = conn.execute("SELECT id FROM mining_cycles WHERE status = 'active' ORDER BY id DESC LIMIT 1").fetchone()
-        c_id = int(c_row["id"]) if c_row else 0
 
-        if getattr(conn, "kind", "sqlite") == "postgres":
-            candidate_params = []
-            candidate_sql = """
-                SELECT id, user_id, pool_id
-                FROM mining_tasks
-                WHERE status IN ('assigned','queued')
-            """
-            if c_id > 0:
-                candidate_sql += "\n  AND cycle_id=?"
-                candidate_params.append(c_id)
-            candidate_sql += "\nORDER BY id ASC\nFOR UPDATE SKIP LOCKED\nLIMIT 64"
-            candidates = conn.execute(candidate_sql, tuple(candidate_params) if candidate_params else None).fetchall()
-            row = None
-            for candidate in list(candidates or []):
-                tid = int((dict(candidate) if candidate else {}).get("id") or 0)
-                uid = int((dict(candidate) if candidate else {}).get("user_id") or 0)
-                pool_id = int((dict(candidate) if candidate else {}).get("pool_id") or 0)
-                if tid <= 0 or uid <= 0 or pool_id <= 0:
-                    continue
-                user_row = conn.execute(
-                    "SELECT COALESCE(disabled,0) AS disabled, COALESCE(run_enabled,1) AS run_enabled FROM users WHERE id=?",
-                    (uid,),
-                ).fetchone()
-                if not user_row:
-                    continue
-                if int((dict(user_row).get("disabled") or 0)) != 0:
-                    continue
-                if int((dict(user_row).get("run_enabled") or 1)) == 0:
-                    continue
-                pool_row = conn.execute(
-                    "SELECT COALESCE(active,1) AS active FROM factor_pools WHERE id=?",
-                    (pool_id,),
-                ).fetchone()
-                if not pool_row:
-                    continue
-                if int((dict(pool_row).get("active") or 1)) == 0:
-                    continue
-                row = {"id": tid}
-                break
-        else:
-            row = conn.execute(
-                """
-                SELECT t.id
-                FROM mining_tasks t
-                JOIN users u ON u.id = t.user_id
-                JOIN factor_pools p ON p.id = t.pool_id
-                WHERE t.status IN ('assigned','queued')
-                  AND (? <= 0 OR t.cycle_id=?)
-                  AND COALESCE(u.disabled,0)=0
-                  AND COALESCE(u.run_enabled,1)=1
-                  AND COALESCE(p.active,1)=1
-                ORDER BY t.id ASC
-                LIMIT 1
-                """,
-                (c_id, c_id),
-            ).fetchone()
+def _lease_reaper_enabled() -> bool:
+    return str(os.environ.get("SHEEP_LEASE_REAPER", "1") or "1").strip().lower() not in {"0", "false", "no", "off"}
 
-        if not row:
-            conn.commit()
-            return None
 
+def _lease_reaper_interval_s() -> float:
+    try:
+        return max(1.0, float(os.environ.get("SHEEP_LEASE_REAP_INTERVAL_S", "5") or "5"))
+    except Exception:
+        return 5.0
+
+
+def _lease_reaper_loop() -> None:
+    while True:
+        time.sleep(_lease_reaper_interval_s())
         try:
-            tid = int((dict(row) if row else {}).get("id") or 0)
-        except Exception:
-            tid = int(row["id"] or 0) if row else 0
-        if tid <= 0:
-            conn.commit()
-            return None
+            conn = _conn_for_scope(str(_LEASE_REAPER["scope"]))
+            if conn is None:
+                continue
+            try:
+                reaped = _reap_expired_running(conn)
+                conn.commit()
+                # 一批回收滿了代表還有剩：分批 commit 直到清完，每批之間讓出寫鎖
+                while reaped >= _CLEANUP_BATCH_ROWS:
+                    reaped = _reap_expired_running_batch(conn)
+                    conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"[DB ERROR] 過期 lease 回收失敗: {e}", file=_sys.stderr, flush=True)
 
-        cur = conn.execute(
-            """
-            UPDATE mining_tasks
-            SET status='running',
-                lease_id=?,
-                lease_worker_id=?,
-                lease_expires_at=?,
-                last_heartbeat=?,
-                updated_at=?,
-                attempt=COALESCE(attempt,0)+1
-            WHERE id=? AND status IN ('assigned','queued')
-            """,
-            (lease_id, wid, exp, now, now, tid),
+
+def _ensure_lease_reaper() -> bool:
+    if not _lease_reaper_enabled():
+        return False
+    with _LEASE_REAPER["lock"]:
+        _LEASE_REAPER["scope"] = _db_cache_scope()
+        t = _LEASE_REAPER.get("thread")
+        if t is None or not t.is_alive():
+            t = threading.Thread(target=_lease_reaper_loop, name="sheep-db-lease-reaper", daemon=True)
+            t.start()
+            _LEASE_REAPER["thread"] = t
+    return True
+
+# 派工以單一 UPDATE ... RETURNING * 挑選並上鎖，Postgres 端以 SKIP LOCKED 避開併發派工
+_SQL_CLAIM_ACTIVE_CYCLE = "(SELECT id FROM mining_cycles WHERE status = 'active' ORDER BY id DESC LIMIT 1)"
+_SQL_CLAIM_TASKS_PICK = """
+    WITH picked AS (
+        SELECT t.id
+        FROM mining_tasks t
+        JOIN users u ON u.id = t.user_id
+        JOIN factor_pools p ON p.id = t.pool_id
+        WHERE t.status IN ('assigned','queued')
+          AND COALESCE(u.disabled,0)=0
+          AND COALESCE(u.run_enabled,1)=1
+          AND COALESCE(p.active,1)=1
+"""
+_SQL_CLAIM_TASKS_UPDATE = """
+        ORDER BY t.id ASC
+        {lock}
+        LIMIT ?
+    ),
+    numbered AS (
+        SELECT id, ROW_NUMBER() OVER (ORDER BY id) AS rn FROM picked
+    ),
+    lease_map(rn, lease_id) AS (
+        VALUES {lease_rows}
+    )
+    UPDATE mining_tasks
+    SET status='running',
+        lease_id=(SELECT l.lease_id FROM numbered n JOIN lease_map l ON l.rn = n.rn WHERE n.id = mining_tasks.id),
+        lease_worker_id=?,
+        lease_expires_at=?,
+        last_heartbeat=?,
+        updated_at=?,
+        attempt=COALESCE(attempt,0)+1
+    WHERE status IN ('assigned','queued')
+      AND id IN (SELECT id FROM picked)
+    RETURNING *
+"""
+_SQL_CLAIM_WHERE = {
+    # 沒有 active cycle 時不限 cycle
+    "any": f"          AND (COALESCE({_SQL_CLAIM_ACTIVE_CYCLE}, 0) <= 0 OR t.cycle_id = {_SQL_CLAIM_ACTIVE_CYCLE})\n",
+    # [專家級優化] 同樣注入 cycle_id，利用複合索引秒殺查詢
+    "user": f"          AND t.user_id=?\n          AND t.cycle_id = {_SQL_CLAIM_ACTIVE_CYCLE}\n",
+}
+_SQL_CLAIM_LOCK = {"sqlite": "", "postgres": "FOR UPDATE OF t SKIP LOCKED"}
+_CLAIM_SQL_CACHE_MAX = 256
+_CLAIM_SQL_CACHE: Dict[Tuple[str, str, int], str] = {}
+
+
+def _claim_sql(kind: str, scope: str, n: int) -> str:
+    """依 (backend, scope, n) 取派工 SQL；組好的字串快取起來，熱路徑不再每次 format/串接 400+ 字元的 SQL。"""
+    key = (kind, scope, n)
+    sql = _CLAIM_SQL_CACHE.get(key)
+    if sql is None:
+        sql = _SQL_CLAIM_TASKS_PICK + _SQL_CLAIM_WHERE[scope] + _SQL_CLAIM_TASKS_UPDATE.format(
+            lock=_SQL_CLAIM_LOCK.get(kind, ""),
+            lease_rows=", ".join("(?, ?)" for _ in range(n)),
         )
-        if int(cur.rowcount or 0) <= 0:
-            conn.commit()
-            return None
+        if len(_CLAIM_SQL_CACHE) >= _CLAIM_SQL_CACHE_MAX:
+            _CLAIM_SQL_CACHE.clear()
+        _CLAIM_SQL_CACHE[key] = sql
+    return sql
 
-        conn.commit()
 
+# 最常見的單筆領取在 import 時就先組好兩種 backend 的版本
+for _kind in _SQL_CLAIM_LOCK:
+    for _scope in _SQL_CLAIM_WHERE:
+        _claim_sql(_kind, _scope, 1)
+
+_SQL_CLAIM_POOL_FIELDS = "SELECT id AS pool_id, family, symbol, timeframe_min, years, grid_spec_json, risk_spec_json, seed, name AS pool_name FROM factor_pools WHERE id IN "
+_CLAIM_POOL_EMPTY = {
+    "family": None, "symbol": None, "timeframe_min": None, "years": None,
+    "grid_spec_json": None, "risk_spec_json": None, "seed": None, "pool_name": None,
+}
+
+
+def _claim_tasks_returning(conn: _DBConn, scope: str, where_params: Tuple[Any, ...], wid: str, n: int) -> List[dict]:
+    n = max(1, int(n or 1))
+    now = _utc_now_iso()
+    exp = _iso_add_seconds(_lease_seconds_default())
+    leases = [(i + 1, _uuid.uuid4().hex) for i in range(n)]
+
+    sql = _claim_sql(str(getattr(conn, "kind", "sqlite") or "sqlite"), scope, n)
+    params = tuple(where_params) + (n,) + tuple(v for pair in leases for v in pair) + (wid, exp, now, now)
+    tasks = sorted((dict(r) for r in conn.execute(sql, params).fetchall()), key=lambda t: int(t.get("id") or 0))
+    if not tasks:
+        # 空佇列時沒改到任何列，rollback 即可
+        conn.rollback()
+        return []
+    # 回傳欄位比照 get_task：補上 Pool 的參數欄位（主鍵查詢，同一交易內完成）
+    pool_ids = sorted({int(t.get("pool_id") or 0) for t in tasks})
+    pool_rows = conn.execute(
+        _SQL_CLAIM_POOL_FIELDS + "(" + ", ".join("?" for _ in pool_ids) + ")",
+        tuple(pool_ids),
+    ).fetchall()
+    conn.commit()
+    pools = {int(d.pop("pool_id") or 0): d for d in (dict(r) for r in pool_rows)}
+    for t in tasks:
+        t.update(pools.get(int(t.get("pool_id") or 0)) or _CLAIM_POOL_EMPTY)
+        t["lease_id"] = str(t.get("lease_id") or "")
+        t["lease_worker_id"] = str(wid)
+        t["lease_expires_at"] = str(exp)
+    return tasks
+
+
+def claim_next_tasks_any(worker_id: str, n: int) -> List[dict]:
+    # compute token 專用：跨用戶一次領取最多 n 筆（只派給 run_enabled=1），依 task id 排序回傳
+    wid = str(worker_id or "").strip()
+    if not wid or int(n or 0) <= 0:
+        return []
+
+    reaper_running = _ensure_lease_reaper()
+    conn = _conn()
+    try:
+        if not reaper_running and _reap_expired_running(conn) > 0:
+            # 回收到的過期 lease 先落地，後面領不到任務時才能放心 rollback
+            conn.commit()
+        return _claim_tasks_returning(conn, "any", (), wid, int(n))
     finally:
         conn.close()
 
-    t = get_task(int(tid))
-    if not t:
-        return None
-    t["lease_id"] = str(lease_id)
-    t["lease_worker_id"] = str(wid)
-    t["lease_expires_at"] = str(exp)
-    return t
+
+def claim_next_task_any(worker_id: str) -> Optional[dict]:
+    # compute token 專用：跨用戶派工（只派給 run_enabled=1）
+    tasks = claim_next_tasks_any(worker_id, 1)
+    return tasks[0] if tasks else None
 
 def claim_next_task(user_id: int, worker_id: str) -> Optional[dict]:
     # 原本 worker token：只領自己的任務（保留）
@@ -6604,99 +8449,63 @@ def claim_next_task(user_id: int, worker_id: str) -> Optional[dict]:
     if uid <= 0 or not wid:
         return None
 
-    lease_s = _lease_seconds_default()
-    lease_id = _uuid.uuid4().hex
-    now = _utc_now_iso()
-    exp = _iso_add_seconds(lease_s)
-
+    reaper_running = _ensure_lease_reaper()
     conn = _conn()
     try:
-        _reap_expired_running(conn)
+        if not reaper_running and _reap_expired_running(conn) > 0:
+            # 回收到的過期 lease 先落地，後面領不到任務時才能放心 rollback
+            conn.commit()
+        tasks = _claim_tasks_returning(conn, "user", (uid,), wid, 1)
+        return tasks[0] if tasks else None
+    finally:
+        conn.close()
 
-        # [專家級優化] 同樣注入 cycle_id，利用複合索引秒殺查詢
-        c_row = conn.execute("SELECT id FROM mining_cycles WHERE status = 'active' ORDER BY id DESC LIMIT 1").fetchone()
-        c_id = int(c_row["id"]) if c_row else 0
+# Lease 心跳 / 釋放是 worker 最高頻的寫入，SQL 固定成模組常數
+_SQL_LEASE_PROGRESS_SET = (
+    "UPDATE mining_tasks SET progress_json=?, progress_combos_done=?, progress_combos_total=?, progress_elapsed_s=?, "
+    "updated_at=?, last_heartbeat=?, lease_expires_at=? "
+)
+_SQL_LEASE_RELEASE_SET = (
+    "UPDATE mining_tasks SET status='assigned', progress_json=?, progress_combos_done=?, progress_combos_total=?, progress_elapsed_s=?, "
+    "updated_at=?, lease_id=NULL, lease_worker_id=NULL, lease_expires_at=NULL "
+)
+_SQL_LEASE_WHERE_ANY = "WHERE id=? AND status='running' AND lease_id=? AND lease_worker_id=?"
+_SQL_LEASE_WHERE_OWN = "WHERE id=? AND user_id=? AND status='running' AND lease_id=? AND lease_worker_id=?"
+_SQL_LEASE_PROGRESS_ANY = _SQL_LEASE_PROGRESS_SET + _SQL_LEASE_WHERE_ANY
+_SQL_LEASE_PROGRESS_OWN = _SQL_LEASE_PROGRESS_SET + _SQL_LEASE_WHERE_OWN
+_SQL_LEASE_RELEASE_ANY = _SQL_LEASE_RELEASE_SET + _SQL_LEASE_WHERE_ANY
+_SQL_LEASE_RELEASE_OWN = _SQL_LEASE_RELEASE_SET + _SQL_LEASE_WHERE_OWN
+# 進度內容與上一次寫入完全相同時只續租，不重寫 progress_json 這個大欄位
+_SQL_LEASE_TOUCH_SET = "UPDATE mining_tasks SET updated_at=?, last_heartbeat=?, lease_expires_at=? "
+_SQL_LEASE_TOUCH_ANY = _SQL_LEASE_TOUCH_SET + _SQL_LEASE_WHERE_ANY
+_SQL_LEASE_TOUCH_OWN = _SQL_LEASE_TOUCH_SET + _SQL_LEASE_WHERE_OWN
+
+# 記住每個任務在目前 lease 下最後落地的 progress_json，內容沒變就跳過改寫
+_LEASE_PROGRESS_LAST: Dict[str, Any] = {
+    "lock": threading.Lock(),
+    "max_entries": 10000,
+    "values": {},
+}
 
-        if getattr(conn, "kind", "sqlite") == "postgres":
-            row = conn.execute(
-                """
-                SELECT t.id
-                FROM mining_tasks t
-                JOIN users u ON u.id = t.user_id
-                JOIN factor_pools p ON p.id = t.pool_id
-                WHERE t.user_id=?
-                AND t.cycle_id=?
-                AND t.status IN ('assigned','queued')
-                AND COALESCE(u.disabled,0)=0
-                AND COALESCE(u.run_enabled,1)=1
-                AND COALESCE(p.active,1)=1
-                ORDER BY t.id ASC
-                FOR UPDATE OF t SKIP LOCKED
-                LIMIT 1
-                """,
-                (uid, c_id),
-            ).fetchone()
-        else:
-            row = conn.execute(
-                """
-                SELECT t.id
-                FROM mining_tasks t
-                JOIN users u ON u.id = t.user_id
-                JOIN factor_pools p ON p.id = t.pool_id
-                WHERE t.user_id=?
-                AND t.cycle_id=?
-                AND t.status IN ('assigned','queued')
-                AND COALESCE(u.disabled,0)=0
-                AND COALESCE(u.run_enabled,1)=1
-                AND COALESCE(p.active,1)=1
-                ORDER BY t.id ASC
-                LIMIT 1
-                """,
-                (uid, c_id),
-            ).fetchone()
 
-        if not row:
-            conn.commit()
-            return None
+def _lease_progress_unchanged(tid: int, lid: str, progress_json: str) -> bool:
+    with _LEASE_PROGRESS_LAST["lock"]:
+        last = _LEASE_PROGRESS_LAST["values"].get(int(tid))
+    return bool(last) and last[0] == lid and last[1] == progress_json
 
-        try:
-            tid = int((dict(row) if row else {}).get("id") or 0)
-        except Exception:
-            tid = int(row["id"] or 0) if row else 0
-        if tid <= 0:
-            conn.commit()
-            return None
 
-        cur = conn.execute(
-            """
-            UPDATE mining_tasks
-            SET status='running',
-                lease_id=?,
-                lease_worker_id=?,
-                lease_expires_at=?,
-                last_heartbeat=?,
-                updated_at=?,
-                attempt=COALESCE(attempt,0)+1
-            WHERE id=? AND user_id=? AND status IN ('assigned','queued')
-            """,
-            (lease_id, wid, exp, now, now, tid, uid),
-        )
-        if int(cur.rowcount or 0) <= 0:
-            conn.commit()
-            return None
+def _lease_progress_remember(tid: int, lid: str, progress_json: str) -> None:
+    with _LEASE_PROGRESS_LAST["lock"]:
+        values = _LEASE_PROGRESS_LAST["values"]
+        if len(values) >= int(_LEASE_PROGRESS_LAST["max_entries"]) and int(tid) not in values:
+            values.clear()
+        values[int(tid)] = (lid, progress_json)
 
-        conn.commit()
 
-    finally:
-        conn.close()
+def _lease_progress_forget(tid: int) -> None:
+    with _LEASE_PROGRESS_LAST["lock"]:
+        _LEASE_PROGRESS_LAST["values"].pop(int(tid), None)
 
-    t = get_task(int(tid))
-    if not t:
-        return None
-    t["lease_id"] = str(lease_id)
-    t["lease_worker_id"] = str(wid)
-    t["lease_expires_at"] = str(exp)
-    return t
 
 def update_task_progress_with_lease(task_id: int, user_id: int, worker_id: str, lease_id: str, progress: dict, allow_cross_user: bool = False) -> bool:
     tid = int(task_id or 0)
@@ -6704,26 +8513,43 @@ def update_task_progress_with_lease(task_id: int, user_id: int, worker_id: str,
     lid = str(lease_id or "").strip()
     if tid <= 0 or not wid or not lid:
         return False
+    uid = int(user_id or 0)
+
+    # 先把合併中的舊進度落地，避免稍後的背景 flush 蓋掉這次 lease 寫入
+    try:
+        flush_task_progress(tid)
+    except Exception:
+        pass
 
     now = _utc_now_iso()
     new_exp = _iso_add_seconds(_lease_extend_seconds())
-    summary = _task_progress_summary(progress)
+    progress_json = _fast_json_dumps(progress or {})
 
     conn = _conn()
     try:
+        if _lease_progress_unchanged(tid, lid, progress_json):
+            if bool(allow_cross_user):
+                cur = conn.execute(_SQL_LEASE_TOUCH_ANY, (now, now, new_exp, tid, lid, wid))
+            else:
+                cur = conn.execute(
+                    _SQL_LEASE_TOUCH_OWN, (now, now, new_exp, tid, uid, lid, wid)
+                )
+            ok = int(cur.rowcount or 0) > 0
+            conn.commit()
+            if not ok:
+                _lease_progress_forget(tid)
+            return bool(ok)
+
+        summary = _task_progress_summary(progress)
         old_done = _read_task_done_counter(conn, tid)
         if bool(allow_cross_user):
             cur = conn.execute(
-                """
-                UPDATE mining_tasks
-                SET progress_json=?, progress_combos_done=?, progress_combos_total=?, progress_elapsed_s=?, updated_at=?, last_heartbeat=?, lease_expires_at=?
-                WHERE id=? AND status='running' AND lease_id=? AND lease_worker_id=?
-                """,
+                _SQL_LEASE_PROGRESS_ANY,
                 (
-                    json.dumps(progress or {}, ensure_ascii=False),
-                    int(summary["combos_done"]),
-                    int(summary["combos_total"]),
-                    float(summary["elapsed_s"]),
+                    progress_json,
+                    summary["combos_done"],
+                    summary["combos_total"],
+                    summary["elapsed_s"],
                     now,
                     now,
                     new_exp,
@@ -6734,21 +8560,17 @@ def update_task_progress_with_lease(task_id: int, user_id: int, worker_id: str,
             )
         else:
             cur = conn.execute(
-                """
-                UPDATE mining_tasks
-                SET progress_json=?, progress_combos_done=?, progress_combos_total=?, progress_elapsed_s=?, updated_at=?, last_heartbeat=?, lease_expires_at=?
-                WHERE id=? AND user_id=? AND status='running' AND lease_id=? AND lease_worker_id=?
-                """,
+                _SQL_LEASE_PROGRESS_OWN,
                 (
-                    json.dumps(progress or {}, ensure_ascii=False),
-                    int(summary["combos_done"]),
-                    int(summary["combos_total"]),
-                    float(summary["elapsed_s"]),
+                    progress_json,
+                    summary["combos_done"],
+                    summary["combos_total"],
+                    summary["elapsed_s"],
                     now,
                     now,
                     new_exp,
                     tid,
-                    int(user_id or 0),
+                    uid,
                     lid,
                     wid,
                 ),
@@ -6758,9 +8580,13 @@ def update_task_progress_with_lease(task_id: int, user_id: int, worker_id: str,
             _refresh_task_done_counter_delta(conn, tid, summary["combos_done"], old_done=old_done)
         conn.commit()
         if ok:
+            _lease_progress_remember(tid, lid, progress_json)
             invalidate_global_dashboard_counters()
+        else:
+            _lease_progress_forget(tid)
         return bool(ok)
     except Exception:
+        _lease_progress_forget(tid)
         return False
     finally:
         conn.close()
@@ -6772,21 +8598,24 @@ def release_task_with_lease(task_id: int, user_id: int, worker_id: str, lease_id
     if tid <= 0 or not wid or not lid:
         return False
 
+    # 先把合併中的舊進度落地，避免稍後的背景 flush 蓋掉這次 lease 寫入
+    try:
+        flush_task_progress(tid)
+    except Exception:
+        pass
+
     now = _utc_now_iso()
     summary = _task_progress_summary(progress)
+    _lease_progress_forget(tid)
 
     conn = _conn()
     try:
         old_done = _read_task_done_counter(conn, tid)
         if bool(allow_cross_user):
             cur = conn.execute(
-                """
-                UPDATE mining_tasks
-                SET status='assigned', progress_json=?, progress_combos_done=?, progress_combos_total=?, progress_elapsed_s=?, updated_at=?, lease_id=NULL, lease_worker_id=NULL, lease_expires_at=NULL
-                WHERE id=? AND status='running' AND lease_id=? AND lease_worker_id=?
-                """,
+                _SQL_LEASE_RELEASE_ANY,
                 (
-                    json.dumps(progress or {}, ensure_ascii=False),
+                    _fast_json_dumps(progress or {}),
                     int(summary["combos_done"]),
                     int(summary["combos_total"]),
                     float(summary["elapsed_s"]),
@@ -6798,13 +8627,9 @@ def release_task_with_lease(task_id: int, user_id: int, worker_id: str, lease_id
             )
         else:
             cur = conn.execute(
-                """
-                UPDATE mining_tasks
-                SET status='assigned', progress_json=?, progress_combos_done=?, progress_combos_total=?, progress_elapsed_s=?, updated_at=?, lease_id=NULL, lease_worker_id=NULL, lease_expires_at=NULL
-                WHERE id=? AND user_id=? AND status='running' AND lease_id=? AND lease_worker_id=?
-                """,
+                _SQL_LEASE_RELEASE_OWN,
                 (
-                    json.dumps(progress or {}, ensure_ascii=False),
+                    _fast_json_dumps(progress or {}),
                     int(summary["combos_done"]),
                     int(summary["combos_total"]),
                     float(summary["elapsed_s"]),
@@ -6834,8 +8659,15 @@ def finish_task_with_lease(task_id: int, user_id: int, worker_id: str, lease_id:
     if tid <= 0 or not wid or not lid:
         return None
 
+    # 先把合併中的舊進度落地，避免稍後的背景 flush 蓋掉這次 lease 寫入
+    try:
+        flush_task_progress(tid)
+    except Exception:
+        pass
+
     now = _utc_now_iso()
     summary = _task_progress_summary(final_progress)
+    _lease_progress_forget(tid)
 
     conn = _conn()
     try:
@@ -6851,7 +8683,8 @@ def finish_task_with_lease(task_id: int, user_id: int, worker_id: str, lease_id:
             ).fetchone()
 
         if not trow:
-            conn.commit()
+            # 純讀取、沒有寫入：rollback 釋放交易即可
+            conn.rollback()
             return None
         trow = dict(trow or {})
 
@@ -6867,7 +8700,7 @@ def finish_task_with_lease(task_id: int, user_id: int, worker_id: str, lease_id:
             WHERE id=? AND status='running' AND lease_id=? AND lease_worker_id=?
             """,
             (
-                json.dumps(final_progress or {}, ensure_ascii=False),
+                _fast_json_dumps(final_progress or {}),
                 int(summary["combos_done"]),
                 int(summary["combos_total"]),
                 float(summary["elapsed_s"]),
@@ -6879,11 +8712,13 @@ def finish_task_with_lease(task_id: int, user_id: int, worker_id: str, lease_id:
             ),
         )
         if int(cur.rowcount or 0) <= 0:
-            conn.commit()
+            conn.rollback()
             return None
         _refresh_task_done_counter_delta(conn, tid, summary["combos_done"], old_done=old_done)
 
-        best_candidate_id = None
+        # 候選、Submission、Strategy 以多列 INSERT ... RETURNING 分批寫入，與任務狀態同一個交易
+        cand_values: List[Tuple[Any, ...]] = []
+        cand_meta: List[Tuple[str, str, float]] = []
         for c in list(candidates or []):
             if not isinstance(c, dict):
                 continue
@@ -6891,55 +8726,42 @@ def finish_task_with_lease(task_id: int, user_id: int, worker_id: str, lease_id:
             pr = c.get("params") or c.get("params_json") or {}
             me = c.get("metrics") or {}
             direction = _infer_direction(params_json=pr)
-            normalized_params = _normalize_strategy_params_payload(params_json=pr, direction=direction)
-            
-            if getattr(conn, "kind", "sqlite") == "postgres":
-                row = conn.execute(
-                    "INSERT INTO candidates (task_id, user_id, pool_id, direction, params_json, metrics_json, score, created_at, is_submitted) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1) RETURNING id",
-                    (tid, owner_id, pool_id, direction, json.dumps(normalized_params, ensure_ascii=False), json.dumps(me, ensure_ascii=False), sc, now),
-                )
-                rid = (row.fetchone() or {}).get("id")
-                cid = int(rid or 0) if rid else None
-            else:
-                row = conn.execute(
-                    "INSERT INTO candidates (task_id, user_id, pool_id, direction, params_json, metrics_json, score, created_at, is_submitted) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)",
-                    (tid, owner_id, pool_id, direction, json.dumps(normalized_params, ensure_ascii=False), json.dumps(me, ensure_ascii=False), sc, now),
-                )
-                cid = int(getattr(row, "lastrowid", 0) or 0)
+            params_json = json.dumps(_normalize_strategy_params_payload(params_json=pr, direction=direction), ensure_ascii=False)
+            cand_values.append((tid, owner_id, pool_id, direction, params_json, json.dumps(me, ensure_ascii=False), sc, now, 1))
+            cand_meta.append((direction, params_json, sc))
 
-            if cid:
-                if best_candidate_id is None:
-                    best_candidate_id = cid
-                
-                # 全自動佈署：建立 Submission 與 Strategy 上線
-                try:
-                    if getattr(conn, "kind", "sqlite") == "postgres":
-                        row_sub = conn.execute(
-                            "INSERT INTO submissions (candidate_id, user_id, pool_id, status, audit_json, submitted_at) VALUES (?, ?, ?, 'approved', '{}', ?) RETURNING id", 
-                            (cid, owner_id, pool_id, now)
-                        ).fetchone()
-                        sub_id = int((row_sub or {}).get("id") or 0)
-                        if sub_id > 0:
-                            conn.execute(
-                                "INSERT INTO strategies (submission_id, user_id, pool_id, direction, params_json, status, allocation_pct, note, created_at, expires_at, external_key) VALUES (?, ?, ?, ?, ?, 'active', 1.0, 'Auto-Deploy', ?, ?, ?)", 
-                                (sub_id, owner_id, pool_id, direction, json.dumps(normalized_params, ensure_ascii=False), now, "2099-12-31T23:59:59Z", "")
-                            )
-                    else:
-                        cur_sub = conn.execute(
-                            "INSERT INTO submissions (candidate_id, user_id, pool_id, status, audit_json, submitted_at) VALUES (?, ?, ?, 'approved', '{}', ?)", 
-                            (cid, owner_id, pool_id, now)
-                        )
-                        sub_id = int(cur_sub.lastrowid)
-                        if sub_id > 0:
-                            conn.execute(
-                                "INSERT INTO strategies (submission_id, user_id, pool_id, direction, params_json, status, allocation_pct, note, created_at, expires_at, external_key) VALUES (?, ?, ?, ?, ?, 'active', 1.0, 'Auto-Deploy', ?, ?, ?)", 
-                                (sub_id, owner_id, pool_id, direction, json.dumps(normalized_params, ensure_ascii=False), now, "2099-12-31T23:59:59Z", "")
-                            )
-                    log_sys_event("AUTO_DEPLOY_SUCCESS", owner_id, f"任務 {tid} 達標，已自動佈署策略上因子池", {"candidate_id": cid, "score": sc})
-                except Exception as auto_deploy_err:
-                    log_sys_event("AUTO_DEPLOY_FAIL", owner_id, f"任務 {tid} 自動佈署失敗: {auto_deploy_err}", {"candidate_id": cid})
+        cids = [int(r[0]) for r in _insert_rows_returning(conn, _SQL_INSERT_CANDIDATES_HEAD, _SQL_INSERT_CANDIDATE_ROW, cand_values, "id")]
+        best_candidate_id = cids[0] if cids else None
+
+        # 全自動佈署：建立 Submission 與 Strategy 上線
+        deploy_events: List[Tuple[str, str, dict]] = []
+        deployed = [(cid, meta) for cid, meta in zip(cids, cand_meta) if cid]
+        if deployed:
+            try:
+                sub_rows = _insert_rows_returning(
+                    conn,
+                    _SQL_INSERT_AUTO_SUBMISSIONS_HEAD,
+                    _SQL_INSERT_AUTO_SUBMISSION_ROW,
+                    [(cid, owner_id, pool_id, now) for cid, _ in deployed],
+                    "id, candidate_id",
+                )
+                sub_by_cid = {int(cand_id): int(sub_id) for sub_id, cand_id in sub_rows if sub_id > 0}
+                strat_values = [
+                    (sub_by_cid[cid], owner_id, pool_id, direction, params_json, now, "2099-12-31T23:59:59Z")
+                    for cid, (direction, params_json, _) in deployed
+                    if cid in sub_by_cid
+                ]
+                _insert_rows_returning(conn, _SQL_INSERT_AUTO_STRATEGIES_HEAD, _SQL_INSERT_AUTO_STRATEGY_ROW, strat_values, "id")
+                for cid, (_, _, sc) in deployed:
+                    deploy_events.append(("AUTO_DEPLOY_SUCCESS", f"任務 {tid} 達標，已自動佈署策略上因子池", {"candidate_id": cid, "score": sc}))
+            except Exception as auto_deploy_err:
+                for cid, _ in deployed:
+                    deploy_events.append(("AUTO_DEPLOY_FAIL", f"任務 {tid} 自動佈署失敗: {auto_deploy_err}", {"candidate_id": cid}))
 
         conn.commit()
+        # 事件寫入走獨立連線，等交易 commit 釋放寫鎖後再送出
+        for event_type, message, detail in deploy_events:
+            log_sys_event(event_type, owner_id, message, detail)
         invalidate_global_dashboard_counters(force=True)
         return best_candidate_id
     except Exception:
@@ -6974,12 +8796,12 @@ def get_all_candidates_detailed(limit: int = 1000) -> list:
         out = []
         for r in rows:
             d = dict(r)
-            try: d["params"] = json.loads(d.get("params_json") or "{}")
+            try: d["params"] = _fast_json_loads(d.get("params_json") or "{}")
             except Exception: d["params"] = {}
-            try: d["metrics"] = json.loads(d.get("metrics_json") or "{}")
+            try: d["metrics"] = _fast_json_loads(d.get("metrics_json") or "{}")
             except Exception: d["metrics"] = {}
             try:
-                tprog = json.loads(d.get("task_progress") or "{}")
+                tprog = _fast_json_loads(d.get("task_progress") or "{}")
                 # 強制顯示已上因子池，因未達標的不會被記錄在 candidates 中
                 d["oos_status"] = "已上因子池"
                 d["oos_metrics"] = tprog.get("oos_metrics", {})
@@ -7057,9 +8879,9 @@ def get_admin_active_strategies() -> list:
         out = []
         for r in rows:
             d = _normalize_strategy_row(r)
-            try: d["metrics"] = json.loads(d.get("metrics_json") or "{}")
+            try: d["metrics"] = _fast_json_loads(d.get("metrics_json") or "{}")
             except Exception: d["metrics"] = {}
-            try: d["progress"] = json.loads(d.get("progress_json") or "{}")
+            try: d["progress"] = _fast_json_loads(d.get("progress_json") or "{}")
             except Exception: d["progress"] = {}
             out.append(d)
         return out
@@ -7174,11 +8996,11 @@ def get_admin_active_strategies_page(
                 item.update(extra)
             item = _normalize_strategy_row(item)
             try:
-                item["metrics"] = json.loads(item.get("metrics_json") or "{}")
+                item["metrics"] = _fast_json_loads(item.get("metrics_json") or "{}")
             except Exception:
                 item["metrics"] = {}
             try:
-                item["progress"] = json.loads(item.get("progress_json") or "{}")
+                item["progress"] = _fast_json_loads(item.get("progress_json") or "{}")
             except Exception:
                 item["progress"] = {}
             items.append(item)
@@ -7290,7 +9112,7 @@ def list_active_strategy_runtime_rows(limit: int = 20000, runtime_items: Optiona
         for row in rows:
             item = _normalize_strategy_row(row)
             try:
-                item["metrics"] = json.loads(item.get("metrics_json") or "{}")
+                item["metrics"] = _fast_json_loads(item.get("metrics_json") or "{}")
             except Exception:
                 item["metrics"] = {}
             if not str(item.get("external_key") or "").strip():
@@ -7328,6 +9150,8 @@ def list_actionable_error_rows(limit: int = 2000) -> list:
         "RUNTIME_SYNC_FAIL",
     }
     max_rows = max(1, min(10000, int(limit or 2000)))
+    # 事件走 write-behind，讀取前先把佇列落地，剛寫的錯誤也能立即出現在匯出內容
+    flush_write_behind()
     conn = _conn()
     try:
         report_rows: List[Dict[str, Any]] = []
@@ -1025,8 +1025,9 @@ class JobManager:
                 "candidates": []
             }
 
-            for sc, full_params, metrics in best_pass:
-                cid = db.insert_candidate(task_id, user_id, pool_id, full_params, metrics, float(sc))
+            # 整批候選一次寫入（單一交易），id 與 best_pass 順序一致
+            cids = db.insert_candidates(task_id, user_id, pool_id, [(full_params, metrics, float(sc)) for sc, full_params, metrics in best_pass])
+            for cid, (sc, full_params, metrics) in zip(cids, best_pass):
                 if best_candidate_id is None:
                     best_candidate_id = int(cid)
                 disk_data["candidates"].append({"id": cid, "score": sc, "params": full_params, "metrics": metrics})
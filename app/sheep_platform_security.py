@@ -4,6 +4,7 @@ import json
 import hmac
 import base64
 import secrets
+import functools
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Optional, Tuple
@@ -150,6 +151,7 @@ def verify_password(password, pw_hash) -> bool:
 USERNAME_RE = re.compile(r"^[^\r\n]{1,64}$")
 
 
+@functools.lru_cache(maxsize=4096)
 def normalize_username(username: str) -> str:
     return str(username or "").strip()
 
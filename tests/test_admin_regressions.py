@@ -333,6 +333,157 @@ def test_api_import_is_side_effect_free(tmp_path, monkeypatch):
     _reset_app_modules()
 
 
+def test_user_cache_does_not_leak_across_db_paths(tmp_path, monkeypatch):
+    monkeypatch.setenv("SHEEP_DB_URL", "")
+    monkeypatch.setenv("SHEEP_DB_PATH", str(tmp_path / "first.sqlite3"))
+    monkeypatch.setenv("SHEEP_COMPUTE_USER", "cache-admin")
+    monkeypatch.setenv("SHEEP_COMPUTE_PASS", "cache-password")
+    _reset_app_modules()
+    db_module = importlib.import_module("sheep_platform_db")
+    bootstrap_module = importlib.reload(importlib.import_module("sheep_platform_bootstrap"))
+    try:
+        db_module.init_db()
+        bootstrap_module._provision_compute_admin()
+        first = db_module.get_user_by_username("cache-admin")
+        assert first is not None
+        assert db_module.get_user_by_id(int(first["id"])) is not None
+
+        # Same module, new database: the cached row from first.sqlite3 must not be served.
+        monkeypatch.setenv("SHEEP_DB_PATH", str(tmp_path / "second.sqlite3"))
+        db_module.init_db()
+        assert db_module.get_user_by_username("cache-admin") is None
+        assert db_module.get_user_by_username("cache-admin", use_cache=False) is None
+
+        bootstrap_module._provision_compute_admin()
+        second = db_module.get_user_by_username("cache-admin")
+        assert second is not None
+        assert second["role"] == "admin"
+    finally:
+        _reset_app_modules()
+
+
+def test_settings_cache_does_not_leak_across_db_paths(tmp_path, monkeypatch):
+    monkeypatch.setenv("SHEEP_DB_URL", "")
+    monkeypatch.setenv("SHEEP_SETTINGS_CACHE", "1")
+    _reset_app_modules()
+    db_module = importlib.import_module("sheep_platform_db")
+    try:
+        for name, value in (("first", "one"), ("second", "two")):
+            monkeypatch.setenv("SHEEP_DB_PATH", str(tmp_path / f"{name}.sqlite3"))
+            db_module.init_db()
+            conn = db_module._conn()
+            try:
+                conn.execute(
+                    "INSERT INTO settings (key, value, updated_at) VALUES (?, ?, ?)",
+                    ("cache_scope_probe", json.dumps(value), db_module._now_iso()),
+                )
+                conn.commit()
+            finally:
+                conn.close()
+
+        monkeypatch.setenv("SHEEP_DB_PATH", str(tmp_path / "first.sqlite3"))
+        assert db_module.get_setting("cache_scope_probe") == "one"
+
+        # Same module, other database: the cached value from first.sqlite3 must not be served.
+        monkeypatch.setenv("SHEEP_DB_PATH", str(tmp_path / "second.sqlite3"))
+        assert db_module.get_setting("cache_scope_probe") == "two"
+    finally:
+        _reset_app_modules()
+
+
+def test_active_cycle_cache_does_not_leak_across_db_paths(tmp_path, monkeypatch):
+    monkeypatch.setenv("SHEEP_DB_URL", "")
+    _reset_app_modules()
+    db_module = importlib.import_module("sheep_platform_db")
+    try:
+        for name in ("first", "second"):
+            monkeypatch.setenv("SHEEP_DB_PATH", str(tmp_path / f"{name}.sqlite3"))
+            db_module.init_db()
+            db_module.ensure_cycle_rollover()
+        conn = db_module._conn()
+        try:
+            # second.sqlite3 moves on to a later cycle so the two databases disagree on the active id.
+            conn.execute("UPDATE mining_cycles SET status = 'completed'")
+            conn.execute(
+                "INSERT INTO mining_cycles (name, status, start_ts, end_ts) VALUES ('Cycle 2', 'active', ?, ?)",
+                (db_module._now_iso(), "2999-01-01T00:00:00+00:00"),
+            )
+            conn.commit()
+            second_id = int(conn.execute("SELECT id FROM mining_cycles WHERE status = 'active'").fetchone()[0])
+        finally:
+            conn.close()
+
+        monkeypatch.setenv("SHEEP_DB_PATH", str(tmp_path / "first.sqlite3"))
+        first_id = int(db_module.get_active_cycle()["id"])
+        assert first_id != second_id
+
+        monkeypatch.setenv("SHEEP_DB_PATH", str(tmp_path / "second.sqlite3"))
+        assert int(db_module.get_active_cycle()["id"]) == second_id
+        conn = db_module._conn()
+        try:
+            assert db_module._active_cycle_id(conn) == second_id
+        finally:
+            conn.close()
+    finally:
+        _reset_app_modules()
+
+
+def test_snapshot_pool_cache_does_not_leak_across_db_paths(tmp_path, monkeypatch):
+    monkeypatch.setenv("SHEEP_DB_URL", "")
+    _reset_app_modules()
+    db_module = importlib.import_module("sheep_platform_db")
+    try:
+        cycle_ids = {}
+        for name in ("first", "second"):
+            monkeypatch.setenv("SHEEP_DB_PATH", str(tmp_path / f"{name}.sqlite3"))
+            db_module.init_db()
+            db_module.ensure_cycle_rollover()
+            cycle_ids[name] = int(db_module.get_active_cycle()["id"])
+            db_module.create_factor_pool(
+                cycle_id=cycle_ids[name],
+                name=f"{name} pool",
+                symbol="BTC_USDT",
+                timeframe_min=60,
+                years=2,
+                family="trend",
+                grid_spec={"alpha": [1, 2]},
+                risk_spec={"max_leverage": 2},
+                num_partitions=4,
+                seed=3,
+                active=True,
+            )
+        assert cycle_ids["first"] == cycle_ids["second"]
+
+        monkeypatch.setenv("SHEEP_DB_PATH", str(tmp_path / "first.sqlite3"))
+        assert [p["name"] for p in db_module._snapshot_factor_pools(cycle_ids["first"])] == ["first pool"]
+
+        # Same cycle id in another database: the cached pool list from first.sqlite3 must not be served.
+        monkeypatch.setenv("SHEEP_DB_PATH", str(tmp_path / "second.sqlite3"))
+        assert [p["name"] for p in db_module._snapshot_factor_pools(cycle_ids["second"])] == ["second pool"]
+    finally:
+        _reset_app_modules()
+
+
+def test_default_avatar_cache_does_not_leak_across_db_paths(tmp_path, monkeypatch):
+    monkeypatch.setenv("SHEEP_DB_URL", "")
+    _reset_app_modules()
+    db_module = importlib.import_module("sheep_platform_db")
+    try:
+        for name in ("first", "second"):
+            monkeypatch.setenv("SHEEP_DB_PATH", str(tmp_path / f"{name}.sqlite3"))
+            db_module.init_db()
+            db_module.set_setting("default_avatar_data_url", f"https://example.com/{name}.png")
+
+        monkeypatch.setenv("SHEEP_DB_PATH", str(tmp_path / "first.sqlite3"))
+        assert db_module._default_avatar_url_from_conn() == "https://example.com/first.png"
+
+        # Same module, other database: the cached avatar from first.sqlite3 must not be served.
+        monkeypatch.setenv("SHEEP_DB_PATH", str(tmp_path / "second.sqlite3"))
+        assert db_module._default_avatar_url_from_conn() == "https://example.com/second.png"
+    finally:
+        _reset_app_modules()
+
+
 def test_global_cost_settings_round_trip_snapshot_and_task_claim(admin_client):
     client = admin_client["client"]
     headers = admin_client["headers"]
@@ -2131,3 +2282,639 @@ def test_legacy_submit_oos_is_read_only_and_unknown_routes_return_404(admin_clie
     assert any(f"/tasks/{task_id}/submit_oos" in row["message"] for row in alias_events)
     unknown_route_events = _query_sys_events(db_module, "UNKNOWN_ROUTE")
     assert any("/totally/missing" in row["message"] for row in unknown_route_events)
+
+
+def test_progress_flush_drops_failing_rows_instead_of_blocking_the_queue(admin_client):
+    db_module = admin_client["db"]
+    user_id = admin_client["user_id"]
+    good_task = admin_client["task_id"]
+    bad_task = _insert_task(
+        db_module,
+        user_id=user_id,
+        pool_id=admin_client["pool_id"],
+        cycle_id=admin_client["cycle_id"],
+        status="running",
+        progress={},
+    )
+    conn = db_module._conn()
+    try:
+        conn.execute(
+            f"""
+            CREATE TRIGGER reject_bad_progress BEFORE UPDATE OF progress_json ON mining_tasks
+            WHEN NEW.id = {int(bad_task)}
+            BEGIN SELECT RAISE(ABORT, 'rejected progress'); END
+            """
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    db_module.update_task_progress(bad_task, {"combos_done": 5, "combos_total": 40, "elapsed_s": 1})
+    db_module.update_task_progress(good_task, {"combos_done": 7, "combos_total": 40, "elapsed_s": 1})
+    db_module.worker_heartbeat("worker-poison-1", int(user_id), task_id=bad_task)
+    db_module.flush_task_progress()
+
+    assert not db_module._PROGRESS_COALESCER["progress"]
+    assert not db_module._PROGRESS_COALESCER["heartbeats"]
+    assert int(db_module.get_task(good_task)["progress_combos_done"]) == 7
+    bad_row = db_module.get_task(bad_task)
+    assert int(bad_row["progress_combos_done"] or 0) == 0
+    assert bad_row["last_heartbeat"]
+
+    db_module.update_task_progress(good_task, {"combos_done": 9, "combos_total": 40, "elapsed_s": 2})
+    db_module.flush_task_progress()
+    assert int(db_module.get_task(good_task)["progress_combos_done"]) == 9
+
+
+def test_progress_flush_drops_failing_worker_touch_rows(admin_client):
+    db_module = admin_client["db"]
+    user_id = int(admin_client["user_id"])
+    task_id = int(admin_client["task_id"])
+    for wid in ("worker-touch-good", "worker-touch-bad"):
+        db_module.upsert_worker(wid, user_id, "2.0.0", 2, {"kind": "worker"})
+    db_module.flush_task_progress()
+    conn = db_module._conn()
+    try:
+        conn.execute(
+            """
+            CREATE TRIGGER reject_bad_touch BEFORE UPDATE OF avg_cps ON workers
+            WHEN NEW.worker_id = 'worker-touch-bad'
+            BEGIN SELECT RAISE(ABORT, 'rejected touch'); END
+            """
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    db_module.worker_touch_progress("worker-touch-bad", cps=10.0, task_id=task_id)
+    db_module.worker_touch_progress("worker-touch-good", cps=10.0, task_id=task_id)
+    db_module.flush_task_progress()
+
+    assert not db_module._PROGRESS_COALESCER["worker_touches"]
+    conn = db_module._conn()
+    try:
+        rows = {
+            str(r["worker_id"]): dict(r)
+            for r in conn.execute("SELECT worker_id, last_task_id, avg_cps FROM workers").fetchall()
+        }
+    finally:
+        conn.close()
+    assert int(rows["worker-touch-good"]["last_task_id"]) == task_id
+    assert float(rows["worker-touch-good"]["avg_cps"]) > 0.0
+    assert rows["worker-touch-bad"]["last_task_id"] is None
+
+
+def test_progress_flush_drops_failing_worker_upsert_rows(admin_client):
+    db_module = admin_client["db"]
+    user_id = int(admin_client["user_id"])
+    conn = db_module._conn()
+    try:
+        conn.execute(
+            """
+            CREATE TRIGGER reject_bad_upsert BEFORE INSERT ON workers
+            WHEN NEW.worker_id = 'worker-upsert-bad'
+            BEGIN SELECT RAISE(ABORT, 'rejected upsert'); END
+            """
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    db_module.upsert_worker("worker-upsert-bad", user_id, "2.0.0", 2, {"kind": "worker"})
+    db_module.upsert_worker("worker-upsert-good", user_id, "2.0.0", 2, {"kind": "worker"})
+    db_module.update_task_progress(admin_client["task_id"], {"combos_done": 3, "combos_total": 40, "elapsed_s": 1})
+    db_module.flush_task_progress()
+
+    assert not db_module._PROGRESS_COALESCER["worker_upserts"]
+    assert int(db_module.get_task(admin_client["task_id"])["progress_combos_done"]) == 3
+    conn = db_module._conn()
+    try:
+        worker_ids = {str(r["worker_id"]) for r in conn.execute("SELECT worker_id FROM workers").fetchall()}
+    finally:
+        conn.close()
+    assert "worker-upsert-good" in worker_ids
+    assert "worker-upsert-bad" not in worker_ids
+
+
+def test_write_behind_rows_land_in_the_database_they_were_logged_against(tmp_path, monkeypatch):
+    first = tmp_path / "first-events.sqlite3"
+    second = tmp_path / "second-events.sqlite3"
+    monkeypatch.setenv("SHEEP_DB_URL", "")
+    monkeypatch.setenv("SHEEP_DB_PATH", str(first))
+    _reset_app_modules()
+    db_module = importlib.import_module("sheep_platform_db")
+    try:
+        db_module.init_db()
+        monkeypatch.setenv("SHEEP_DB_PATH", str(second))
+        db_module.init_db()
+
+        monkeypatch.setenv("SHEEP_DB_PATH", str(first))
+        with db_module._WRITE_BEHIND["flush_lock"]:
+            # Hold the writer so the rows are still queued when the path switches.
+            db_module.log_sys_event("SCOPE_CHECK", None, "first-db-event", {})
+            db_module.write_audit_log(None, "scope_check", {"db": "first"})
+            monkeypatch.setenv("SHEEP_DB_PATH", str(second))
+        db_module.flush_write_behind()
+
+        def _count(path, sql):
+            monkeypatch.setenv("SHEEP_DB_PATH", str(path))
+            conn = db_module._conn()
+            try:
+                return int(conn.execute(sql).fetchone()[0])
+            finally:
+                conn.close()
+
+        events_sql = "SELECT COUNT(*) FROM sys_monitor_events WHERE event_type = 'SCOPE_CHECK'"
+        audit_sql = "SELECT COUNT(*) FROM audit_logs WHERE action = 'scope_check'"
+        assert _count(first, events_sql) == 1
+        assert _count(first, audit_sql) == 1
+        assert _count(second, events_sql) == 0
+        assert _count(second, audit_sql) == 0
+    finally:
+        _reset_app_modules()
+
+
+def test_flush_write_behind_sees_rows_the_writer_is_still_batching(admin_client, monkeypatch):
+    import time
+
+    db_module = admin_client["db"]
+    db_module.flush_write_behind()
+    monkeypatch.setitem(db_module._WRITE_BEHIND, "wait_s", 5.0)
+    db_module.write_audit_log(None, "flush_probe", {})
+    # Let the background writer take the row and start waiting for more rows to batch with it.
+    deadline = time.monotonic() + 2.0
+    while not db_module._WRITE_BEHIND["queue"].empty() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert db_module._WRITE_BEHIND["queue"].empty()
+
+    started = time.monotonic()
+    db_module.flush_write_behind()
+    elapsed = time.monotonic() - started
+
+    conn = db_module._conn()
+    try:
+        count = int(conn.execute("SELECT COUNT(*) FROM audit_logs WHERE action = 'flush_probe'").fetchone()[0])
+    finally:
+        conn.close()
+    assert count == 1
+    assert elapsed < 2.0
+
+
+def test_recover_factor_pools_treats_null_columns_as_duplicates(admin_client, tmp_path):
+    import sqlite3
+
+    db_module = admin_client["db"]
+    cycle_id = int(admin_client["cycle_id"])
+    legacy_path = tmp_path / "legacy_sheep.db"
+    legacy = sqlite3.connect(str(legacy_path))
+    try:
+        legacy.execute(
+            """
+            CREATE TABLE factor_pools (
+                id INTEGER PRIMARY KEY, cycle_id INTEGER, name TEXT, symbol TEXT, timeframe_min INTEGER,
+                years INTEGER, family TEXT, grid_spec_json TEXT, risk_spec_json TEXT, num_partitions INTEGER,
+                seed INTEGER, active INTEGER, created_at TEXT
+            )
+            """
+        )
+        legacy.execute(
+            "INSERT INTO factor_pools (cycle_id, name, symbol, timeframe_min, years, family, grid_spec_json, risk_spec_json, num_partitions, seed, active) "
+            "VALUES (1, 'Null Pool', 'ETH_USDT', 60, 2, NULL, '{}', '{}', NULL, NULL, 1)"
+        )
+        legacy.commit()
+    finally:
+        legacy.close()
+
+    conn = db_module._conn()
+    try:
+        conn.execute(
+            "INSERT INTO factor_pools (cycle_id, name, symbol, timeframe_min, years, family, grid_spec_json, risk_spec_json, num_partitions, seed, active, created_at) "
+            "VALUES (?, 'Null Pool', 'ETH_USDT', 60, 2, NULL, '{}', '{}', NULL, NULL, 1, ?)",
+            (cycle_id, db_module._now_iso()),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    report = db_module.recover_factor_pools_from_local(cycle_id, search_roots=[str(legacy_path)])
+
+    assert report["imported"] == 0
+    assert report["skipped_duplicates"] == 1
+    conn = db_module._conn()
+    try:
+        count = conn.execute(
+            "SELECT COUNT(*) FROM factor_pools WHERE cycle_id = ? AND name = 'Null Pool'", (cycle_id,)
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    assert int(count) == 1
+
+
+def test_claim_next_tasks_any_assigns_distinct_leases_and_skips_ineligible_rows(admin_client):
+    db_module = admin_client["db"]
+    cycle_id = int(admin_client["cycle_id"])
+    owner_id = int(admin_client["user_id"])
+    pool_id = int(admin_client["pool_id"])
+    db_module.set_user_run_enabled(owner_id, True)
+
+    paused_id = db_module.create_user("claim-paused", "x", role="user")
+    db_module.set_user_run_enabled(int(paused_id), False)
+    disabled_id = db_module.create_user("claim-disabled", "x", role="user")
+    db_module.set_user_run_enabled(int(disabled_id), True)
+    db_module.set_user_disabled(int(disabled_id), True)
+    inactive_pool_id = db_module.create_factor_pool(
+        cycle_id=cycle_id,
+        name="Inactive Pool",
+        symbol="ETH_USDT",
+        timeframe_min=60,
+        years=2,
+        family="trend",
+        grid_spec={"alpha": [1, 2]},
+        risk_spec={"max_leverage": 2},
+        num_partitions=8,
+        seed=11,
+        active=False,
+    )[0]
+
+    def _task(user_id, task_pool_id):
+        return _insert_task(
+            db_module,
+            user_id=int(user_id),
+            pool_id=int(task_pool_id),
+            cycle_id=cycle_id,
+            status="assigned",
+            progress={},
+        )
+
+    eligible = {int(admin_client["task_id"]), _task(owner_id, pool_id), _task(owner_id, pool_id)}
+    ineligible = {_task(paused_id, pool_id), _task(disabled_id, pool_id), _task(owner_id, inactive_pool_id)}
+
+    claimed = db_module.claim_next_tasks_any("worker-claim-1", 10)
+
+    assert {int(t["id"]) for t in claimed} == eligible
+    lease_ids = [str(t["lease_id"]) for t in claimed]
+    assert all(lease_ids)
+    assert len(set(lease_ids)) == len(claimed)
+    for task in claimed:
+        row = db_module.get_task(int(task["id"]))
+        assert row["status"] == "running"
+        assert row["lease_id"] == task["lease_id"]
+        assert row["lease_worker_id"] == "worker-claim-1"
+    for tid in ineligible:
+        row = db_module.get_task(tid)
+        assert row["status"] == "assigned"
+        assert not row["lease_id"]
+
+    assert db_module.claim_next_tasks_any("worker-claim-2", 10) == []
+
+
+def _sqlite_index_exists(db_module, name: str) -> bool:
+    conn = db_module._conn()
+    try:
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)).fetchone() is not None
+    finally:
+        conn.close()
+
+
+def _init_db_with_statement(db_module, old_stmt: str, new_stmt: str):
+    import types
+
+    def _swap(const):
+        if const == old_stmt:
+            return new_stmt
+        if isinstance(const, tuple):
+            return tuple(_swap(c) for c in const)
+        return const
+
+    original = db_module._init_db_locked
+    code = original.__code__
+    return types.FunctionType(
+        code.replace(co_consts=tuple(_swap(c) for c in code.co_consts)),
+        original.__globals__,
+        original.__name__,
+    )
+
+
+def test_init_db_schema_gate_skips_ddl_until_fingerprint_changes(admin_client, monkeypatch):
+    db_module = admin_client["db"]
+    index_name = "idx_mining_cycles_status_id"
+    conn = db_module._conn()
+    try:
+        conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+        conn.commit()
+    finally:
+        conn.close()
+
+    # Fingerprint unchanged: the DDL is skipped, so the dropped index stays missing.
+    db_module.init_db()
+    assert not _sqlite_index_exists(db_module, index_name)
+
+    # Gate disabled: the full DDL runs again.
+    monkeypatch.setenv("SHEEP_INIT_DB_SCHEMA_GATE", "0")
+    db_module.init_db()
+    assert _sqlite_index_exists(db_module, index_name)
+    monkeypatch.delenv("SHEEP_INIT_DB_SCHEMA_GATE")
+
+    # Editing one DDL string inside _init_db_locked changes the fingerprint and forces a full run.
+    old_stmt = f"CREATE INDEX IF NOT EXISTS {index_name} ON mining_cycles(status, id)"
+    new_stmt = "CREATE INDEX IF NOT EXISTS idx_schema_gate_probe ON mining_cycles(status, id)"
+
+    original = db_module._init_db_locked
+    edited = _init_db_with_statement(db_module, old_stmt, new_stmt)
+    old_version = db_module._schema_version()
+    db_module._init_db_locked = edited
+    db_module._schema_version.cache_clear()
+    try:
+        new_version = db_module._schema_version()
+        assert new_version != old_version
+        db_module.init_db()
+        assert _sqlite_index_exists(db_module, "idx_schema_gate_probe")
+        conn = db_module._conn()
+        try:
+            assert db_module.get_setting(conn, db_module._SCHEMA_VERSION_KEY, "") == new_version
+        finally:
+            conn.close()
+    finally:
+        db_module._init_db_locked = original
+        db_module._schema_version.cache_clear()
+
+
+def test_init_db_does_not_record_schema_version_when_ddl_fails(admin_client):
+    db_module = admin_client["db"]
+    conn = db_module._conn()
+    try:
+        conn.execute("DELETE FROM settings WHERE key = ?", (db_module._SCHEMA_VERSION_KEY,))
+        conn.commit()
+    finally:
+        conn.close()
+    db_module._invalidate_settings_cache(db_module._SCHEMA_VERSION_KEY)
+
+    original = db_module._init_db_locked
+    db_module._init_db_locked = _init_db_with_statement(
+        db_module,
+        "CREATE INDEX IF NOT EXISTS idx_mining_cycles_status_id ON mining_cycles(status, id)",
+        "ALTER TABLE schema_gate_missing_table ADD COLUMN probe INTEGER",
+    )
+    db_module._schema_version.cache_clear()
+    try:
+        db_module.init_db()
+        conn = db_module._conn()
+        try:
+            # A failed statement leaves no fingerprint, so the next boot runs the DDL again.
+            assert db_module.get_setting(conn, db_module._SCHEMA_VERSION_KEY, None) is None
+            assert not db_module._schema_is_current(conn)
+        finally:
+            conn.close()
+    finally:
+        db_module._init_db_locked = original
+        db_module._schema_version.cache_clear()
+
+    db_module.init_db()
+    conn = db_module._conn()
+    try:
+        assert db_module._schema_is_current(conn)
+    finally:
+        conn.close()
+
+
+def test_init_db_backfills_payout_cycle_ids_when_schema_gate_is_current(admin_client):
+    db_module = admin_client["db"]
+    conn = db_module._conn()
+    try:
+        strategy_id = int(conn.execute("SELECT id FROM strategies ORDER BY id LIMIT 1").fetchone()[0])
+        # Older builds insert payouts without cycle_id.
+        payout_id = int(
+            conn.execute(
+                "INSERT INTO payouts (strategy_id, user_id, week_start_ts, amount_usdt, status, created_at) "
+                "VALUES (?, ?, ?, ?, 'unpaid', ?)",
+                (strategy_id, int(admin_client["user_id"]), "2026-01-05", 12.5, db_module._now_iso()),
+            ).lastrowid
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    db_module.init_db()
+
+    conn = db_module._conn()
+    try:
+        cycle_id = conn.execute("SELECT cycle_id FROM payouts WHERE id = ?", (payout_id,)).fetchone()[0]
+    finally:
+        conn.close()
+    assert int(cycle_id) == int(admin_client["cycle_id"])
+
+
+def test_fast_json_keeps_non_finite_floats_like_stdlib(admin_client):
+    db_module = admin_client["db"]
+    payload = {"phase": "running", "best": {"sharpe": float("nan"), "pf": float("inf")}, "curve": [1.5, float("-inf")]}
+
+    # orjson would write these as null; progress_json and metrics keep the json.dumps spelling.
+    assert db_module._fast_json_dumps(payload) == json.dumps(payload, ensure_ascii=False)
+    assert db_module._fast_json_line(payload) == (json.dumps(payload, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+    assert json.loads(db_module._fast_json_dumps({"a": None, "b": 1.0})) == {"a": None, "b": 1.0}
+
+
+def test_assign_tasks_batch_skips_partitions_taken_by_a_concurrent_assigner(admin_client):
+    db_module = admin_client["db"]
+    user_id = int(admin_client["user_id"])
+    cycle_id = int(admin_client["cycle_id"])
+    pool_id = int(admin_client["pool_id"])
+    now = db_module._now_iso()
+    conn = db_module._conn()
+    try:
+        conn.execute("UPDATE factor_pools SET active = 0 WHERE id <> ?", (pool_id,))
+        # Partitions 1-3 pass the per-cycle NOT EXISTS check but hit the unique index, like a racing assigner would.
+        conn.execute("CREATE UNIQUE INDEX idx_test_mining_tasks_pool_partition ON mining_tasks(pool_id, partition_idx)")
+        conn.executemany(
+            "INSERT INTO mining_tasks (user_id, pool_id, cycle_id, partition_idx, num_partitions, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, 8, 'assigned', ?, ?)",
+            [(user_id, pool_id, cycle_id + 1000, part, now, now) for part in (1, 2, 3)],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    db_module._invalidate_active_pool_cache(cycle_id)
+
+    db_module.assign_tasks_for_user(user_id, cycle_id=cycle_id, min_tasks=8, max_tasks=8)
+
+    conn = db_module._conn()
+    try:
+        parts = sorted(
+            int(r["partition_idx"])
+            for r in conn.execute(
+                "SELECT partition_idx FROM mining_tasks WHERE cycle_id = ? AND pool_id = ?",
+                (cycle_id, pool_id),
+            ).fetchall()
+        )
+    finally:
+        conn.close()
+    assert parts == [0, 4, 5, 6, 7]
+
+
+def test_worker_stats_snapshot_counts_queued_worker_events(admin_client):
+    db_module = admin_client["db"]
+    user_id = int(admin_client["user_id"])
+    db_module.insert_worker_event(user_id, "stats-worker", "task_finish_ok", {"task_id": 1})
+    db_module.insert_worker_event(user_id, "stats-worker", "task_finish_ok", {"task_id": 2})
+    db_module.insert_worker_event(user_id, "stats-worker", "task_finish_fail", {"task_id": 3})
+
+    # The events are still in the write-behind queue; the snapshot must count them anyway.
+    stats = db_module.get_worker_stats_snapshot(window_seconds=60)
+
+    assert stats["tasks_ok"] == 2
+    assert stats["tasks_fail"] == 1
+    assert stats["fail_rate"] == pytest.approx(1 / 3)
+
+
+def test_create_factor_pool_reuses_existing_targets_and_inserts_the_rest(admin_client):
+    db_module = admin_client["db"]
+    cycle_id = int(admin_client["cycle_id"])
+    spec = dict(
+        cycle_id=cycle_id,
+        name="Expand Pool",
+        symbol="ETH_USDT",
+        timeframe_min=15,
+        years=2,
+        family="expand_family",
+        grid_spec={"alpha": [1, 2]},
+        risk_spec={"max_leverage": 2},
+        num_partitions=4,
+        seed=11,
+        active=True,
+    )
+    single_id = db_module.create_factor_pool(**spec)[0]
+
+    expanded = db_module.create_factor_pool(**spec, auto_expand=True)
+    assert len(expanded) == 14
+    assert len(set(expanded)) == 14
+    # ETH_USDT is the second symbol and 15m the third timeframe of the expansion grid.
+    assert expanded[7 + 2] == single_id
+    assert db_module.create_factor_pool(**spec, auto_expand=True) == expanded
+
+    conn = db_module._conn()
+    try:
+        count = conn.execute(
+            "SELECT COUNT(*) FROM factor_pools WHERE cycle_id = ? AND family = ?",
+            (cycle_id, "expand_family"),
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    assert int(count) == 14
+
+
+def test_record_weekly_settlement_pays_once_and_disqualifies_ineligible(admin_client):
+    db_module = admin_client["db"]
+    user_id = int(admin_client["user_id"])
+    now = db_module._now_iso()
+    conn = db_module._conn()
+    try:
+        eligible_id = int(conn.execute("SELECT id FROM strategies ORDER BY id LIMIT 1").fetchone()[0])
+        ineligible_id = int(
+            conn.execute(
+                "INSERT INTO strategies (submission_id, user_id, pool_id, params_json, status, allocation_pct, note, created_at, expires_at) "
+                "VALUES (2, ?, ?, '{}', 'active', 5.0, 'weekly', ?, ?)",
+                (user_id, int(admin_client["pool_id"]), now, now),
+            ).lastrowid
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    week = ("2026-01-05T00:00:00+00:00", "2026-01-12T00:00:00+00:00")
+    payout_id = db_module.record_weekly_settlement(eligible_id, user_id, *week, 3.5, 4.0, 12, True, 25.0)
+    assert payout_id > 0
+    # Re-running the same week records another check but never a second payout.
+    assert db_module.record_weekly_settlement(eligible_id, user_id, *week, 3.5, 4.0, 12, True, 25.0) == 0
+    assert db_module.record_weekly_settlement(ineligible_id, user_id, *week, -2.0, 30.0, 3, False, 25.0) == 0
+
+    conn = db_module._conn()
+    try:
+        payouts = conn.execute(
+            "SELECT id, strategy_id, amount_usdt FROM payouts WHERE week_start_ts = ? ORDER BY id",
+            (week[0],),
+        ).fetchall()
+        statuses = {
+            int(r["id"]): str(r["status"])
+            for r in conn.execute(
+                "SELECT id, status FROM strategies WHERE id IN (?, ?)", (eligible_id, ineligible_id)
+            ).fetchall()
+        }
+        checks = conn.execute(
+            "SELECT strategy_id, eligible FROM weekly_checks WHERE week_start_ts = ? ORDER BY id", (week[0],)
+        ).fetchall()
+    finally:
+        conn.close()
+
+    assert [(int(p["id"]), int(p["strategy_id"]), float(p["amount_usdt"])) for p in payouts] == [(payout_id, eligible_id, 25.0)]
+    assert statuses == {eligible_id: "active", ineligible_id: "disqualified"}
+    assert [(int(c["strategy_id"]), int(c["eligible"])) for c in checks] == [
+        (eligible_id, 1),
+        (eligible_id, 1),
+        (ineligible_id, 0),
+    ]
+
+
+def test_clean_zombie_tasks_set_based_requeues_then_fails_after_four_attempts(admin_client, monkeypatch):
+    db_module = admin_client["db"]
+    user_id = int(admin_client["user_id"])
+    stale = "2026-01-01T00:00:00+00:00"
+    conn = db_module._conn()
+    try:
+        task_ids = {}
+        for part, attempt in ((2, 0), (3, 3)):
+            task_ids[attempt] = int(
+                conn.execute(
+                    "INSERT INTO mining_tasks (user_id, pool_id, cycle_id, partition_idx, num_partitions, status, attempt, "
+                    "progress_json, created_at, updated_at, last_heartbeat) VALUES (?, ?, ?, ?, 8, 'running', ?, ?, ?, ?, ?)",
+                    (
+                        user_id,
+                        int(admin_client["pool_id"]),
+                        int(admin_client["cycle_id"]),
+                        part,
+                        attempt,
+                        json.dumps({"phase": "running", "combos_done": 5, "combos_total": 10}),
+                        stale,
+                        stale,
+                        stale,
+                    ),
+                ).lastrowid
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+    def _rowwise_must_not_run(*_args, **_kwargs):
+        raise AssertionError("set-based zombie recycle fell back to the row-wise path")
+
+    monkeypatch.setattr(db_module, "_clean_zombie_tasks_rowwise", _rowwise_must_not_run)
+    assert db_module.clean_zombie_tasks(timeout_minutes=15) == 2
+
+    conn = db_module._conn()
+    try:
+        rows = {
+            int(r["id"]): dict(r)
+            for r in conn.execute(
+                "SELECT id, status, attempt, progress_json FROM mining_tasks WHERE id IN (?, ?)",
+                (task_ids[0], task_ids[3]),
+            ).fetchall()
+        }
+    finally:
+        conn.close()
+
+    requeued = rows[task_ids[0]]
+    requeued_progress = json.loads(requeued["progress_json"])
+    assert requeued["status"] == "assigned"
+    assert int(requeued["attempt"]) == 1
+    assert requeued_progress["phase"] == "queued"
+    assert requeued_progress["phase_msg"] == "requeued_after_timeout_attempt_1"
+    assert requeued_progress["last_error"] == "zombie_timeout"
+    assert requeued_progress["combos_done"] == 5
+
+    failed = rows[task_ids[3]]
+    failed_progress = json.loads(failed["progress_json"])
+    assert failed["status"] == "completed"
+    assert int(failed["attempt"]) == 4
+    assert failed_progress["phase"] == "error"
+    assert failed_progress["phase_msg"] == "task_failed"
+    assert failed_progress["last_error"] == "zombie_timeout"
+    assert failed_progress["combos_total"] == 10